@@ -1,56 +1,1171 @@
 #!/usr/bin/env python3
 
 import argparse
+import asyncio
+import copy
+import fnmatch
+import functools
 import glob
+import hashlib
+import inspect
+import json
+import logging
 import os
+import sqlite3
 import subprocess
 import sys
 import platform
 import math
 import string
 import random
+import shlex
+import shutil
+import signal
+import stat
+import struct
+import tempfile
+import threading
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from bisect import bisect_left
 from shutil import which
 
+
+# messages of the library (the command line prints INFO and above, see main)
+log = logging.getLogger('ffeasytool')
+log.addHandler(logging.NullHandler())
+
+
+class FFEasyToolError(Exception):
+    '''Base class of ffeasytool errors'''
+
+
+class BinaryNotFoundError(FFEasyToolError):
+    '''ffmpeg or ffprobe is not found'''
+
+
+class AudioTrackNotFoundError(FFEasyToolError):
+    '''Requested audio track does not exist in the file'''
+
+
+class TargetSizeTooSmallError(FFEasyToolError):
+    '''Target size can not hold the audio track and the container overhead'''
+
+
+class InvalidArgumentError(FFEasyToolError, ValueError):
+    '''Wrong size, time, step or number of outputs'''
+
+
+class FFmpegError(FFEasyToolError, subprocess.CalledProcessError):
+    '''ffmpeg exited with an error (returncode, cmd)'''
+
+
+# --------------------------------------------
+def get_cachedir():
+    '''Returns (and creates) the per-user cache directory of ffeasytool'''
+    if platform.system() == "Windows":
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    cachedir = os.path.join(base, 'ffeasytool')
+    os.makedirs(cachedir, exist_ok=True)
+    return cachedir
+
+
+# --------------------------------------------
+def get_cpucount():
+    '''Number of CPUs available to this process'''
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+class MediaInfo:
+    '''Parsed output of a single "ffprobe -show_format -show_streams" call'''
+
+    # --------------------------------------------
+    def __init__(self, data):
+        self.data = data
+        self.format = data.get('format', {})
+        self.streams = data.get('streams', [])
+        self.video = [s for s in self.streams if s.get('codec_type') == 'video']
+        self.audio = [s for s in self.streams if s.get('codec_type') == 'audio']
+
+    # --------------------------------------------
+    @property
+    def duration(self):
+        '''Container duration in seconds, falls back to the longest stream'''
+        try:
+            return float(self.format['duration'])
+        except (KeyError, ValueError):
+            durations = []
+            for stream in self.streams:
+                try:
+                    durations.append(float(stream['duration']))
+                except (KeyError, ValueError):
+                    pass
+            return max(durations, default=0.0)
+
+    # --------------------------------------------
+    @property
+    def start_time(self):
+        '''Container start time in seconds (ffmpeg -ss is relative to it)'''
+        try:
+            return float(self.format['start_time'])
+        except (KeyError, ValueError):
+            return 0.0
+
+    # --------------------------------------------
+    @property
+    def bit_rate(self):
+        '''Overall bitrate in bits per second or None'''
+        try:
+            return float(self.format['bit_rate'])
+        except (KeyError, ValueError):
+            return None
+
+    # --------------------------------------------
+    def videostream(self, n=0):
+        '''Returns n-th video stream (as ffprobe dict) or None'''
+        if n < len(self.video):
+            return self.video[n]
+        return None
+
+    # --------------------------------------------
+    def audiostream(self, track=1):
+        '''Returns audio stream by track number (starts from 1) or None'''
+        if track is not None and 0 < track <= len(self.audio):
+            return self.audio[track - 1]
+        return None
+
+    # --------------------------------------------
+    @property
+    def videocodec(self):
+        stream = self.videostream()
+        return stream.get('codec_name') if stream else None
+
+    # --------------------------------------------
+    @property
+    def framerate(self):
+        '''Frame rate of the first video stream as float (0.0 if unknown)'''
+        stream = self.videostream() or {}
+        for key in ('avg_frame_rate', 'r_frame_rate'):
+            num, _, den = stream.get(key, '0/0').partition('/')
+            try:
+                if float(den or 1) != 0 and float(num) != 0:
+                    return float(num) / float(den or 1)
+            except ValueError:
+                pass
+        return 0.0
+
+    # --------------------------------------------
+    @property
+    def resolution(self):
+        '''Returns tuple (width, height) of the first video stream as int'''
+        stream = self.videostream()
+        return int(stream['width']), int(stream['height'])
+
+    # --------------------------------------------
+    def audio_bit_rate(self, track=1):
+        '''Audio track bitrate in bits per second or None (ffprobe sometimes returns N/A)'''
+        stream = self.audiostream(track)
+        try:
+            return float(stream['bit_rate'])
+        except (TypeError, KeyError, ValueError):
+            return None
+
+
+class ProbeCache:
+    '''Persistent ffprobe results, keyed by path+size+mtime'''
+
+    # --------------------------------------------
+    def __init__(self, path=None):
+        if path is None:
+            path = os.path.join(get_cachedir(), 'probecache.sqlite')
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS probe (path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, data TEXT)')
+
+    # --------------------------------------------
+    @staticmethod
+    def _key(file):
+        st = os.stat(file)
+        return os.path.abspath(file), st.st_size, st.st_mtime_ns
+
+    # --------------------------------------------
+    def get(self, file):
+        '''Returns cached ffprobe data (dict) or None if file is new or changed'''
+        path, size, mtime = self._key(file)
+        with self._lock:
+            row = self._db.execute('SELECT data FROM probe WHERE path=? AND size=? AND mtime=?', (path, size, mtime)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    # --------------------------------------------
+    def put(self, file, data):
+        path, size, mtime = self._key(file)
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO probe VALUES (?, ?, ?, ?)', (path, size, mtime, json.dumps(data)))
+
+
+class MediaIndex:
+    '''Keyframe and packet index of the first video stream: keyframe timestamps (pts, seconds) and byte offsets,
+    packet timestamps and cumulative packet sizes (both sorted by pts). Saved as a header and plain arrays
+    (native doubles and int64), loaded without parsing: the arrays are views of the file bytes.'''
+
+    MAGIC = b'FFEIDX01'
+    HEADER = struct.Struct('<8s8sqqddqq') # magic, byte order, file size, file mtime (ns), start time, duration, keyframes, packets
+
+    # --------------------------------------------
+    def __init__(self, keytimes, keypositions, packettimes, packetbytes, start=0.0, duration=0.0, size=0, mtime=0):
+        self.keytimes = keytimes
+        self.keypositions = keypositions
+        self.packettimes = packettimes
+        self.packetbytes = packetbytes # packetbytes[i] - size of packets 0..i
+        self.start = start
+        self.duration = duration
+        self.size = size
+        self.mtime = mtime
+
+    # --------------------------------------------
+    @classmethod
+    def from_packets(cls, out, start=0.0, duration=0.0, size=0, mtime=0):
+        '''Builds index from "ffprobe -show_entries packet=pts_time,dts_time,size,pos,flags -of csv=p=0" output'''
+        keys = []
+        packets = []
+        for line in out.splitlines():
+            fields = line.split(',')
+            if len(fields) < 5:
+                continue
+            pts, dts, packetsize, pos, flags = fields[:5]
+            try:
+                timestamp = float(pts if pts not in ('', 'N/A') else dts)
+                packetsize = int(packetsize)
+            except ValueError:
+                continue
+            packets.append((timestamp, packetsize))
+            if 'K' in flags:
+                keys.append((timestamp, int(pos) if pos.lstrip('-').isdigit() else -1))
+        keys.sort()
+        packets.sort()
+        total = 0
+        packetbytes = array('q')
+        for timestamp, packetsize in packets:
+            total += packetsize
+            packetbytes.append(total)
+        return cls(array('d', [k[0] for k in keys]), array('q', [k[1] for k in keys]), array('d', [p[0] for p in packets]), packetbytes
+                   , start=start, duration=duration, size=size, mtime=mtime)
+
+    # --------------------------------------------
+    def save(self, path):
+        '''Writes index through a temporary file'''
+        temp = '{}.tmp-{}'.format(path, os.getpid())
+        with open(temp, 'wb') as f:
+            f.write(self.HEADER.pack(self.MAGIC, sys.byteorder.encode('ascii'), self.size, self.mtime, self.start, self.duration
+                                     , len(self.keytimes), len(self.packettimes)))
+            for values, typecode in ((self.keytimes, 'd'), (self.keypositions, 'q'), (self.packettimes, 'd'), (self.packetbytes, 'q')):
+                array(typecode, values).tofile(f)
+        os.replace(temp, path)
+
+    # --------------------------------------------
+    @classmethod
+    def load(cls, path, size=None, mtime=None):
+        '''Reads index file, returns None if there is no valid index (or it is made for another size/mtime of the media file).
+        The file is read at once and closed (not mapped): it can be replaced by save while the index is in use, also on Windows.'''
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        try:
+            magic, byteorder, filesize, filemtime, start, duration, nkeys, npackets = cls.HEADER.unpack_from(data)
+        except struct.error:
+            return None
+        if (magic != cls.MAGIC or byteorder.rstrip(b'\0') != sys.byteorder.encode('ascii')
+                or (size is not None and filesize != size) or (mtime is not None and filemtime != mtime)
+                or len(data) != cls.HEADER.size + 8 * (2 * nkeys + 2 * npackets)):
+            return None
+        arrays = []
+        offset = cls.HEADER.size
+        for count, typecode in ((nkeys, 'd'), (nkeys, 'q'), (npackets, 'd'), (npackets, 'q')):
+            arrays.append(memoryview(data)[offset:offset + 8 * count].cast(typecode))
+            offset += 8 * count
+        return cls(*arrays, start=start, duration=duration, size=filesize, mtime=filemtime)
+
+    # --------------------------------------------
+    def snap(self, timestamp, direction='before'):
+        '''Keyframe timestamp at or before (after, nearest) timestamp, None if there is no such keyframe'''
+        n = bisect_left(self.keytimes, timestamp)
+        if n < len(self.keytimes) and self.keytimes[n] == timestamp:
+            return timestamp
+        before = self.keytimes[n - 1] if n > 0 else None
+        after = self.keytimes[n] if n < len(self.keytimes) else None
+        if direction == 'before':
+            return before
+        if direction == 'after':
+            return after
+        candidates = [k for k in (before, after) if k is not None]
+        return min(candidates, key=lambda k: abs(k - timestamp)) if candidates else None
+
+    # --------------------------------------------
+    def position(self, timestamp):
+        '''Byte offset of the keyframe at or before timestamp (-1 if unknown)'''
+        n = bisect_left(self.keytimes, timestamp + 1e-9)
+        return self.keypositions[n - 1] if n > 0 else -1
+
+    # --------------------------------------------
+    def bitrate(self, start=None, end=None):
+        '''Video bitrate (bits per second) of packets with start <= pts < end (stream timestamps), by packet sizes'''
+        start = self.start if start is None else start
+        end = self.start + self.duration if end is None else end
+        if end <= start:
+            return 0.0
+        first = bisect_left(self.packettimes, start)
+        last = bisect_left(self.packettimes, end)
+        if last <= first:
+            return 0.0
+        packetbytes = self.packetbytes[last - 1] - (self.packetbytes[first - 1] if first > 0 else 0)
+        return packetbytes * 8 / (end - start)
+
+
+class Calibration:
+    '''Values learned from the previous runs (JSON file, path=None - keep in memory only)'''
+
+    # --------------------------------------------
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self.data = {}
+        if path is not None:
+            try:
+                with open(path, encoding='utf-8') as f:
+                    self.data = json.load(f)
+            except (OSError, ValueError):
+                pass
+
+    # --------------------------------------------
+    def get(self, section, key, default=None):
+        with self._lock:
+            return self.data.get(section, {}).get(key, default)
+
+    # --------------------------------------------
+    def items(self, section):
+        '''Returns list of (key, value) of a section'''
+        with self._lock:
+            return list(self.data.get(section, {}).items())
+
+    # --------------------------------------------
+    def put(self, section, key, value):
+        with self._lock:
+            self.data.setdefault(section, {})[key] = value
+            if self.path is None:
+                return
+            try:
+                tmpfile = '{}.tmp'.format(self.path)
+                with open(tmpfile, 'w', encoding='utf-8') as f:
+                    json.dump(self.data, f, indent=1)
+                os.replace(tmpfile, self.path)
+            except OSError as e:
+                log.warning('Calibration data is not saved: {}'.format(e))
+
+
+class ProgressReporter:
+    '''Parses "ffmpeg -progress" output and reports progress events: as a compact terminal line (mode='term') or as JSON lines (mode='json')'''
+
+    # --------------------------------------------
+    def __init__(self, mode='term', stream=None, interval=0.5):
+        self.mode = mode
+        self.stream = stream or (sys.stderr if mode == 'term' else sys.stdout)
+        self.interval = interval
+        self.jobs = {}
+        self._lock = threading.Lock()
+        self._lastline = 0.0
+        self._counter = 0
+        self._blocks = {}
+
+    # --------------------------------------------
+    def start(self, label, duration=None):
+        '''Registers a job, returns its id'''
+        with self._lock:
+            self._counter += 1
+            jobid = self._counter
+            self.jobs[jobid] = {'job': jobid, 'label': label, 'duration': duration, 'started': time.monotonic()}
+        self._emit({'event': 'start', 'job': jobid, 'label': label, 'duration': duration})
+        return jobid
+
+    # --------------------------------------------
+    def feed(self, jobid, line):
+        '''Takes one "key=value" line of ffmpeg -progress output, reports every complete block'''
+        key, _, value = line.strip().partition('=')
+        values = self._blocks.setdefault(jobid, {})
+        values[key] = value
+        if key == 'progress':
+            del self._blocks[jobid]
+            self.update(jobid, values)
+
+    # --------------------------------------------
+    def _seconds(self, value):
+        '''ffmpeg progress time (out_time: HH:MM:SS.micro) to seconds, None if it is not known yet (N/A)'''
+        try:
+            hours, minutes, seconds = value.split(':')
+            return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+        except ValueError:
+            return None
+
+    # --------------------------------------------
+    def update(self, jobid, values):
+        '''values - one block of "key=value" lines from ffmpeg -progress'''
+        job = self.jobs[jobid]
+        elapsed = time.monotonic() - job['started']
+        event = {'event': 'progress', 'job': jobid, 'label': job['label'], 'elapsed': round(elapsed, 3)}
+        try:
+            event['frame'] = int(values.get('frame', 0))
+            event['fps'] = float(values.get('fps', 0))
+        except ValueError:
+            pass
+        try:
+            event['size'] = int(values.get('total_size', 0))
+        except ValueError:
+            event['size'] = 0
+        outtime = self._seconds(values.get('out_time', ''))
+        speed = values.get('speed', '').rstrip('x').strip()
+        try:
+            event['speed'] = float(speed)
+        except ValueError:
+            event['speed'] = outtime / elapsed if outtime and outtime > 0 and elapsed > 0 else None
+        if outtime is not None and outtime >= 0:
+            event['out_time'] = round(outtime, 3)
+            duration = job['duration']
+            if duration and outtime > 0:
+                event['percent'] = round(min(100.0, outtime * 100 / duration), 1)
+                event['projected_size'] = int(event['size'] * duration / outtime)
+                if event['speed']:
+                    event['eta'] = round(max(0.0, (duration - outtime) / event['speed']), 1)
+        job.update(event)
+        if values.get('progress') == 'end':
+            return
+        self._emit(event)
+
+    # --------------------------------------------
+    def finish(self, jobid, returncode):
+        with self._lock:
+            job = self.jobs.pop(jobid)
+            self._blocks.pop(jobid, None)
+        self._emit({'event': 'end', 'job': jobid, 'label': job['label'], 'returncode': returncode
+                    , 'elapsed': round(time.monotonic() - job['started'], 3), 'size': job.get('size', 0)})
+
+    # --------------------------------------------
+    def _emit(self, event):
+        with self._lock:
+            if self.mode == 'json':
+                self.stream.write(json.dumps(event) + '\n')
+                self.stream.flush()
+                return
+            now = time.monotonic()
+            if event['event'] == 'progress' and now - self._lastline < self.interval:
+                return
+            self._lastline = now
+            parts = []
+            for job in self.jobs.values():
+                part = '{}: {}'.format(job['label'], '{}%'.format(job['percent']) if 'percent' in job else '{}s'.format(job.get('out_time', 0)))
+                if job.get('speed'):
+                    part += ' {:.2f}x'.format(job['speed'])
+                if 'eta' in job:
+                    part += ' ETA {}s'.format(int(job['eta']))
+                parts.append(part)
+            line = ' | '.join(parts)
+            columns = shutil.get_terminal_size().columns - 1
+            self.stream.write('\r{}'.format(line[:columns].ljust(columns)))
+            if event['event'] == 'end':
+                self.stream.write('\r{}\r'.format(' ' * columns))
+            self.stream.flush()
+
+
+class Result:
+    '''What a VideoTool operation did: status ("ok" or "skipped" - nothing to do or already done),
+    output files and wall time in seconds. Size and duration of the outputs are read on first use.'''
+
+    # --------------------------------------------
+    def __init__(self, operation, status, outputs=(), seconds=0.0, videotool=None):
+        self.operation = operation
+        self.status = status
+        self.outputs = list(outputs)
+        self.seconds = seconds
+        self._videotool = videotool
+
+    # --------------------------------------------
+    @property
+    def ok(self):
+        return self.status == 'ok'
+
+    # --------------------------------------------
+    @property
+    def output(self):
+        '''The first output file, None if there are no outputs'''
+        return self.outputs[0] if self.outputs else None
+
+    # --------------------------------------------
+    @property
+    def size(self):
+        '''Total size of the outputs in bytes'''
+        return sum(os.path.getsize(output) for output in self.outputs if os.path.exists(output))
+
+    # --------------------------------------------
+    @property
+    def duration(self):
+        '''Duration of the first output in seconds (ffprobe), None if there are no outputs'''
+        if self.output is None or self._videotool is None or not os.path.exists(self.output):
+            return None
+        return self._videotool.probe(self.output).duration
+
+    # --------------------------------------------
+    def __repr__(self):
+        return '<Result {} {} {} ({:.1f}s)>'.format(self.operation, self.status, self.outputs, self.seconds)
+
+
+class Estimate:
+    '''Dry run of a VideoTool operation (see VideoTool.get_plan): status ("planned", "skipped", "partial" - the next
+    commands depend on results of the listed ones, or "failed"), ffmpeg commands (Command) the operation would run,
+    estimated time in seconds and total output size in bytes (None - nothing learned for a command yet)'''
+
+    # --------------------------------------------
+    def __init__(self, operation, status, commands=(), seconds=None, size=None, message=''):
+        self.operation = operation
+        self.status = status
+        self.commands = list(commands)
+        self.seconds = seconds
+        self.size = size
+        self.message = message
+
+    # --------------------------------------------
+    def __repr__(self):
+        return '<Estimate {} {} {} commands, {}s, {} bytes>'.format(self.operation, self.status, len(self.commands), self.seconds, self.size)
+
+
+class Command:
+    '''One process of an operation plan: ffmpeg (result is True) or ffprobe with capture=True (result is its output).
+    outputs - files written through temporary names, renamed only when the process succeeds'''
+
+    # --------------------------------------------
+    def __init__(self, cmd, outputs=(), duration=None, capture=False):
+        self.cmd = cmd
+        self.outputs = list(outputs)
+        self.duration = duration
+        self.capture = capture
+
+
+class Parallel:
+    '''Several operation plans run at once (up to "workers"), result is the list of their results'''
+
+    # --------------------------------------------
+    def __init__(self, plans, workers):
+        self.plans = list(plans)
+        self.workers = max(1, workers)
+
+
+# operation name: VideoTool method (see operation)
+OPERATIONS = {}
+
+
+# --------------------------------------------
+def operation(plan):
+    '''Makes a blocking VideoTool method of an operation plan - a generator method, which yields Command and Parallel
+    and gets their results back. The method returns Result (see VideoTool._get_result).
+    The plan itself is kept as method.plan, the method is registered in OPERATIONS (see AsyncVideoTool).'''
+    @functools.wraps(plan)
+    def method(self, *args, **kwargs):
+        started = time.monotonic()
+        value = self._drive(plan(self, *args, **kwargs), timeout=self.timeout)
+        return self._get_result(plan, args, kwargs, value, started)
+    method.plan = plan
+    OPERATIONS[plan.__name__] = method
+    return method
+
+
 class VideoTool:
-    bins = {}
-
-    # --------------------------------------------
-    def __init__(self, ffmpeg='ffmpeg', ffprobe='ffprobe'):
-        self.bins['ffmpeg'] = which(ffmpeg)
-        self.bins['ffprobe'] = which(ffprobe)
-
-        # check bins
-        binsfailed = False
-        if self.bins['ffmpeg'] is None:
-            binsfailed = True
-            print("ffmpeg not found in PATH directory.")
-        if self.bins['ffprobe'] is None:
-            binsfailed = True
-            print("ffprobe not found in PATH directory.")
-        if binsfailed:
-            print('\nYou must install ffmpeg.')
-            if platform.system() == "Windows":
-                print(  '\nFOR WINDOWS:\n'
-                        'You can download ffmpeg from:\n'
-                        'https://github.com/GyanD/codexffmpeg/releases/\n'
-                        'Copy ffmpeg.exe and ffprobe.exe to one of this folders:\n'
-                        '{}'.format(os.environ['PATH']).replace(';',';\n'))
-            sys.exit(1)
+
+    X264PRESETS = ['ultrafast', 'superfast', 'veryfast', 'faster', 'fast', 'medium', 'slow', 'slower']
+
+    # bytes kept in the file caches (see _trim_cache), the least recently used files are removed above it
+    CACHELIMITS = {'normalized': 20 * 1024 ** 3, 'palettes': 64 * 1024 ** 2}
+
+    # --------------------------------------------
+    def __init__(self, ffmpeg='ffmpeg', ffprobe='ffprobe', probecache=True):
+        '''ffmpeg, ffprobe - names (looked up in PATH on first use, see bins) or paths of the binaries'''
+        self._binnames = {'ffmpeg': ffmpeg, 'ffprobe': ffprobe}
+        self._bins = None
+        self.threads = 0 # ffmpeg -threads per process, 0 - let ffmpeg decide
+        self.quiet = False # hide ffmpeg banner and stats (used when several processes share a terminal)
+        self.progress = None # ProgressReporter: ffmpeg runs with -progress and reports events to it
+        self.timeout = None # seconds for one operation (all its processes), None - no limit
+        self.preset = 'fast' # x264 preset
+        self.autopreset = None # (criterion, value) for _get_preset: ('speed', 1.0), ('ssim', 0.98) or ('psnr', 42.0)
+        self.keyint = None # seconds between keyframes of x264 outputs, None - chosen by x264 (at scene changes, up to 250 frames)
+        self.replaceable = set() # absolute paths of outputs overwritten without "-y" (made by ffeasytool before, see Manifest)
+        self.dryrun = False # operations only plan commands: no sample encodes, checkpoints or checks of outputs (see get_plan)
+        self.confirm_overwrite = None # callable(outfile) -> True to replace an existing output, None - FileExistsError is raised
+        self._statslock = threading.Lock()
+        self.reset_stats()
+        self._mediainfo = {}
+        self._indexes = {}
+        self._probecache = None
+        try:
+            self.calibration = Calibration(os.path.join(get_cachedir(), 'calibration.json'))
+        except OSError:
+            self.calibration = Calibration()
+        if probecache:
+            try:
+                self._probecache = ProbeCache(None if probecache is True else probecache)
+            except (OSError, sqlite3.Error) as e:
+                log.warning('Probe cache disabled: {}'.format(e))
 
     # --------------------------------------------
-    def _get_h264settings(self, quality):
+    @property
+    def bins(self):
+        '''Paths of ffmpeg and ffprobe, found once per instance. Raises BinaryNotFoundError.'''
+        if self._bins is None:
+            bins = {name: which(binary) for name, binary in self._binnames.items()}
+            missing = [name for name, path in bins.items() if path is None]
+            if missing:
+                message = '\n'.join('{} not found in PATH directory.'.format(name) for name in missing)
+                message += '\n\nYou must install ffmpeg.'
+                if platform.system() == "Windows":
+                    message += ('\n\nFOR WINDOWS:\n'
+                                'You can download ffmpeg from:\n'
+                                'https://github.com/GyanD/codexffmpeg/releases/\n'
+                                'Copy ffmpeg.exe and ffprobe.exe to one of this folders:\n'
+                                '{}'.format(os.environ['PATH']).replace(';',';\n'))
+                raise BinaryNotFoundError(message)
+            self._bins = bins
+        return self._bins
+
+    # --------------------------------------------
+    def _get_h264settings(self, quality, preset=None):
         '''returns common encoder settings'''
-        return [
+        cmd = [
             '-c:v', 'libx264'
             , '-sn'
             , '-crf', str(quality)
-            , '-preset', 'fast'
-            , '-g', '30'
-            , '-force_key_frames', 'expr:gte(t,n_forced*18)'
+            , '-preset', preset or self.preset
             , '-pix_fmt', 'yuv420p'
             ]
+        if self.keyint:
+            cmd += ['-force_key_frames', 'expr:gte(t,n_forced*{})'.format(self.keyint)]
+        return cmd
+
+    # --------------------------------------------
+    def _get_vp9settings(self, quality):
+        '''returns common vp9 encoder settings'''
+        return [
+            '-c:v', 'libvpx-vp9'
+            , '-row-mt', '1'
+            , '-crf', str(quality)
+            , '-b:v', '20M'
+            , '-auto-alt-ref', '0'
+            ]
+
+    # --------------------------------------------
+    def _get_preset(self, infile, quality):
+        '''Plan: returns x264 preset - self.preset or, with self.autopreset, the preset chosen
+        by sample encodes of infile (the choice is stored per host, resolution class, threads and criterion)'''
+        if not self.autopreset:
+            return self.preset
+        name, target = self.autopreset
+        resolutionclass = self._get_resolutionclass(*self._get_resolution(infile))
+        key = '{} {}p threads={} {}>={}'.format(platform.node(), resolutionclass, self.threads or get_cpucount(), name, target)
+        preset = self.calibration.get('preset', key)
+        if preset is None and self.dryrun:
+            # chosen by sample encodes at run time
+            return self.preset
+        if preset is None:
+            results = yield from self._measure_presets(infile, quality, name, target)
+            if name == 'speed':
+                # the slowest preset fast enough, or the fastest one
+                fastenough = [r for r in results if r['speed'] >= target]
+                chosen = fastenough[-1] if fastenough else results[0]
+            else:
+                # the fastest preset good enough, or the best one
+                goodenough = [r for r in results if r[name] >= target]
+                chosen = goodenough[0] if goodenough else max(results, key=lambda r: r[name])
+            preset = chosen['preset']
+            self._info('x264 preset for {}p ({}>={}): {} ({:.2f}x realtime, SSIM {:.4f}, PSNR {:.2f})'.format(
+                  resolutionclass, name, target, preset, chosen['speed'], chosen['ssim'], chosen['psnr']))
+            self.calibration.put('preset', key, preset)
+        return preset
+
+    # --------------------------------------------
+    def _get_resolutionclass(self, width, height):
+        '''Resolution class of calibration keys: the smallest of 360p, 480p, ... 4320p not less than the smaller side'''
+        return next((c for c in (360, 480, 720, 1080, 1440, 2160) if min(width, height) <= c), 4320)
+
+    # --------------------------------------------
+    def _measure_presets(self, infile, quality, name, target, samplelength=5):
+        '''Plan: encodes a sample from the middle of infile with presets from the fastest to the slowest one,
+        returns list of {'preset', 'speed' (realtime factor), 'ssim', 'psnr'}. Stops when the criterion can not be met better.'''
+        duration = self.probe(infile).duration
+        length = min(samplelength, duration) or samplelength
+        start = max(0.0, duration / 2 - length / 2)
+        rangecmd = ['-ss', '{:.6f}'.format(start), '-t', '{:.6f}'.format(length)]
+        even = 'scale=trunc(iw/2)*2:trunc(ih/2)*2'
+        workdir = self._get_workdir(prefix='tmp-presets-')
+        results = []
+        try:
+            # startup baseline: process start, probing and seeking are not encoding time (they would dominate a short sample)
+            cmd = [self.bins['ffmpeg'], '-y']
+            cmd += rangecmd[:2]
+            cmd += ['-i', infile, '-map', '0:v:0', '-frames:v', '1', '-f', 'null', '-']
+            started = time.monotonic()
+            yield Command(cmd)
+            startup = time.monotonic() - started
+            for preset in self.X264PRESETS:
+                samplefile = os.path.join(workdir, '{}.mp4'.format(preset))
+                cmd = [self.bins['ffmpeg'], '-y']
+                cmd += rangecmd[:2]
+                cmd += ['-i', infile]
+                cmd += rangecmd[2:]
+                # passthrough: no duplicated frames at the start, the sample is compared frame by frame
+                cmd += ['-map', '0:v:0', '-an', '-vf', even, '-fps_mode', 'passthrough']
+                cmd += self._get_h264settings(quality, preset)
+                cmd += self._get_threadsettings()
+                cmd += [samplefile]
+                started = time.monotonic()
+                yield Command(cmd)
+                speed = length / max(time.monotonic() - started - startup, 0.001)
+
+                # ffmpeg's own metrics, per frame stats are averaged
+                ssimlog = os.path.join(workdir, '{}.ssim'.format(preset))
+                psnrlog = os.path.join(workdir, '{}.psnr'.format(preset))
+                escape = lambda path: path.replace('\\', '/').replace(':', '\\\\:')
+                cmd = [self.bins['ffmpeg'], '-y', '-i', samplefile]
+                cmd += rangecmd
+                cmd += ['-i', infile]
+                cmd += [
+                    '-filter_complex', '[1:v]{even},setpts=PTS-STARTPTS[ref];[0:v]setpts=PTS-STARTPTS,split[d0][d1];[ref]split[r0][r1];[d0][r0]ssim=stats_file={ssim}[s];[d1][r1]psnr=stats_file={psnr}[p]'.format(
+                        even=even, ssim=escape(ssimlog), psnr=escape(psnrlog))
+                    , '-map', '[s]'
+                    , '-map', '[p]'
+                    , '-f', 'null', '-'
+                    ]
+                yield Command(cmd)
+                results.append({'preset': preset, 'speed': speed, 'ssim': self._get_statsmean(ssimlog, 'All:'), 'psnr': self._get_statsmean(psnrlog, 'psnr_avg:')})
+                if name == 'speed' and speed < target:
+                    break
+                if name != 'speed' and results[-1][name] >= target:
+                    break
+        finally:
+            self._remove_workdir(workdir)
+        return results
+
+    # --------------------------------------------
+    def _get_statsmean(self, statsfile, field):
+        '''Mean of "field" values (ex. "All:0.98") in ssim/psnr filter stats file'''
+        values = []
+        with open(statsfile, encoding='utf-8') as f:
+            for line in f:
+                for item in line.split():
+                    if item.startswith(field):
+                        try:
+                            values.append(min(float(item[len(field):]), 100.0)) # psnr of identical frames is inf
+                        except ValueError:
+                            pass
+        return sum(values) / len(values) if values else 0.0
+
+    # --------------------------------------------
+    def _get_threadsettings(self, threads=None):
+        '''returns per-process thread cap (see JobScheduler)'''
+        if threads is None:
+            threads = self.threads
+        if threads:
+            return ['-threads', str(threads)]
+        return []
+
+    # --------------------------------------------
+    def _get_result(self, plan, args, kwargs, value, started):
+        '''Result of an operation plan. The plan returns False or None if it did nothing, True or the list of written files.
+        Outputs are this list or the "outfile"/"outfiles" arguments of the plan.'''
+        if value is False or value is None:
+            return Result(plan.__name__, 'skipped', seconds=time.monotonic() - started, videotool=self)
+        if isinstance(value, list):
+            outputs = value
+        else:
+            arguments = inspect.signature(plan).bind(self, *args, **kwargs)
+            arguments.apply_defaults()
+            outputs = arguments.arguments.get('outfile', arguments.arguments.get('outfiles')) or []
+            if isinstance(outputs, str):
+                outputs = [outputs]
+        return Result(plan.__name__, 'ok', outputs, time.monotonic() - started, videotool=self)
+
+    # --------------------------------------------
+    def _run(self, cmd, duration=None):
+        '''Runs ffmpeg, returns True or raises FFmpegError.
+        duration (of the output, for ETA) is taken from -t or from the input file if not set.'''
+        return self._run_command(Command(cmd, duration=duration))
+
+    # --------------------------------------------
+    def _drive(self, plan, timeout=None, deadline=None):
+        '''Runs an operation plan with blocking calls (Parallel plans in threads), returns its result.
+        Errors of processes are raised inside the plan, so its "finally" cleanup always runs.'''
+        if deadline is None and timeout is not None:
+            deadline = time.monotonic() + timeout
+        result, error = None, None
+        while True:
+            try:
+                request = plan.send(result) if error is None else plan.throw(error)
+            except StopIteration as e:
+                return e.value
+            result, error = None, None
+            try:
+                if isinstance(request, Parallel):
+                    result = self._parallel(self._drive, [(subplan, None, deadline) for subplan in request.plans], request.workers)
+                else:
+                    result = self._run_command(request, deadline)
+            except BaseException as e:
+                error = e
+
+    # --------------------------------------------
+    def _drive_dry(self, plan, commands):
+        '''Runs an operation plan without ffmpeg (see get_plan): ffmpeg commands are added to "commands" and succeed,
+        ffprobe runs as usual'''
+        result, error = None, None
+        while True:
+            try:
+                request = plan.send(result) if error is None else plan.throw(error)
+            except StopIteration as e:
+                return e.value
+            result, error = None, None
+            try:
+                if isinstance(request, Parallel):
+                    # all parallel plans are listed even if one of them needs results of its commands
+                    result, errors = [], []
+                    for subplan in request.plans:
+                        try:
+                            result.append(self._drive_dry(subplan, commands))
+                        except OSError as e:
+                            result.append(None)
+                            errors.append(e)
+                    if errors:
+                        raise errors[0]
+                elif request.capture:
+                    result = self._run_command(request)
+                else:
+                    commands.append(request)
+                    result = True
+            except BaseException as e:
+                error = e
+
+    # --------------------------------------------
+    def _get_planner(self):
+        '''Dry run context of get_plan: a twin with the same binaries, settings and calibration, but its own probe results,
+        indexes, replaceable outputs and stats, so planning never changes this instance'''
+        planner = copy.copy(self)
+        planner.dryrun = True
+        planner.progress = None
+        planner.confirm_overwrite = None
+        planner.replaceable = set(self.replaceable)
+        planner._mediainfo = dict(self._mediainfo)
+        planner._indexes = dict(self._indexes)
+        planner._statslock = threading.Lock()
+        planner.reset_stats()
+        return planner
+
+    # --------------------------------------------
+    def get_plan(self, method, *args, **kwargs):
+        '''Dry run of an operation (ex. get_plan(VideoTool.convert_to_x264, 'in.mkv', outfile='out.mp4')): probes the inputs
+        and returns Estimate with the ffmpeg commands the operation would run, nothing is encoded or written.
+        Time and size of every command are estimated from the calibration of the previous runs on this host (see _learn_speed).'''
+        planner = self._get_planner()
+        plan = method.plan
+        commands = []
+        status, message = 'planned', ''
+        try:
+            value = planner._drive_dry(plan(planner, *args, **kwargs), commands)
+            if value is False or value is None:
+                status = 'skipped'
+        except OSError as e:
+            # ex. sizes of encoded samples decide the next commands
+            status, message = 'partial', str(e)
+        seconds, size = 0.0, 0
+        for request in commands:
+            commandseconds, commandsize = planner._estimate_command(request)
+            seconds = None if seconds is None or commandseconds is None else seconds + commandseconds
+            size = None if size is None or commandsize is None else size + commandsize
+        return Estimate(plan.__name__, status, commands, seconds, size, message)
+
+    # --------------------------------------------
+    def _get_speedkey(self, cmd):
+        '''Calibration key of ffmpeg command: "codec preset quality resolutionclass threads".
+        Codec is the video encoder, the audio encoder of audio only outputs or the output format (gif, png)'''
+        def value(option, default='-'):
+            # the last one wins as in ffmpeg
+            return cmd[len(cmd) - cmd[::-1].index(option)] if option in cmd else default
+        if '-c:v' in cmd:
+            codec = value('-c:v')
+        elif '-c:a' in cmd:
+            codec = value('-c:a')
+        else:
+            codec = os.path.splitext(cmd[-1])[1].lstrip('.') or '-'
+        if '-crf' in cmd:
+            quality = 'crf{:.0f}'.format(float(value('-crf')))
+        elif '-pass' in cmd:
+            quality = 'pass{}'.format(value('-pass'))
+        elif '-q:a' in cmd:
+            quality = 'q{}'.format(value('-q:a'))
+        else:
+            quality = '-'
+        resolutionclass = '-'
+        n = cmd.index('-i') if '-i' in cmd else 0
+        if n and not (n > 1 and cmd[n - 2] == '-f'):
+            try:
+                info = self.probe(cmd[n + 1])
+                resolutionclass = '{}p'.format(self._get_resolutionclass(*info.resolution)) if info.videostream() else 'audio'
+            except (OSError, subprocess.CalledProcessError, FFEasyToolError):
+                pass
+        return '{} {} {} {} threads={}'.format(codec, value('-preset'), quality, resolutionclass, value('-threads', self.threads or get_cpucount()))
+
+    # --------------------------------------------
+    def _learn_speed(self, request, seconds):
+        '''Stores speed (seconds of output per second) and bitrate (bytes of outputs per second) of a finished ffmpeg command
+        for estimates of get_plan. Values are averaged over the last 10 or so runs with the same key (see _get_speedkey)'''
+        try:
+            duration = request.duration or self._get_cmdduration(request.cmd)
+        except subprocess.CalledProcessError:
+            return
+        if not duration or seconds <= 0:
+            return
+        key = self._get_speedkey(request.cmd)
+        entry = dict(self.calibration.get('speed', key) or {'runs': 0})
+        sample = {'speed': duration / seconds}
+        outputs = [output for output in request.outputs if os.path.exists(output)]
+        if outputs:
+            sample['bitrate'] = sum(os.path.getsize(output) for output in outputs) / duration
+        runs = min(entry['runs'], 9)
+        for name, value in sample.items():
+            entry[name] = (entry[name] * runs + value) / (runs + 1) if name in entry else value
+        entry['runs'] += 1
+        self.calibration.put('speed', key, entry)
+
+    # --------------------------------------------
+    def _get_calibrated(self, key):
+        '''Learned speed/bitrate of command key: the same key or, if there is nothing, the same codec
+        and resolution class with other settings (the most runs)'''
+        entry = self.calibration.get('speed', key)
+        if entry is not None:
+            return entry
+        codec, preset, quality, resolutionclass, threads = key.split(' ')
+        similar = [entry for otherkey, entry in self.calibration.items('speed') if otherkey.split(' ')[0] == codec and otherkey.split(' ')[3] == resolutionclass]
+        return max(similar, key=lambda entry: entry['runs'], default=None)
+
+    # --------------------------------------------
+    def _estimate_command(self, request):
+        '''Returns (seconds, bytes) estimated for Command, None - unknown'''
+        cmd = request.cmd
+        duration = request.duration or self._get_cmdduration(cmd)
+        if duration is None:
+            # joins encoded parts (concat list): stream copy, the parts are counted
+            return 0.0, 0
+        entry = self._get_calibrated(self._get_speedkey(cmd))
+        seconds = duration / entry['speed'] if entry is not None else None
+        if cmd[-1] in ('/dev/null', 'NUL', '-'):
+            return seconds, 0
+        if '-b:v' in cmd and '-crf' not in cmd:
+            # the bitrate is given (bits per second: "800k", "2M")
+            def bitrate(option):
+                if option not in cmd:
+                    return 0
+                text = cmd[cmd.index(option) + 1]
+                multiplier = {'k': 1000, 'K': 1000, 'M': 1000 ** 2}.get(text[-1:], 1)
+                return float(text[:-1] if multiplier != 1 else text) * multiplier
+            return seconds, math.ceil((bitrate('-b:v') + bitrate('-b:a')) * duration / 8)
+        if entry is None or 'bitrate' not in entry:
+            return seconds, None
+        return seconds, math.ceil(entry['bitrate'] * duration)
+
+    # --------------------------------------------
+    def _run_command(self, request, deadline=None):
+        '''Runs Command, returns True (ffprobe output for capture=True). Raises FFmpegError
+        or subprocess.TimeoutExpired after deadline (time.monotonic()) - the process is killed then.'''
+        if request.capture:
+            return self._run_ffprobe(request.cmd, deadline)
+        cmd, temps = self._get_tempoutputs(request, ask=True)
+        cmd = self._get_quietcmd(cmd)
+        stdout = None
+        jobid = None
+        if self.progress:
+            jobid = self.progress.start(self._get_cmdlabel(request.cmd), request.duration or self._get_cmdduration(request.cmd))
+            cmd = cmd[:1] + ['-progress', 'pipe:1'] + cmd[1:]
+            stdout = subprocess.PIPE
+        started = time.monotonic()
+        proc = None
+        timer = None
+        expired = threading.Event()
+
+        def kill():
+            expired.set()
+            self._terminate(proc, force=True)
+
+        try:
+            proc = subprocess.Popen(cmd, stdout=stdout, universal_newlines=True)
+            if deadline is not None:
+                timer = threading.Timer(max(0.0, deadline - started), kill)
+                timer.start()
+            if stdout:
+                for line in proc.stdout:
+                    self.progress.feed(jobid, line)
+            self._wait(proc, started)
+        except BaseException:
+            if proc is not None and proc.returncode is None:
+                self._terminate(proc, force=True)
+                proc.wait()
+            self._remove_files(temp for temp, outfile in temps)
+            raise
+        finally:
+            if timer is not None:
+                timer.cancel()
+            if jobid is not None:
+                self.progress.finish(jobid, proc.returncode if proc else None)
+        if expired.is_set():
+            self._remove_files(temp for temp, outfile in temps)
+            raise subprocess.TimeoutExpired(request.cmd, time.monotonic() - started)
+        result = self._commit_outputs(request.cmd, proc.returncode, temps)
+        self._learn_speed(request, time.monotonic() - started)
+        return result
+
+    # --------------------------------------------
+    def _get_quietcmd(self, cmd):
+        '''adds options hiding ffmpeg banner and stats (if needed)'''
+        if self.quiet or self.progress:
+            return cmd[:1] + ['-hide_banner', '-nostdin', '-nostats', '-loglevel', 'error'] + cmd[1:]
+        return cmd
+
+    # --------------------------------------------
+    def _info(self, message):
+        '''Status message of an operation (logged at INFO), a dry run has none'''
+        if not self.dryrun:
+            log.info(message)
+
+    # --------------------------------------------
+    def _get_cmdlabel(self, cmd):
+        '''Job name for progress reports: output file name'''
+        if cmd[-1] in ('/dev/null', 'NUL'):
+            return '{} (analysis)'.format(os.path.basename(cmd[cmd.index('-i') + 1]))
+        return os.path.basename(cmd[-1])
+
+    # --------------------------------------------
+    def _get_tempoutputs(self, request, ask=False):
+        '''Replaces Command outputs with temporary names in the same directories, returns (cmd, [(tempfile, outfile)]).
+        Existing outputs are overwritten with "-y" only, without it confirm_overwrite is asked (if "ask"), or FileExistsError is raised.'''
+        cmd = list(request.cmd)
+        temps = []
+        for outfile in request.outputs:
+            if os.path.exists(outfile) and '-y' not in cmd and os.path.abspath(outfile) not in self.replaceable:
+                if not (ask and not self.quiet and self.confirm_overwrite is not None and self.confirm_overwrite(outfile)):
+                    raise FileExistsError('File "{}" already exists.'.format(outfile))
+            directory, name = os.path.split(os.path.abspath(outfile))
+            temp = os.path.join(directory, 'tmp-{}-{}'.format(''.join(random.choices(string.ascii_uppercase + string.digits, k=6)), name))
+            cmd[len(cmd) - 1 - cmd[::-1].index(outfile)] = temp
+            temps.append((temp, outfile))
+        return cmd, temps
+
+    # --------------------------------------------
+    def _commit_outputs(self, cmd, returncode, temps):
+        '''Renames temporary outputs of a finished process to their names, or removes them and raises FFmpegError'''
+        if returncode != 0:
+            self._remove_files(temp for temp, outfile in temps)
+            raise FFmpegError(returncode, cmd)
+        for temp, outfile in temps:
+            os.replace(temp, outfile)
+        return True
+
+    # --------------------------------------------
+    def _remove_files(self, files):
+        for file in files:
+            try:
+                os.remove(file)
+            except OSError:
+                pass
+
+    # --------------------------------------------
+    @staticmethod
+    def _terminate(proc, force=False, group=False):
+        '''Stops the process (SIGTERM, SIGKILL with force), group - the whole process group of a process started in a new session'''
+        try:
+            if group and os.name == 'posix':
+                os.killpg(proc.pid, signal.SIGKILL if force else signal.SIGTERM)
+            elif force:
+                proc.kill()
+            else:
+                proc.terminate()
+        except OSError:
+            pass
+
+    # --------------------------------------------
+    def _wait(self, proc, started):
+        '''Waits for ffmpeg process and adds its time and peak memory to self.stats'''
+        maxrss = 0
+        if hasattr(os, 'wait4'):
+            pid, status, rusage = os.wait4(proc.pid, 0)
+            proc.returncode = os.waitstatus_to_exitcode(status)
+            maxrss = rusage.ru_maxrss # Kb on Linux
+        else:
+            proc.wait()
+        self._add_stats('ffmpeg', started, maxrss)
+
+    # --------------------------------------------
+    def _add_stats(self, binary, started, maxrss=0):
+        with self._statslock:
+            self.stats['{}_calls'.format(binary)] += 1
+            self.stats['{}_time'.format(binary)] += time.monotonic() - started
+            if maxrss:
+                self.stats['ffmpeg_maxrss'] = max(self.stats['ffmpeg_maxrss'], maxrss)
+
+    # --------------------------------------------
+    def _run_ffprobe(self, cmd, deadline=None):
+        '''Runs ffprobe, returns its output (time is added to self.stats)'''
+        started = time.monotonic()
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        try:
+            out, err = proc.communicate(timeout=None if deadline is None else max(0.0, deadline - started))
+        except BaseException:
+            self._terminate(proc, force=True)
+            proc.wait()
+            raise
+        finally:
+            self._add_stats('ffprobe', started)
+        return out
+
+    # --------------------------------------------
+    def reset_stats(self):
+        '''Resets counters of ffmpeg/ffprobe calls, their time and ffmpeg peak memory'''
+        with self._statslock:
+            self.stats = {'ffprobe_calls': 0, 'ffprobe_time': 0.0, 'ffmpeg_calls': 0, 'ffmpeg_time': 0.0, 'ffmpeg_maxrss': 0}
+
+    # --------------------------------------------
+    def _get_cmdduration(self, cmd):
+        '''Output duration of ffmpeg command: -t value or duration of the first input (minus -ss)'''
+        if '-t' in cmd:
+            try:
+                return float(cmd[cmd.index('-t') + 1])
+            except ValueError:
+                return None
+        if '-i' not in cmd:
+            return None
+        n = cmd.index('-i')
+        if n > 1 and cmd[n - 2] == '-f':
+            return None # concat lists, lavfi
+        try:
+            duration = self.probe(cmd[n + 1]).duration
+        except OSError:
+            return None
+        if '-ss' in cmd[:n]:
+            duration -= self._parse_timestamp(cmd[cmd.index('-ss') + 1])
+        return duration or None
+
     # --------------------------------------------
-    
     def _get_audiocodec(self, codec='libvorbis'):
         '''returns common audio encoder settings'''
         return [
@@ -68,41 +1183,340 @@ class VideoTool:
         return pxls
     
     # --------------------------------------------
-    def _there_is_audio(self, file, audiotrack=None, wrongtrackexit=False):
-        ''' Checks if audio exists, returns cmd params with stream number. Returns False or calls sys.exit if no track exists. '''
-        cmd = [
+    def probe(self, file) -> MediaInfo:
+        '''Runs ffprobe once per file (results are cached in memory and on disk), returns MediaInfo'''
+        info = self._get_probed(file)
+        if info is None:
+            info = self._set_probed(file, self._run_ffprobe(self._get_probecmd(file)))
+        return info
+
+    # --------------------------------------------
+    def _get_probecmd(self, file):
+        return [
             self.bins['ffprobe']
-            , '-i', infile
+            , '-v', 'error'
+            , '-show_format'
             , '-show_streams'
-            , '-select_streams', 'a:{}'.format(str(audiotrack - 1))
-            , '-loglevel', 'error'
+            , '-show_data_hash', 'sha256' # extradata_hash: parameter sets (see _can_concat)
+            , '-of', 'json'
+            , file
             ]
-        out, err = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True).communicate()
-        if len(out.strip()) > 1:
+
+    # --------------------------------------------
+    def _get_probed(self, file):
+        '''Returns MediaInfo from the memory or disk cache, None if the file is not probed yet'''
+        # keyed like ProbeCache: a replaced file is probed again
+        try:
+            key = ProbeCache._key(file)
+        except OSError:
+            return None
+        if key in self._mediainfo:
+            return self._mediainfo[key]
+        data = None
+        if self._probecache is not None:
+            try:
+                data = self._probecache.get(file)
+            except (OSError, sqlite3.Error):
+                data = None
+        if data is None:
+            return None
+        info = MediaInfo(data)
+        self._mediainfo[key] = info
+        return info
+
+    # --------------------------------------------
+    def _set_probed(self, file, out):
+        '''Caches ffprobe JSON output, returns MediaInfo'''
+        try:
+            data = json.loads(out)
+        except ValueError:
+            data = {}
+        if data.get('format') and self._probecache is not None:
+            try:
+                self._probecache.put(file, data)
+            except (OSError, sqlite3.Error):
+                pass
+        info = MediaInfo(data)
+        try:
+            self._mediainfo[ProbeCache._key(file)] = info
+        except OSError:
+            pass
+        return info
+
+    # --------------------------------------------
+    def _there_is_audio(self, file, audiotrack=None, wrongtrackexit=False):
+        ''' Checks if audio exists, returns cmd params with stream number. Returns False or raises AudioTrackNotFoundError (wrongtrackexit) if no track exists. '''
+        if audiotrack is None: audiotrack = 1
+        if self.probe(file).audiostream(audiotrack) is not None:
             return([ '-map',  '0:a:{}'.format(str(audiotrack-1))])
+        elif wrongtrackexit:
+            raise AudioTrackNotFoundError('Audio track not found: #{} in "{}"'.format(audiotrack, file))
         else:
-            print("Audio track not found: #{}".format(str(audiotrack)))
-            if wrongtrackexit:
-                sys.exit(1)
-            else:
-                return(False)
-        
+            log.warning("Audio track not found: #{}".format(str(audiotrack)))
+            return(False)
+
     # --------------------------------------------
     def _get_resolution(self, file):
         '''Returns tuple  (width, height) as int'''
-        cmd = [self.bins['ffprobe']
-                , '-v'
-                , 'error'
-                , '-select_streams'
-                , 'v:0'
-                , '-show_entries'
-                , 'stream=width,height'
-                , '-of'
-                , 'csv=s=x:p=0'
-                , file]
-        out, err = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True).communicate()
-        width, height = out.split('x')
-        return( int(width),  int(height) )
+        return self.probe(file).resolution
+
+    # --------------------------------------------
+    def _parse_size(self, targetsize):
+        '''"1024", "1K", "1M", "1G" to (bytes, units)'''
+        sizeerror='Use size format: 1024 - 1024 bytes, 1K - 1 kilobyte, 1M - 1 megabyte, 1G - 1 gigabyte'
+        targetsize = targetsize.strip()
+        multipliers = {'K': (1024, 'Kb'), 'M': (1024 ** 2, 'Mb'), 'G': (1024 ** 3, 'Gb')}
+        multiplier, sizein = multipliers.get(targetsize[-1:], (1, 'B'))
+        try:
+            return int(targetsize[:-1] if multiplier != 1 else targetsize) * multiplier, sizein
+        except Exception as e:
+            raise InvalidArgumentError('{}\n\n{}.'.format(e, sizeerror))
+
+    # --------------------------------------------
+    def _parse_timestamp(self, timestamp):
+        '''[HH:][MM:]SS[.mmm] to seconds'''
+        seconds = 0.0
+        for part in str(timestamp).split(':'):
+            seconds = seconds * 60 + float(part)
+        return seconds
+
+    # --------------------------------------------
+    def _remove_passlogs(self, ffmpeglogname):
+        '''removes x264 two-pass stats files'''
+        for logfile in glob.glob('{}-*.log*'.format(ffmpeglogname)):
+            try:
+                os.remove(logfile)
+            except OSError:
+                pass
+
+    # --------------------------------------------
+    def _get_keyframes(self, file):
+        '''Plan: returns sorted list of video keyframe timestamps (pts, seconds)'''
+        index = yield from self._get_index(file)
+        return list(index.keytimes)
+
+    # --------------------------------------------
+    def _get_indexpath(self, file):
+        '''Index file of a media file: in the cache directory (media directories may be read-only or watched)'''
+        key = hashlib.sha1(os.path.abspath(file).encode('utf-8')).hexdigest()
+        try:
+            indexdir = os.path.join(get_cachedir(), 'index')
+            os.makedirs(indexdir, exist_ok=True)
+        except OSError:
+            indexdir = tempfile.gettempdir()
+        return os.path.join(indexdir, '{}.idx'.format(key))
+
+    # --------------------------------------------
+    def _get_index(self, file):
+        '''Plan: returns MediaIndex of file. The file is scanned (ffprobe packet list of the first video stream, no decoding)
+        only once: the index is kept in memory and in the index file until the size or mtime of the media file changes'''
+        stat = os.stat(file)
+        path = os.path.abspath(file)
+        index = self._indexes.get(path)
+        if index is not None and (index.size, index.mtime) == (stat.st_size, stat.st_mtime_ns):
+            return index
+        indexpath = self._get_indexpath(file)
+        index = MediaIndex.load(indexpath, size=stat.st_size, mtime=stat.st_mtime_ns)
+        if index is None:
+            cmd = [
+                self.bins['ffprobe']
+                , '-v', 'error'
+                , '-select_streams', 'v:0'
+                , '-show_entries', 'packet=pts_time,dts_time,size,pos,flags'
+                , '-of', 'csv=p=0'
+                , file
+                ]
+            out = yield Command(cmd, capture=True)
+            info = self.probe(file)
+            index = MediaIndex.from_packets(out, start=info.start_time, duration=info.duration, size=stat.st_size, mtime=stat.st_mtime_ns)
+            try:
+                index.save(indexpath)
+            except OSError as e:
+                log.warning('Index is not saved: {}'.format(e))
+        self._indexes[path] = index
+        return index
+
+    # --------------------------------------------
+    def get_index(self, file) -> MediaIndex:
+        '''Returns MediaIndex of file (keyframes, byte offsets, packet sizes), see _get_index'''
+        return self._drive(self._get_index(file), timeout=self.timeout)
+
+    # --------------------------------------------
+    def _get_chunks(self, file, chunks):
+        '''Plan: splits file into (about) equal parts at keyframes.
+        Returns list of (start, duration) for _get_rangesettings: duration of the last chunk is None'''
+        info = self.probe(file)
+        keyframes = yield from self._get_keyframes(file)
+        if not keyframes:
+            return [(None, None)]
+        first = keyframes[0]
+        last = first + info.duration
+        bounds = [first]
+        for i in range(1, chunks):
+            n = bisect_left(keyframes, first + info.duration * i / chunks)
+            if n < len(keyframes) and bounds[-1] + 1 < keyframes[n] < last - 1:
+                bounds.append(keyframes[n])
+        parts = []
+        for i, bound in enumerate(bounds):
+            # -ss is relative to the container start time and a bit before the keyframe
+            # (accurate seek drops frames before it), -t is counted from the first frame of a chunk.
+            # The first chunk is seeked too: without -ss, -t is counted from the container start (can be negative)
+            start = max(bound - info.start_time - 0.001, 0.0)
+            duration = bounds[i + 1] - bound - 0.001 if i + 1 < len(bounds) else None
+            parts.append((start, duration))
+        return parts
+
+    # --------------------------------------------
+    def _get_rangesettings(self, start, duration):
+        '''returns input (-ss) and output (-t) options for a part of a file'''
+        inputcmd = ['-ss', '{:.6f}'.format(start)] if start is not None else []
+        outputcmd = ['-t', '{:.6f}'.format(duration)] if duration is not None else []
+        return inputcmd, outputcmd
+
+    # --------------------------------------------
+    def _parallel(self, func, argslist, workers):
+        '''Calls func(*args) for every args in argslist using up to "workers" threads, returns list of results. Reraises the first error.'''
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            futures = [executor.submit(func, *args) for args in argslist]
+            return [future.result() for future in futures]
+
+    # --------------------------------------------
+    def _get_workdir(self, prefix, dir=None):
+        '''Creates a temporary directory for files of a plan. A dry run writes nothing: returns a template of the name
+        (random part as XXXXXXXX, as in the real name made by mkdtemp)'''
+        if self.dryrun:
+            return os.path.join(dir or tempfile.gettempdir(), '{}XXXXXXXX'.format(prefix))
+        return tempfile.mkdtemp(prefix=prefix, dir=dir)
+
+    # --------------------------------------------
+    def _remove_workdir(self, workdir):
+        if not self.dryrun:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    # --------------------------------------------
+    def _concat(self, files, outfile, inputs=[], options=[]):
+        '''Plan: joins files with the concat demuxer (stream copy). "inputs" are extra input options (ex. ['-i', 'audio.mp4']) mapped with "options"'''
+        directory = os.path.dirname(os.path.abspath(outfile))
+        if self.dryrun:
+            # a dry run writes nothing: the command shows a template of the name made by mkstemp
+            listfile = os.path.join(directory, 'tmp-concat-XXXXXXXX.txt')
+        else:
+            fd, listfile = tempfile.mkstemp(prefix='tmp-concat-', suffix='.txt', dir=directory)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                for file in files:
+                    f.write("file '{}'\n".format(os.path.abspath(file).replace("'", "'\\''")))
+        cmd = [
+            self.bins['ffmpeg']
+            , '-y'
+            , '-f', 'concat'
+            , '-safe', '0'
+            , '-i', listfile
+            ]
+        cmd += inputs
+        cmd += ['-map', '0:v:0']
+        cmd += options
+        cmd += ['-c:v', 'copy', outfile]
+        try:
+            return (yield Command(cmd, outputs=[outfile]))
+        finally:
+            if not self.dryrun:
+                os.remove(listfile)
+
+    # --------------------------------------------
+    def _encode_chunked(self, infile, chunks, encode, audiotrack=None, audiocmd=[], outfiles=['outfile.mp4']):
+        '''Plan: splits infile at keyframes into chunks and encodes them in parallel
+        with encode(start, duration, chunkfiles, threads) plan - one chunkfile for each of outfiles,
+        then joins the video without re-encoding and adds the audio track (encoded once with "audiocmd")'''
+        parts = yield from self._get_chunks(infile, chunks)
+        threads = max(1, (self.threads or get_cpucount()) // len(parts))
+        workdir = self._get_workdir(prefix='tmp-chunks-', dir=os.path.dirname(os.path.abspath(outfiles[0])))
+        try:
+            chunkfiles = [[os.path.join(workdir, 'chunk{:04d}-{}.mp4'.format(i, n)) for n in range(len(outfiles))] for i in range(len(parts))]
+            yield Parallel([encode(start, duration, files, threads) for (start, duration), files in zip(parts, chunkfiles)], len(parts))
+            audioinputs = []
+            audiooptions = []
+            if audiocmd:
+                audioinputs = ['-i', infile]
+                audiooptions = ['-map', '1:a:{}'.format(audiotrack - 1)] + audiocmd
+            for n, outfile in enumerate(outfiles):
+                yield from self._concat([files[n] for files in chunkfiles], outfile, inputs=audioinputs, options=audiooptions)
+            return True
+        finally:
+            self._remove_workdir(workdir)
+
+    # --------------------------------------------
+    def _encode_resumable(self, infiles, settings, segmentlength, encode, audio=None, outfile='outfile.webm'):
+        '''Plan: encodes infiles (joined in this order) in keyframe-aligned segments of about "segmentlength" seconds
+        with encode(infile, start, duration, segmentfile) plan (video only) and the audio with audio(audiofile) plan
+        (matroska file), then joins them without re-encoding.
+        Finished segments are recorded in a checkpoint file of a work directory next to outfile: a killed encode
+        started again with the same input files and "settings" continues after the last finished segment.'''
+        workdir = os.path.join(os.path.dirname(os.path.abspath(outfile)), '.{}.resume'.format(os.path.basename(outfile)))
+        checkpointfile = os.path.join(workdir, 'checkpoint.json')
+        key = {
+            'inputs': [[os.path.abspath(file), os.path.getsize(file), os.path.getmtime(file)] for file in infiles]
+            , 'settings': settings
+            , 'segmentlength': segmentlength
+            }
+        try:
+            with open(checkpointfile, encoding='utf-8') as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError):
+            checkpoint = None
+        if checkpoint is None or checkpoint.get('key') != json.loads(json.dumps(key)):
+            if checkpoint is not None:
+                self._info('Input files or settings of "{}" changed, encoding from the start.'.format(outfile))
+            if not self.dryrun:
+                shutil.rmtree(workdir, ignore_errors=True)
+                os.makedirs(workdir)
+            segments = []
+            for n, infile in enumerate(infiles):
+                chunks = max(1, math.ceil(self.probe(infile).duration / segmentlength))
+                segments += [[n, start, duration] for start, duration in (yield from self._get_chunks(infile, chunks))]
+            checkpoint = {'key': key, 'segments': segments, 'done': []}
+            self._write_checkpoint(checkpointfile, checkpoint)
+        elif checkpoint['done']:
+            self._info('Resuming "{}": {} of {} segments done.'.format(outfile, len([name for name in checkpoint['done'] if name.startswith('segment')]), len(checkpoint['segments'])))
+
+        # outputs of the killed run not recorded as done (ex. temporary files of ffmpeg killed with the process)
+        for name in (os.listdir(workdir) if not self.dryrun else []):
+            if name != 'checkpoint.json' and name not in checkpoint['done']:
+                self._remove_files([os.path.join(workdir, name)])
+
+        extension = os.path.splitext(outfile)[1]
+        segmentfiles = []
+        for i, (n, start, duration) in enumerate(checkpoint['segments']):
+            segmentfile = os.path.join(workdir, 'segment{:05d}{}'.format(i, extension))
+            segmentfiles.append(segmentfile)
+            if os.path.basename(segmentfile) not in checkpoint['done']:
+                yield from encode(infiles[n], start, duration, segmentfile)
+                checkpoint['done'].append(os.path.basename(segmentfile))
+                self._write_checkpoint(checkpointfile, checkpoint)
+
+        audioinputs = []
+        audiooptions = []
+        if audio is not None:
+            audiofile = os.path.join(workdir, 'audio.mka')
+            if 'audio.mka' not in checkpoint['done']:
+                yield from audio(audiofile)
+                checkpoint['done'].append('audio.mka')
+                self._write_checkpoint(checkpointfile, checkpoint)
+            audioinputs = ['-i', audiofile]
+            audiooptions = ['-map', '1:a:0', '-c:a', 'copy']
+        yield from self._concat(segmentfiles, outfile, inputs=audioinputs, options=audiooptions)
+        if not self.dryrun:
+            shutil.rmtree(workdir, ignore_errors=True)
+        return True
+
+    # --------------------------------------------
+    def _write_checkpoint(self, path, checkpoint):
+        '''Writes checkpoint of _encode_resumable through a temporary file (a killed process never leaves a part of it)'''
+        if self.dryrun:
+            return
+        tmpfile = '{}.tmp'.format(path)
+        with open(tmpfile, 'w', encoding='utf-8') as f:
+            json.dump(checkpoint, f, indent=1)
+        os.replace(tmpfile, path)
 
     # --------------------------------------------
     def show_versions(self):
@@ -113,13 +1527,103 @@ class VideoTool:
         return self.bins['ffmpeg'], ffmpegver, self.bins['ffprobe'], ffprobever
 
     # --------------------------------------------
-    def avmerge(self, files, maxWidth=1920, maxHeight=1080, frameRate=30, quality=22, outfile='outfile.mp4'):
+    @operation
+    def avmerge(self, files, maxWidth=1920, maxHeight=1080, frameRate=30, quality=22, copy=True, resume=False, segmentlength=300, normalize=False, jobs=0, outfile='outfile.mp4'):
+        '''copy - join files without re-encoding if they all have the output format and the same codecs,
+        resume - encode in keyframe-aligned segments of about "segmentlength" seconds with a checkpoint,
+        so the encode killed before the end continues from the last finished segment when started again,
+        normalize - encode every file separately to the output format ("jobs" at once, 0 - by CPU count) and join them
+        without re-encoding: for many files. Normalized files are cached, so a changed list re-encodes only new files.'''
         frameRate = str(frameRate)
         maxWidth = str(self._lead_to_divisibility_by_2(int(maxWidth)))
         maxHeight = str(self._lead_to_divisibility_by_2(int(maxHeight)))
 
         if outfile in files: files.remove(outfile)
 
+        if copy and self._can_concat(files, int(maxWidth), int(maxHeight), float(frameRate)):
+            self._info('All files have the same format, joining without re-encoding.')
+            return (yield from self._concat(files, outfile, options=['-map', '0:a:0', '-c:a', 'copy']))
+
+        scale = 'scale=iw*sar*min({maxWidth}/(iw*sar)\\,{maxHeight}/ih):ih*min({maxWidth}/(iw*sar)\\,{maxHeight}/ih),pad={maxWidth}:{maxHeight}:(ow-iw)/2:(oh-ih)/2,setsar=1'.format(
+            maxWidth=maxWidth, maxHeight=maxHeight)
+        preset = yield from self._get_preset(files[0], quality)
+
+        if normalize:
+            if jobs <= 0:
+                jobs = max(1, get_cpucount() // JobScheduler.THREADSPERJOB['x264'])
+            settings = [maxWidth, maxHeight, frameRate, quality, preset, self.keyint]
+            clips = [self._get_normalizedpath(file, settings) for file in files]
+            missing = list(dict.fromkeys((file, clip) for file, clip in zip(files, clips) if not os.path.exists(clip)))
+            if not self.dryrun:
+                self._touch_cached([clip for clip in clips if os.path.exists(clip)])
+            self._info('Normalizing {} of {} files ({} cached).'.format(len(missing), len(files), len(files) - len(missing)))
+            jobs = max(1, min(jobs, len(missing)))
+            threads = max(1, (self.threads or get_cpucount()) // jobs) if jobs > 1 else self.threads
+
+            def encode(file, clip):
+                cmd = [self.bins['ffmpeg'], '-y', '-i', file]
+                if self.probe(file).audiostream(1) is not None:
+                    cmd += ['-map', '0:v:0', '-map', '0:a:0', '-af', 'apad']
+                else:
+                    # silence: the concat demuxer needs the same streams in every file
+                    cmd += ['-f', 'lavfi', '-i', 'anullsrc=r=48000:cl=stereo', '-map', '0:v:0', '-map', '1:a:0']
+                # fps filter, not -r: -r with -shortest and apad keeps duplicated frames after the end of the clip
+                cmd += [
+                    '-shortest'
+                    , '-vf', '{},fps={}'.format(scale, frameRate)
+                    , '-c:a', 'libmp3lame'
+                    , '-ar', '48000'
+                    , '-ac', '2'
+                    , '-bf', '2'
+                    ]
+                cmd += self._get_h264settings(quality, preset)
+                cmd += self._get_threadsettings(threads)
+                cmd += [clip]
+                return (yield Command(cmd, outputs=[clip]))
+            yield Parallel([encode(file, clip) for file, clip in missing], jobs)
+            result = yield from self._concat(clips, outfile, options=['-map', '0:a:0', '-c:a', 'copy'])
+            if not self.dryrun:
+                self._trim_cache(os.path.dirname(clips[0]), self.CACHELIMITS['normalized'], keep=clips)
+            return result
+
+        if resume:
+            def encode(infile, start, duration, segmentfile):
+                inputcmd, outputcmd = self._get_rangesettings(start, duration)
+                cmd = [self.bins['ffmpeg'], '-y']
+                cmd += inputcmd
+                cmd += ['-i', infile]
+                cmd += outputcmd
+                cmd += [
+                    '-map', '0:v:0'
+                    , '-vf', scale
+                    , '-an'
+                    , '-r', frameRate
+                    , '-bf', '2'
+                    ]
+                cmd += self._get_h264settings(quality, preset)
+                cmd += self._get_threadsettings()
+                cmd += [segmentfile]
+                return (yield Command(cmd, outputs=[segmentfile]))
+            def audio(audiofile):
+                # every audio track is padded or cut to the duration of its file (video segments follow each other)
+                cmd = [self.bins['ffmpeg'], '-y']
+                filter = ''
+                for i, file in enumerate(files):
+                    cmd += ['-i', file]
+                    filter += '[{i}:a]apad,atrim=end={duration:.6f}[{i}a];'.format(i=i, duration=self.probe(file).duration)
+                filter += ''.join('[{}a]'.format(i) for i in range(len(files)))
+                filter += 'concat=n={}:v=0:a=1[a]'.format(len(files))
+                cmd += [
+                    '-filter_complex', filter
+                    , '-map', '[a]'
+                    , '-c:a', 'libmp3lame'
+                    , '-ar', '48000'
+                    , audiofile
+                    ]
+                return (yield Command(cmd, outputs=[audiofile]))
+            settings = {'operation': 'avmerge', 'maxWidth': maxWidth, 'maxHeight': maxHeight, 'frameRate': frameRate, 'quality': quality, 'preset': preset}
+            return (yield from self._encode_resumable(files, settings, segmentlength, encode, audio, outfile))
+
         cmdoptions = []
         filteropt1 = ''
         filteropt2 = ''
@@ -143,401 +1647,2459 @@ class VideoTool:
             , '-r', frameRate
             , '-bf', '2'
             ]
-        cmd += self._get_h264settings(quality)
+        cmd += self._get_h264settings(quality, preset)
+        cmd += self._get_threadsettings()
+        cmd += [outfile]
+        return (yield Command(cmd, outputs=[outfile]))
+
+    # --------------------------------------------
+    def _get_normalizedpath(self, file, settings):
+        '''File of avmerge normalize cache: in the cache directory, by file (path, size, mtime) and output settings'''
+        stat = os.stat(file)
+        key = json.dumps([os.path.abspath(file), stat.st_size, stat.st_mtime_ns] + settings)
+        try:
+            normalizeddir = os.path.join(get_cachedir(), 'normalized')
+            os.makedirs(normalizeddir, exist_ok=True)
+        except OSError:
+            normalizeddir = tempfile.gettempdir()
+        return os.path.join(normalizeddir, '{}.mp4'.format(hashlib.sha1(key.encode('utf-8')).hexdigest()))
+
+    # --------------------------------------------
+    def _touch_cached(self, files):
+        '''Marks cache files as used now (mtime is the last use for _trim_cache)'''
+        for file in files:
+            try:
+                os.utime(file)
+            except OSError:
+                pass
+
+    # --------------------------------------------
+    def _trim_cache(self, directory, limit, keep=()):
+        '''Removes the least recently used cache files (named by a sha1 key, see _get_normalizedpath and _get_palette)
+        from directory until they take at most "limit" bytes. Files in "keep" are never removed'''
+        keep = set(os.path.abspath(file) for file in keep)
+        files = []
+        try:
+            for entry in os.scandir(directory):
+                name, extension = os.path.splitext(entry.name)
+                if len(name) == 40 and all(c in string.hexdigits for c in name) and entry.is_file():
+                    st = entry.stat()
+                    files.append((st.st_mtime, st.st_size, os.path.abspath(entry.path)))
+        except OSError:
+            return
+        total = sum(size for mtime, size, path in files)
+        for mtime, size, path in sorted(files):
+            if total <= limit:
+                break
+            if path in keep:
+                continue
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    # --------------------------------------------
+    def _can_concat(self, files, width, height, framerate):
+        '''Checks if files can be joined by the concat demuxer with stream copy into mp4:
+        the same video/audio codec parameters and the requested resolution and frame rate.
+        mp4 keeps one set of decoder parameters (extradata: h264 SPS/PPS, AAC config) per track, so they must be equal too'''
+        signatures = set()
+        for file in files:
+            info = self.probe(file)
+            video = info.videostream()
+            audio = info.audiostream(1)
+            if video is None or audio is None:
+                return False
+            if video.get('codec_name') not in ('h264', 'hevc', 'mpeg4', 'av1'):
+                return False
+            if audio.get('codec_name') not in ('aac', 'mp3', 'ac3', 'eac3', 'opus'):
+                return False
+            if info.resolution != (width, height) or abs(info.framerate - framerate) > 0.01:
+                return False
+            signatures.add((
+                video.get('codec_name'), video.get('codec_tag_string'), video.get('profile'), video.get('level'), video.get('pix_fmt')
+                , video.get('sample_aspect_ratio', '1:1'), video.get('r_frame_rate'), video.get('time_base'), video.get('extradata_hash')
+                , audio.get('codec_name'), audio.get('codec_tag_string'), audio.get('profile'), audio.get('sample_rate'), audio.get('channels')
+                , audio.get('channel_layout'), audio.get('time_base'), audio.get('extradata_hash')
+                ))
+        return len(signatures) == 1
+
+    # --------------------------------------------
+    @operation
+    def compress_single_video(self, infile: str, targetsize: str, audiobitrate=None, audiotrack=None, containerfactor=10, chunks=0, jobs=1, mode='abr', outfile="outfile.mp4"):
+        '''targetsize - one size or several comma-separated sizes (outfile is a list of the same length then):
+        the first pass runs once and its stats are used for all targets, "jobs" second passes run at once.
+        chunks > 1 - split the file at keyframes and encode parts in parallel (with the same video bitrate).
+        mode - 'abr' (two-pass) or 'predict' (one CRF pass, CRF is predicted from encoded samples).
+        Container overhead is learned from the results, containerfactor is used until there is nothing learned.'''
+        # platform check
+        if platform.system() == "Linux":
+            devnull = '/dev/null'
+        elif platform.system() == "Windows":
+            devnull = 'NUL'
+
+        if isinstance(targetsize, str):
+            targetsize = targetsize.split(',')
+        if isinstance(outfile, str):
+            outfile = [outfile]
+        if len(targetsize) != len(outfile):
+            raise InvalidArgumentError('Number of target sizes and output files must be the same.')
+
+        # find video duration in seconds
+        info = self.probe(infile)
+        duration = info.duration
+
+        # check if audio exists
+        audiocodeccmd = []
+        audiobps = 0
+        audiotrackcmd = self._there_is_audio(infile, audiotrack=audiotrack)
+        if audiotrackcmd:
+            audiocodeccmd = self._get_audiocodec()
+
+            # get audio rate in bits per seconds
+            if audiobitrate is None:
+                audiobps = info.audio_bit_rate(audiotrack)
+                if audiobps is None:
+                    # sometimes ffprobe return N/A
+                    audiobps = 128 * 1000
+            else:
+                audiobps = audiobitrate * 1000
+            audiocodeccmd += ['-b:a', '{}k'.format(str(math.floor(audiobps/1000)))]
+        else:
+            audiotrackcmd = []
+
+        learnedoverhead = self.calibration.get('overhead', 'mp4')
+        if learnedoverhead is not None:
+            mp4overhead = math.floor( learnedoverhead * duration ) # in bytes, learned from the previous results
+        else:
+            mp4overhead = math.floor( containerfactor *  (1024**2/3600) * duration ) # in bytes. The basic overhead is 1Mb per hour (really a random value). Some multiplier (containerfactor) is needed for tuning.
+        videobitrates = []
+        for size in targetsize:
+            size, sizein = self._parse_size(size)
+            # check if target size is smaller than audio size
+            audiosize = duration * (audiobps/8) # bytes
+            if size <= ( audiosize + mp4overhead ):
+                if sizein == 'B':
+                    errsize = math.ceil( audiosize + mp4overhead )
+                elif sizein == 'Kb':
+                    errsize = math.ceil( (audiosize + mp4overhead) / 1024 )
+                elif sizein == 'Mb':
+                    errsize = math.ceil(( audiosize + mp4overhead) / 1024**2 )
+                elif sizein == 'Gb':
+                    errsize = math.ceil( (audiosize + mp4overhead) / 1024**3 )
+                raise TargetSizeTooSmallError("TARGET SIZE IS TOO SMALL!\nAudio track size: ~{asize} {sizein} with {audiokbps} kbps. \nTry target size {errsize} {sizein}. Increase it if an encoding error appears.".format(asize=errsize-1, audiokbps=math.ceil(audiobps/1000), errsize=errsize, sizein=sizein))
+
+            # calculate bitrate
+            videobps = math.floor( ( (size - mp4overhead) * 8 / duration ) - math.floor(audiobps) )
+            infotargetsize = size / 1024 # Kb
+            infovideosize = (videobps / (8 * 1024) ) * duration # Kb
+            infomp4overhead = mp4overhead /  1024 # Kb
+            infoaudiosize = (audiobps / (8 * 1024)) * duration # Kb
+            self._info("Duration: {duration}\nTarget size: {targetsize} Kb\nVideo size: {videosize} Kb\nAudio size: {audiosize} Kb\nMP4 Overhead: {mp4overhead} Kb".format(duration=duration, targetsize=infotargetsize, videosize=infovideosize, audiosize=infoaudiosize, mp4overhead=infomp4overhead))
+            videobitrates.append(videobps)
+
+        if mode == 'predict':
+            prediction = yield from self._predict_crf(infile, videobitrates)
+            if prediction is None:
+                self._info('Size prediction failed, using two-pass encoding.')
+                mode = 'abr'
+            else:
+                crfs, slope = prediction
+                self._info('Predicted CRF: {}'.format(', '.join('{:.1f}'.format(crf) for crf in crfs)))
+
+        # the first pass is made once with the median bitrate, its stats are good for all targets
+        firstpassbps = sorted(videobitrates)[len(videobitrates) // 2]
+
+        def secondpass(inputcmd, outputcmd, ffmpeglogname, setting, passout, threads):
+            '''pass 2 of two-pass encoding (setting is a video bitrate) or a single CRF pass (setting is (crf, video bitrate))'''
+            cmd = [self.bins['ffmpeg'], '-y']
+            cmd += inputcmd
+            cmd += ['-i', infile]
+            cmd += outputcmd
+            cmd += ['-map', '0:v:0']
+            if chunks > 1:
+                cmd += ['-an']
+            else:
+                cmd += audiotrackcmd
+                cmd += audiocodeccmd
+            if ffmpeglogname is None:
+                crf, videobps = setting
+                # VBV cap: peaks can not blow up the size predicted by the samples
+                cmd += [
+                      '-c:v', 'libx264'
+                    , '-crf', '{:.1f}'.format(crf)
+                    , '-maxrate', '{}k'.format(str(math.floor(videobps * 1.5 / 1000)))
+                    , '-bufsize', '{}k'.format(str(math.floor(videobps * 3 / 1000)))
+                    ]
+            else:
+                cmd += [
+                      '-c:v', 'libx264'
+                    , '-b:v', '{}k'.format(str(math.floor(setting/1000)))
+                    , '-pass', '2'
+                    , '-passlogfile', ffmpeglogname
+                    ]
+            cmd += self._get_threadsettings(threads)
+            cmd += [passout]
+            return (yield Command(cmd, outputs=[passout]))
+
+        def encode(start, duration, outfiles, threads, secondpassjobs, settings):
+            '''encodes (a part of) the file: the first pass once (abr mode) and a second pass for every target'''
+            inputcmd, outputcmd = self._get_rangesettings(start, duration)
+            ffmpeglogname = None
+            try:
+                if mode == 'abr':
+                    # pass 1
+                    ffmpeglogname = 'tmp-passlogfile-{}'.format(''.join(random.choices(string.ascii_uppercase + string.digits, k=6)))
+                    cmd = [self.bins['ffmpeg'], '-y']
+                    cmd += inputcmd
+                    cmd += ['-i', infile]
+                    cmd += outputcmd
+                    cmd += [
+                          '-map', '0:v:0'
+                        , '-an'
+                        , '-c:v', 'libx264'
+                        , '-b:v', '{}k'.format(str(math.floor(firstpassbps/1000)))
+                        , '-pass', '1'
+                        , '-passlogfile', ffmpeglogname
+                        , '-f', 'mp4'
+                        ]
+                    cmd += self._get_threadsettings(threads)
+                    cmd += [devnull]
+                    yield Command(cmd)
+                # pass 2
+                secondpassjobs = max(1, min(secondpassjobs, len(outfiles)))
+                secondpassthreads = max(1, (threads or get_cpucount()) // secondpassjobs) if secondpassjobs > 1 else threads
+                yield Parallel([secondpass(inputcmd, outputcmd, ffmpeglogname, setting, passout, secondpassthreads) for setting, passout in zip(settings, outfiles)], secondpassjobs)
+            finally:
+                if ffmpeglogname is not None:
+                    self._remove_passlogs(ffmpeglogname)
+            return True
+
+        def encodeall(outfiles, settings):
+            if chunks > 1:
+                return (yield from self._encode_chunked(infile, chunks, lambda start, duration, chunkfiles, threads: encode(start, duration, chunkfiles, threads, 1, settings)
+                                                        , audiotrack=audiotrack or 1, audiocmd=audiocodeccmd, outfiles=outfiles))
+            return (yield from encode(None, None, outfiles, self.threads, jobs, settings))
+
+        if mode == 'predict':
+            settings = list(zip(crfs, videobitrates))
+        else:
+            settings = videobitrates
+        yield from encodeall(outfile, settings)
+        if self.dryrun:
+            return True
+
+        # check the result
+        retry = []
+        for size, out, setting in zip(targetsize, outfile, settings):
+            size = self._parse_size(size)[0]
+            outsize = os.path.getsize(out)
+            self._info('"{}": {} Kb (target: {} Kb)'.format(out, math.ceil(outsize / 1024), math.floor(size / 1024)))
+            if mode == 'predict' and outsize > size:
+                # one more try: move CRF along the fitted size curve (+0.5 for safety)
+                crf, videobps = setting
+                crf = min(51, crf + math.log(outsize / size) / -slope + 0.5)
+                self._info('"{}" is bigger than the target, re-encoding with CRF {:.1f}.'.format(out, crf))
+                retry.append((out, (crf, videobps)))
+        if retry:
+            yield from encodeall([out for out, setting in retry], [setting for out, setting in retry])
+        # learn the real container overhead once, from the final files
+        for out in outfile:
+            self._learn_overhead(out)
+        return True
+
+    # --------------------------------------------
+    def _predict_crf(self, infile, videobitrates, crfs=(20, 32), samples=5, samplelength=4):
+        '''Plan: encodes short samples spread across the file with several CRF values and fits log(bitrate) = a + slope * crf.
+        Returns (list of CRF for the video bitrates, slope) or None'''
+        duration = self.probe(infile).duration
+        samples = max(1, min(samples, int(duration // (samplelength * 2))))
+        length = min(samplelength, duration / samples)
+        starts = [max(0.0, duration * (2 * i + 1) / (2 * samples) - length / 2) for i in range(samples)]
+        workers = min(get_cpucount(), len(starts) * len(crfs))
+        threads = max(1, (self.threads or get_cpucount()) // workers)
+        workdir = self._get_workdir(prefix='tmp-samples-')
+
+        def encodesample(crf, n, start):
+            # raw h264: the file size is the size of the video stream
+            samplefile = os.path.join(workdir, 'sample{}-{}.h264'.format(crf, n))
+            cmd = [
+                self.bins['ffmpeg']
+                , '-y'
+                , '-ss', '{:.6f}'.format(start)
+                , '-i', infile
+                , '-t', '{:.6f}'.format(length)
+                , '-map', '0:v:0'
+                , '-an'
+                , '-c:v', 'libx264'
+                , '-crf', str(crf)
+                ]
+            cmd += self._get_threadsettings(threads)
+            cmd += ['-f', 'h264', samplefile]
+            yield Command(cmd)
+            return os.path.getsize(samplefile)
+
+        try:
+            jobs = [(crf, n, start) for crf in crfs for n, start in enumerate(starts)]
+            sizes = yield Parallel([encodesample(*job) for job in jobs], workers)
+        finally:
+            self._remove_workdir(workdir)
+
+        points = []
+        for crf in crfs:
+            bytes = sum(size for (jobcrf, n, start), size in zip(jobs, sizes) if jobcrf == crf)
+            if bytes <= 0:
+                return None
+            points.append((crf, math.log(bytes * 8 / (length * len(starts)))))
+        meanx = sum(x for x, y in points) / len(points)
+        meany = sum(y for x, y in points) / len(points)
+        variance = sum((x - meanx) ** 2 for x, y in points)
+        slope = sum((x - meanx) * (y - meany) for x, y in points) / variance
+        if slope >= 0:
+            return None
+        intercept = meany - slope * meanx
+        return [min(51.0, max(0.0, (math.log(max(bps, 1)) - intercept) / slope)) for bps in videobitrates], slope
+
+    # --------------------------------------------
+    def _learn_overhead(self, file):
+        '''Stores container overhead (bytes per second of the file size not taken by streams) of an encoded file'''
+        info = self.probe(file)
+        streamsbytes = 0
+        for stream in info.streams:
+            try:
+                streamsbytes += float(stream['bit_rate']) * float(stream['duration']) / 8
+            except (KeyError, ValueError):
+                return
+        if info.duration <= 0:
+            return
+        overhead = max(0.0, (os.path.getsize(file) - streamsbytes) / info.duration)
+        learned = self.calibration.get('overhead', 'mp4')
+        if learned is not None:
+            overhead = (learned + overhead) / 2
+        self.calibration.put('overhead', 'mp4', overhead)
+
+    # --------------------------------------------
+    @operation
+    def resize_single_video(self, infile: str, scale=None, audiotrack=None, resolution=None, quality=22, outfile='outfile.mp4'):
+        if scale is None and resolution is None: return
+
+        if scale is not None:
+            scale = float(scale)
+            width, height = self._get_resolution(infile)
+            newwidth = int(width * scale)
+            newheight = int(height * scale)
+        elif resolution is not None:
+            newwidth, newheight = resolution.split('x')
+            newwidth = int(newwidth)
+            newheight = int(newheight)
+        
+        newwidth = self._lead_to_divisibility_by_2(newwidth)
+        newheight = self._lead_to_divisibility_by_2(newheight)
+
+        # convert resolution
+        cmd = [
+            self.bins['ffmpeg']
+            , '-i', infile
+            , '-map', '0:v:0'
+            , '-vf', 'scale={}:{}, setsar=1:1'.format(newwidth, newheight)
+            ]
+        
+        # check if audio exists
+        audiocodeccmd = []
+        audiotrackcmd = self._there_is_audio(infile, audiotrack=audiotrack)
+        if audiotrackcmd:
+            audiocodeccmd = self._get_audiocodec()
+        else:
+            audiotrackcmd = []
+        
+        cmd += self._get_h264settings(quality, (yield from self._get_preset(infile, quality)))
+        cmd += audiotrackcmd
+        cmd += audiocodeccmd
+        cmd += self._get_threadsettings()
+        cmd += [outfile]
+        return (yield Command(cmd, outputs=[outfile]))
+
+    # --------------------------------------------
+    @operation
+    def cut_single_video(self, infile: str, startpoint='-1', endpoint='-1', audiotrack=None, quality=22, smart=False, snap=False, outfile='outfile.mp4'):
+        '''smart - copy the video between the first and the last keyframe in the range and re-encode only the partial GOPs at the cut points,
+        snap - move the cut points to the keyframes (at or before the start, at or after the end) and copy the video without re-encoding'''
+        if startpoint == '-1' and endpoint == '-1': return
+
+        start = self._parse_timestamp(startpoint) if startpoint != '-1' else 0.0
+        duration = self._parse_timestamp(endpoint) - start if endpoint != '-1' else None
+
+        # check if audio exists
+        audiocodeccmd = []
+        audiotrackcmd = self._there_is_audio(infile, audiotrack=audiotrack)
+        if audiotrackcmd:
+            audiocodeccmd = self._get_audiocodec()
+        else:
+            audiotrackcmd = []
+
+        if snap:
+            # keyframe positions are taken from the index (see _get_index), the range is relative to the container start (as -ss)
+            info = self.probe(infile)
+            index = yield from self._get_index(infile)
+            if len(index.keytimes):
+                firstkey = index.snap(start + info.start_time, 'before')
+                if firstkey is None:
+                    firstkey = index.keytimes[0]
+                lastkey = index.snap(start + duration + info.start_time, 'after') if duration is not None else None
+                self._info('Cut at keyframes: {:.3f} - {}'.format(firstkey - info.start_time, '{:.3f}'.format(lastkey - info.start_time) if lastkey is not None else 'end'))
+                # stream copy starts at the keyframe before -ss: -ss is a bit after the keyframe. The video ends
+                # by the frame count of the index (stream copy -t lets the next keyframe through), -t ends the audio
+                inputcmd, outputcmd = self._get_rangesettings(max(0.0, firstkey - info.start_time + 0.0005), lastkey - firstkey if lastkey is not None else None)
+                cmd = [self.bins['ffmpeg']]
+                cmd += inputcmd
+                cmd += ['-i', infile]
+                cmd += outputcmd
+                if lastkey is not None:
+                    cmd += ['-frames:v', str(bisect_left(index.packettimes, lastkey - 0.0001) - bisect_left(index.packettimes, firstkey - 0.0001))]
+                cmd += ['-map', '0:v:0', '-c:v', 'copy']
+                cmd += audiotrackcmd
+                cmd += audiocodeccmd
+                cmd += ['-avoid_negative_ts', 'make_zero', outfile]
+                return (yield Command(cmd, outputs=[outfile]))
+            self._info('No keyframes in the index of "{}", re-encoding.'.format(infile))
+
+        if smart:
+            result = yield from self._smart_cut(infile, start, duration, audiotrack=audiotrack or 1, audiocmd=audiocodeccmd, quality=quality, outfile=outfile)
+            if result is not None:
+                return result
+            self._info('Smart cut is not possible for "{}" (not h264 or no full GOP in the range), re-encoding.'.format(infile))
+
+        # seek on the input side: ffmpeg does not decode everything before the start point
+        inputcmd, outputcmd = self._get_rangesettings(start or None, duration)
+        cmd = [self.bins['ffmpeg']]
+        cmd += inputcmd
+        cmd += ['-i', infile]
+        cmd += outputcmd
+        cmd += ['-map', '0:v:0']
+        cmd += self._get_h264settings(quality, (yield from self._get_preset(infile, quality)))
+        cmd += audiotrackcmd
+        cmd += audiocodeccmd
+        cmd += self._get_threadsettings()
         cmd += [outfile]
-        subprocess.Popen(cmd).communicate()
+        return (yield Command(cmd, outputs=[outfile]))
+
+    # --------------------------------------------
+    def _smart_cut(self, infile, start, duration, audiotrack=1, audiocmd=[], quality=22, outfile='outfile.mp4'):
+        '''Plan: cuts h264 video as: re-encoded head (start - first keyframe), copied GOPs, re-encoded tail (last keyframe - end).
+        Returns None if the file can not be cut this way.'''
+        info = self.probe(infile)
+        stream = info.videostream()
+        if stream is None or stream.get('codec_name') != 'h264':
+            return None
+        end = duration + start if duration is not None else info.duration
+        # keyframe and frame positions relative to the container start (as -ss)
+        index = yield from self._get_index(infile)
+        keyframes = [k - info.start_time for k in index.keytimes]
+        frametimes = [t - info.start_time for t in index.packettimes]
+        inside = [k for k in keyframes if start <= k <= end]
+        if len(inside) < 2 - (duration is None):
+            return None
+        firstkey, lastkey = inside[0], inside[-1]
+
+        # boundary parts must be decodable as one stream with the copied part,
+        # so every part keeps its SPS/PPS in-band (repeat-headers, h264_mp4toannexb)
+        encodecmd = [
+            '-c:v', 'libx264'
+            , '-crf', str(quality)
+            , '-preset', (yield from self._get_preset(infile, quality))
+            , '-pix_fmt', stream.get('pix_fmt', 'yuv420p')
+            , '-x264-params', 'repeat-headers=1'
+            # passthrough: the first frame after an accurate seek is not duplicated (the frame count is exact)
+            , '-fps_mode', 'passthrough'
+            ]
+        profile = stream.get('profile', '').lower().replace('constrained ', '')
+        if profile in ('baseline', 'main', 'high', 'high10', 'high422', 'high444'):
+            encodecmd += ['-profile:v', profile]
+        if stream.get('level', 0) > 0:
+            encodecmd += ['-level', '{:.1f}'.format(stream['level'] / 10)]
+
+        # (-ss, number of frames, codec settings) for every part. Parts end by frame counts from the index:
+        # stream copy -t lets the next keyframe through, so time limits would repeat the frames at the joins.
+        # -ss of the copied part is a bit after the keyframe (stream copy starts at the keyframe before -ss),
+        # re-encoded parts are seeked a bit before it (accurate seek drops frames before -ss)
+        countframes = lambda a, b: bisect_left(frametimes, b - 0.0001) - bisect_left(frametimes, a - 0.0001)
+        copycmd = ['-c:v', 'copy', '-bsf:v', 'h264_mp4toannexb', '-avoid_negative_ts', 'make_zero']
+        parts = []
+        if countframes(start, firstkey):
+            parts.append((start, countframes(start, firstkey), encodecmd))
+        parts.append((firstkey + 0.0005, countframes(firstkey, lastkey) if duration is not None else None, copycmd))
+        if duration is not None and countframes(lastkey, end):
+            parts.append((lastkey - 0.001, countframes(lastkey, end), encodecmd))
+
+        workdir = self._get_workdir(prefix='tmp-cut-', dir=os.path.dirname(os.path.abspath(outfile)))
+        try:
+            partfiles = []
+            for i, (partstart, frames, codeccmd) in enumerate(parts):
+                partfile = os.path.join(workdir, 'part{}.mp4'.format(i))
+                cmd = [self.bins['ffmpeg'], '-y']
+                cmd += self._get_rangesettings(partstart, None)[0]
+                cmd += ['-i', infile]
+                if frames is not None:
+                    cmd += ['-frames:v', str(frames)]
+                cmd += ['-map', '0:v:0', '-an']
+                cmd += codeccmd
+                if codeccmd is encodecmd:
+                    cmd += self._get_threadsettings()
+                cmd += [partfile]
+                yield Command(cmd)
+                partfiles.append(partfile)
+            audioinputs = []
+            audiooptions = []
+            if duration is not None:
+                audiooptions += ['-t', '{:.6f}'.format(duration)]
+            if audiocmd:
+                audioinputs = ['-ss', '{:.6f}'.format(start), '-i', infile]
+                audiooptions += ['-map', '1:a:{}'.format(audiotrack - 1)] + audiocmd
+            return (yield from self._concat(partfiles, outfile, inputs=audioinputs, options=audiooptions))
+        finally:
+            self._remove_workdir(workdir)
+
+    # --------------------------------------------
+    @operation
+    def split_video(self, infile, time='0', chunks=0, quality=22, audiotrack=None, copy=False, jobs=0):
+        '''time in seconds (also in 1m/1h format) or chunks - number of equal parts.
+        copy - split without re-encoding at the keyframes (parts start at the first keyframe after the split point),
+        otherwise parts are encoded in parallel ("jobs" at once, 0 - by CPU count)'''
+        if chunks == 0 and time == '0': return
+
+        infilebasename = os.path.basename(infile)
+        outfile = '{}.split_%03d.mp4'.format(os.path.splitext(infilebasename)[0])
+
+        info = self.probe(infile)
+        duration = info.duration
+        if chunks != 0:
+            length = duration / chunks
+        else:
+            length = self._parse_duration(time)
+        count = max(1, math.ceil(duration / length - 0.001))
+
+        # check if audio exists
+        audiocodeccmd = []
+        audiotrackcmd = self._there_is_audio(infile, audiotrack=audiotrack)
+        if audiotrackcmd:
+            audiocodeccmd = self._get_audiocodec()
+        else:
+            audiotrackcmd = []
+
+        if copy:
+            cmd = [
+                self.bins['ffmpeg']
+                , '-i', infile
+                , '-map', '0:v:0'
+                ]
+            cmd += audiotrackcmd
+            cmd += [
+                '-c', 'copy'
+                , '-f', 'segment'
+                , '-reset_timestamps', '1'
+                , '-segment_times', ','.join('{:.6f}'.format(length * i) for i in range(1, count))
+                , outfile
+                ]
+            yield Command(cmd)
+            return [outfile % n for n in range(count) if os.path.exists(outfile % n)]
+
+        preset = yield from self._get_preset(infile, quality)
+        if jobs <= 0:
+            jobs = max(1, get_cpucount() // JobScheduler.THREADSPERJOB['x264'])
+        jobs = min(jobs, count)
+        threads = max(1, (self.threads or get_cpucount()) // jobs) if jobs > 1 else self.threads
+
+        # split points at frames: -ss (relative to the container start) is a bit before the first frame of a part
+        # (accurate seek drops frames before it), -t is counted from the first frame (as in _get_chunks)
+        framerate = info.framerate or 25
+        frames = [round(length * n * framerate) for n in range(count)]
+        try:
+            videostart = float(info.videostream()['start_time'])
+        except (KeyError, TypeError, ValueError):
+            videostart = info.start_time
+
+        def encode(n):
+            partfile = outfile.replace('%03d', '{:03d}'.format(n))
+            start = max(0.0, videostart - info.start_time + frames[n] / framerate - 0.001) if n else None
+            partduration = (frames[n + 1] - frames[n]) / framerate - 0.001 if n + 1 < count else None
+            inputcmd, outputcmd = self._get_rangesettings(start, partduration)
+            cmd = [self.bins['ffmpeg'], '-y']
+            cmd += inputcmd
+            cmd += ['-i', infile]
+            cmd += outputcmd
+            cmd += ['-map', '0:v:0']
+            cmd += self._get_h264settings(quality, preset)
+            cmd += audiotrackcmd
+            cmd += audiocodeccmd
+            cmd += self._get_threadsettings(threads)
+            cmd += [partfile]
+            return (yield Command(cmd, outputs=[partfile]))
+
+        yield Parallel([encode(n) for n in range(count)], jobs)
+        return [outfile % n for n in range(count)]
+
+    # --------------------------------------------
+    def _parse_duration(self, duration):
+        '''"15", "2m", "1h" to seconds'''
+        multipliers = {'m': 60, 'h': 60 * 60}
+        multiplier = multipliers.get(duration[-1:], 1)
+        try:
+            seconds = float(duration[:-1] if multiplier != 1 else duration) * multiplier
+        except ValueError as e:
+            seconds = 0
+        if seconds <= 0:
+            raise InvalidArgumentError('Wrong time: "{}"\n\nUse time format: 1 - 1 sec, 1m - 1 min, 1h - 1 hour.'.format(duration))
+        return seconds
+
+    # --------------------------------------------
+    @operation
+    def convert_to_gif(self, infile, fps=10, outfile='outfile.gif', width=None, dither='sierra2_4a', targetsize=None, chunks=0):
+        '''width - scale down to this width (never up), dither - paletteuse dither mode,
+        targetsize ("5M") - choose fps, width and dither (not above the given ones) to fit the size,
+        chunks > 1 - encode time ranges in parallel and join them.
+        The palette is made from the scaled frames once and kept in the cache for re-runs'''
+        info = self.probe(infile)
+        if targetsize is not None:
+            fps, width, dither = yield from self._get_gifsettings(infile, self._parse_size(targetsize)[0], fps, width, dither)
+        palette = yield from self._get_palette(infile, fps, width)
+        filters = '{}[x];[x][1:v]paletteuse=dither={}'.format(self._get_giffilters(fps, width), dither)
+
+        def encode(start, duration, partfile, threads):
+            inputcmd, outputcmd = self._get_rangesettings(start, duration)
+            cmd = [self.bins['ffmpeg'], '-y']
+            cmd += inputcmd
+            cmd += outputcmd # before -i: limits the input, so fps filter gets no frames after the range
+            cmd += [
+                '-i', infile
+                , '-i', palette
+                , '-lavfi', filters
+                , '-loop', '0'
+                ]
+            cmd += self._get_threadsettings(threads)
+            cmd += [partfile]
+            return (yield Command(cmd, outputs=[partfile], duration=duration))
+
+        count = min(chunks, max(1, math.floor(info.duration * fps))) if chunks > 1 else 1
+        if count == 1:
+            result = yield from encode(None, None, outfile, self.threads)
+        else:
+            # ranges at output frames, so the parts have no extra or missing frames
+            frames = [round(info.duration * fps * n / count) for n in range(count + 1)]
+            threads = max(1, (self.threads or get_cpucount()) // count)
+            workdir = self._get_workdir(prefix='tmp-gif-', dir=os.path.dirname(os.path.abspath(outfile)))
+            try:
+                # all parts use one copy of the palette: the cache file can be trimmed or made again meanwhile
+                if not self.dryrun:
+                    shutil.copyfile(palette, os.path.join(workdir, 'palette.png'))
+                palette = os.path.join(workdir, 'palette.png')
+                partfiles = [os.path.join(workdir, 'part{:04d}.gif'.format(n)) for n in range(count)]
+                yield Parallel([encode(frames[n] / fps if n else None, (frames[n + 1] - frames[n]) / fps if n + 1 < count else None, partfiles[n], threads) for n in range(count)], count)
+                # all parts use the same palette: they are joined without re-encoding
+                result = yield from self._concat(partfiles, outfile, options=['-loop', '0'])
+            finally:
+                self._remove_workdir(workdir)
+
+        if targetsize is not None:
+            size = self._parse_size(targetsize)[0]
+            outsize = os.path.getsize(outfile)
+            self._info('"{}": {} Kb (target: {} Kb), {} fps, width {}, dither {}'.format(outfile, math.ceil(outsize / 1024), math.floor(size / 1024), fps, width or info.resolution[0], dither))
+        return result
+
+    # --------------------------------------------
+    def _get_giffilters(self, fps, width):
+        '''fps reduction and downscale: before palettegen and paletteuse, so they work on small frames only'''
+        filters = 'fps={}'.format(fps)
+        if width:
+            filters += ",scale='min({},iw)':-1:flags=lanczos".format(width)
+        return filters
+
+    # --------------------------------------------
+    def _get_palettepath(self, infile, fps, width):
+        '''Cache file of the palette of infile for fps and width (it may not exist yet): the key is file (path, size, mtime) and settings'''
+        stat = os.stat(infile)
+        key = json.dumps([os.path.abspath(infile), stat.st_size, stat.st_mtime_ns, fps, width])
+        try:
+            palettedir = os.path.join(get_cachedir(), 'palettes')
+            os.makedirs(palettedir, exist_ok=True)
+        except OSError:
+            palettedir = tempfile.gettempdir()
+        return os.path.join(palettedir, '{}.png'.format(hashlib.sha1(key.encode('utf-8')).hexdigest()))
+
+    # --------------------------------------------
+    def _get_palette(self, infile, fps, width):
+        '''Plan: returns the palette (png) of infile for fps and width.
+        Palettes are cached (see _get_palettepath), so re-runs and parts skip palettegen'''
+        palette = self._get_palettepath(infile, fps, width)
+        if os.path.exists(palette):
+            if not self.dryrun:
+                self._touch_cached([palette])
+            return palette
+        cmd = [
+            self.bins['ffmpeg']
+            , '-y'
+            , '-i', infile
+            , '-vf', '{},palettegen=stats_mode=full'.format(self._get_giffilters(fps, width))
+            ]
+        cmd += self._get_threadsettings()
+        cmd += [palette]
+        yield Command(cmd, outputs=[palette])
+        if not self.dryrun:
+            self._trim_cache(os.path.dirname(palette), self.CACHELIMITS['palettes'], keep=[palette])
+        return palette
+
+    # --------------------------------------------
+    def _get_gifsettings(self, infile, size, fps, width, dither, samplelength=3, tries=3):
+        '''Plan: returns (fps, width, dither) predicted to fit "size" bytes.
+        Samples from the middle of the file are encoded with each dither mode at the given fps and width;
+        GIF size is about proportional to pixels per second, so smaller settings are predicted from them.
+        The settings with the most pixels per second that fit (with 10% margin) win, they are checked
+        with one more sample and the prediction is corrected if it was wrong'''
+        info = self.probe(infile)
+        srcwidth = info.resolution[0]
+        maxwidth = min(width or srcwidth, srcwidth)
+        samplelength = min(samplelength, info.duration)
+        samplestart = max(0.0, (info.duration - samplelength) / 2)
+        dithers = list(dict.fromkeys([dither, 'bayer:bayer_scale=3', 'none']))
+
+        workdir = self._get_workdir(prefix='tmp-gifsample-')
+        try:
+            def sample(f, w, d):
+                '''Plan: returns bytes per second of the sample'''
+                samplefile = os.path.join(workdir, 'sample-{}-{}-{}.gif'.format(f, w, d.replace(':', '_')))
+                cmd = [
+                    self.bins['ffmpeg']
+                    , '-y'
+                    , '-ss', '{:.6f}'.format(samplestart)
+                    , '-t', '{:.6f}'.format(samplelength)
+                    , '-i', infile
+                    , '-lavfi', '{},split[a][b];[a]palettegen=stats_mode=full[p];[b][p]paletteuse=dither={}'.format(self._get_giffilters(f, w), d)
+                    , samplefile
+                    ]
+                yield Command(cmd, outputs=[samplefile], duration=samplelength)
+                return os.path.getsize(samplefile) / samplelength
+
+            rates = yield Parallel([sample(fps, maxwidth, d) for d in dithers], len(dithers))
+            widths = [w for w in [maxwidth, 640, 480, 400, 320, 240, 160, 120] if w <= maxwidth]
+            fpslist = [f for f in [fps, 15, 12, 10, 8, 6, 5] if f <= fps]
+            model = {}
+            for w in dict.fromkeys(widths):
+                for f in dict.fromkeys(fpslist):
+                    for d, rate in zip(dithers, rates):
+                        # key: pixels per second, then dither mode in the order of preference
+                        model[(w * w * f, -dithers.index(d))] = (rate * (w / maxwidth) ** 2 * (f / fps) * info.duration, f, w, d)
+            candidates = dict(model)
+            measured = {(maxwidth * maxwidth * fps, -n) for n in range(len(dithers))}
+            for attempt in range(tries):
+                fitting = [key for key, (predicted, *_) in candidates.items() if predicted * 1.1 <= size]
+                best = max(fitting) if fitting else min(candidates, key=lambda key: candidates[key][0])
+                if best in measured:
+                    break
+                modelled, f, w, d = model[best]
+                actual = (yield from sample(f, w, d)) * info.duration
+                measured.add(best)
+                # the model is wrong by about the same factor for the similar settings
+                correction = actual / modelled
+                for key, (predicted, *settings) in model.items():
+                    if key not in measured:
+                        candidates[key] = (predicted * correction, *settings)
+                candidates[best] = (actual, f, w, d)
+        finally:
+            self._remove_workdir(workdir)
+
+        predicted, fps, width, dither = candidates[best]
+        if predicted * 1.1 > size:
+            self._info('"{}": {} Kb is too small for gif, trying the smallest settings (~{} Kb).'.format(infile, math.floor(size / 1024), math.ceil(predicted / 1024)))
+        return fps, width if width < srcwidth else None, dither
+
+    # --------------------------------------------
+    @operation
+    def make_thumbnails(self, infile, count=16, columns=4, width=320, scenes=False, interval=None, sprite=False, spritewidth=160, outfile='outfile_thumbs.jpg'):
+        '''Contact sheet (outfile) of "count" keyframes evenly spaced or, with "scenes", keyframes with the most changes.
+        Only keyframes are decoded: frames are grabbed with input seeking and "-skip_frame nokey", in parallel.
+        A file with fewer keyframes than thumbnails gets frames at the exact times instead (accurate seeking, slower).
+        interval - one thumbnail every N seconds instead of "count",
+        sprite - also write <outfile root>_sprite.jpg (tiles of "spritewidth" pixels) and <outfile root>_sprite.vtt
+        (WebVTT cues with #xywh= tiles for scrubbing previews). Returns list of written files.'''
+        info = self.probe(infile)
+        stream = info.videostream()
+        if stream is None:
+            raise InvalidArgumentError('No video stream in "{}".'.format(infile))
+        if interval:
+            count = max(1, math.ceil(info.duration / interval))
+        count = max(1, count)
+
+        # thumbnail sizes keep the display aspect ratio
+        inwidth, inheight = info.resolution
+        sarnum, _, sarden = stream.get('sample_aspect_ratio', '1:1').partition(':')
+        try:
+            sar = int(sarnum) / int(sarden) or 1.0
+        except (ValueError, ZeroDivisionError):
+            sar = 1.0
+        aspect = inwidth * sar / inheight
+        size = lambda w: (w, max(2, int(round(w / aspect / 2)) * 2))
+
+        root, extension = os.path.splitext(outfile)
+        spritefile = '{}_sprite{}'.format(root, extension)
+        vttfile = '{}_sprite.vtt'.format(root)
+        workdir = self._get_workdir(prefix='tmp-thumbs-', dir=os.path.dirname(os.path.abspath(outfile)))
+        try:
+            # the middles of equal parts (relative to the start of the file)
+            targets = [info.duration * (2 * i + 1) / (2 * count) for i in range(count)]
+            if scenes:
+                times = yield from self._get_scenekeyframes(infile, count, workdir)
+            else:
+                # keyframes nearest to the targets
+                keyframes = [keytime - info.start_time for keytime in (yield from self._get_keyframes(infile))]
+                times = []
+                for target in targets:
+                    n = bisect_left(keyframes, target)
+                    nearest = min(keyframes[max(n - 1, 0):n + 1], key=lambda keytime: abs(keytime - target), default=None)
+                    if nearest is not None and nearest not in times:
+                        times.append(nearest)
+            accurate = len(times) < count
+            if accurate:
+                self._info('"{}": {} keyframes for {} thumbnails, decoding frames at the exact times (slower).'.format(infile, len(times), count))
+                times = targets
+
+            def grab(n, start, threads):
+                cmd = [self.bins['ffmpeg'], '-y']
+                if not accurate:
+                    # -ss a bit before the keyframe: accurate seek drops the keyframe before it, the first frame is this one
+                    cmd += ['-skip_frame', 'nokey']
+                    start = max(start - 0.001, 0.0)
+                cmd += [
+                    '-ss', '{:.6f}'.format(start)
+                    , '-i', infile
+                    , '-map', '0:v:0'
+                    , '-frames:v', '1'
+                    , '-vf', 'scale={}:{},setsar=1'.format(*size(width))
+                    , '-q:v', '3'
+                    ]
+                cmd += self._get_threadsettings(threads)
+                cmd += [os.path.join(workdir, 'thumb{:05d}.jpg'.format(n))]
+                return (yield Command(cmd))
+            workers = max(1, min(len(times), self.threads or get_cpucount()))
+            yield Parallel([grab(n, start, 1) for n, start in enumerate(times)], workers)
+
+            def tile(tilewidth, padding, tilefile):
+                rows = math.ceil(len(times) / columns)
+                cmd = [
+                    self.bins['ffmpeg']
+                    , '-f', 'image2'
+                    , '-start_number', '0'
+                    , '-i', os.path.join(workdir, 'thumb%05d.jpg')
+                    , '-vf', 'scale={}:{},tile={}x{}:padding={p}:margin={p}'.format(*size(tilewidth), min(columns, len(times)), rows, p=padding)
+                    , '-frames:v', '1'
+                    , '-q:v', '3'
+                    , tilefile
+                    ]
+                return (yield Command(cmd, outputs=[tilefile]))
+            yield from tile(width, 4, outfile)
+            if not sprite:
+                return [outfile]
+
+            yield from tile(spritewidth, 0, spritefile)
+            # cue of a thumbnail: from its keyframe (the first one from 0) to the next one
+            tilewidth, tileheight = size(spritewidth)
+            bounds = [0.0] + times[1:] + [max(info.duration, times[-1])]
+            timestamp = lambda seconds: '{:02d}:{:02d}:{:06.3f}'.format(int(seconds // 3600), int(seconds % 3600 // 60), seconds % 60)
+            lines = ['WEBVTT', '']
+            for n in range(len(times)):
+                lines += [
+                    '{} --> {}'.format(timestamp(bounds[n]), timestamp(bounds[n + 1]))
+                    , '{}#xywh={},{},{},{}'.format(os.path.basename(spritefile), n % columns * tilewidth, n // columns * tileheight, tilewidth, tileheight)
+                    , ''
+                    ]
+            if not self.dryrun:
+                tmpfile = os.path.join(workdir, os.path.basename(vttfile))
+                with open(tmpfile, 'w', encoding='utf-8') as f:
+                    f.write('\n'.join(lines))
+                shutil.move(tmpfile, vttfile)
+            return [outfile, spritefile, vttfile]
+        finally:
+            self._remove_workdir(workdir)
+
+    # --------------------------------------------
+    def _get_scenekeyframes(self, infile, count, workdir):
+        '''Plan: returns timestamps (relative to the start of the file) of "count" keyframes most different from the keyframe
+        before them (scene score of the select filter), in time order. Only keyframes are decoded (small copies are compared).'''
+        escape = lambda path: path.replace('\\', '/').replace(':', '\\\\:')
+        scenefile = os.path.join(workdir, 'scenes.txt')
+        cmd = [
+            self.bins['ffmpeg']
+            , '-y'
+            , '-skip_frame', 'nokey'
+            , '-i', infile
+            , '-map', '0:v:0'
+            , '-vf', "scale=160:-2,select='gte(scene\\,0)',metadata=print:file={}".format(escape(scenefile))
+            , '-f', 'null', '-'
+            ]
+        cmd += self._get_threadsettings()
+        yield Command(cmd)
+        keyframes = []
+        with open(scenefile, encoding='utf-8') as f:
+            for line in f:
+                if line.startswith('frame:'):
+                    keyframes.append([float(line.split('pts_time:')[1].split()[0]), 0.0])
+                elif line.startswith('lavfi.scene_score=') and keyframes:
+                    keyframes[-1][1] = float(line.split('=')[1])
+        # the first keyframe always opens the sheet
+        if keyframes:
+            keyframes[0][1] = 2.0
+        return sorted(keytime for keytime, score in sorted(keyframes, key=lambda keyframe: -keyframe[1])[:count])
+
+    # --------------------------------------------
+    @operation
+    def convert_to_webm(self, infile, quality=31, audiotrack=None, resume=False, segmentlength=300, outfile='outfile.webm'):
+        '''resume - encode in keyframe-aligned segments of about "segmentlength" seconds with a checkpoint,
+        so the encode killed before the end continues from the last finished segment when started again'''
+
+        # check video codec
+        if self.probe(infile).videocodec == 'vp8':
+            self._info('"{}" is already webm, skipped.'.format(infile))
+            return False
+
+        # check if audio exists
+        audiocodeccmd = []
+        audiotrackcmd = self._there_is_audio(infile, audiotrack=audiotrack)
+        if audiotrackcmd:
+            audiocodeccmd = self._get_audiocodec()
+        else:
+            audiotrackcmd = []
+
+        if resume:
+            def encode(infile, start, duration, segmentfile):
+                inputcmd, outputcmd = self._get_rangesettings(start, duration)
+                cmd = [self.bins['ffmpeg'], '-y']
+                cmd += inputcmd
+                cmd += ['-i', infile]
+                cmd += outputcmd
+                cmd += ['-map', '0:v:0']
+                cmd += self._get_vp9settings(quality)
+                cmd += ['-an']
+                cmd += self._get_threadsettings()
+                cmd += [segmentfile]
+                return (yield Command(cmd, outputs=[segmentfile]))
+            def audio(audiofile):
+                cmd = [
+                    self.bins['ffmpeg']
+                    , '-y'
+                    , '-i', infile
+                    ]
+                cmd += audiotrackcmd
+                cmd += audiocodeccmd
+                cmd += [audiofile]
+                return (yield Command(cmd, outputs=[audiofile]))
+            settings = {'operation': 'convert_to_webm', 'quality': quality, 'audiotrack': audiotrack}
+            return (yield from self._encode_resumable([infile], settings, segmentlength, encode, audio if audiotrackcmd else None, outfile))
+
+        cmd = [
+            self.bins['ffmpeg']
+            , '-i', infile
+            , '-map', '0:v:0'
+            ]
+        cmd += audiotrackcmd
+        cmd += audiocodeccmd
+        cmd += self._get_vp9settings(quality)
+        cmd += self._get_threadsettings()
+        cmd += [outfile]
+        return (yield Command(cmd, outputs=[outfile]))
+
+    # --------------------------------------------
+    @operation
+    def convert_to_x264(self, infile, quality=22, audiotrack=None, chunks=0, outfile='outfile.mp4'):
+        '''chunks > 1 - split the file at keyframes and encode parts in parallel'''
+
+        # check video codec
+        if self.probe(infile).videocodec == 'h264':
+            self._info('"{}" is already h264, skipped.'.format(infile))
+            return False
+
+        inwidth, inheight = self._get_resolution(infile)
+        outwidth = self._lead_to_divisibility_by_2(inwidth)
+        outheight = self._lead_to_divisibility_by_2(inheight)
+        
+        # check if audio exists
+        audiocodeccmd = []
+        audiotrackcmd = self._there_is_audio(infile, audiotrack=audiotrack)
+        if audiotrackcmd:
+            audiocodeccmd = self._get_audiocodec()
+        else:
+            audiotrackcmd = []
+
+        scalecmd = []
+        if inwidth != outwidth or inheight != outheight: scalecmd = ['-vf', 'scale={}:{}, setsar=1:1'.format(outwidth, outheight)]
+        preset = yield from self._get_preset(infile, quality)
+
+        if chunks > 1:
+            def encode(start, duration, chunkfiles, threads):
+                inputcmd, outputcmd = self._get_rangesettings(start, duration)
+                cmd = [self.bins['ffmpeg'], '-y']
+                cmd += inputcmd
+                cmd += ['-i', infile]
+                cmd += outputcmd
+                cmd += ['-map', '0:v:0']
+                cmd += scalecmd
+                cmd += self._get_h264settings(quality, preset)
+                cmd += ['-an']
+                cmd += self._get_threadsettings(threads)
+                cmd += chunkfiles
+                return (yield Command(cmd))
+            return (yield from self._encode_chunked(infile, chunks, encode, audiotrack=audiotrack or 1, audiocmd=audiocodeccmd, outfiles=[outfile]))
+
+        cmd = [
+            self.bins['ffmpeg']
+            , '-i', infile
+            , '-map', '0:v:0'
+            ]
+        cmd += scalecmd
+        cmd += self._get_h264settings(quality, preset)
+        cmd += audiotrackcmd
+        cmd += audiocodeccmd
+        cmd += self._get_threadsettings()
+        cmd += [outfile]
+        return (yield Command(cmd, outputs=[outfile]))
+
+    # --------------------------------------------
+    @operation
+    def convert_to_mp3(self, infile, audiotrack=None, quality=4, copy=False, outfile='outfile.mp3'):
+        '''audiotrack - track number, list of numbers or "all": all tracks are extracted by one ffmpeg process
+        (outfile - list of names or one name: "<name>_<track>.mp3" for several tracks),
+        copy - keep mp3 and AAC (as .m4a) tracks without re-encoding, other codecs are encoded to mp3'''
+        info = self.probe(infile)
+        if audiotrack == 'all':
+            tracks = list(range(1, len(info.audio) + 1))
+            if not tracks:
+                raise AudioTrackNotFoundError('No audio tracks in "{}"'.format(infile))
+        elif isinstance(audiotrack, (list, tuple)):
+            tracks = list(audiotrack)
+        else:
+            tracks = [audiotrack or 1]
+        for track in tracks:
+            self._there_is_audio(infile, audiotrack=track, wrongtrackexit=True)
+
+        if isinstance(outfile, str):
+            if len(tracks) > 1:
+                root, extension = os.path.splitext(outfile)
+                outfiles = ['{}_{}{}'.format(root, track, extension) for track in tracks]
+            else:
+                outfiles = [outfile]
+        else:
+            outfiles = list(outfile)
+        if len(outfiles) != len(tracks):
+            raise InvalidArgumentError('Number of audio tracks and output files must be the same.')
+
+        cmd = [
+            self.bins['ffmpeg']
+            , '-i', infile]
+        for n, track in enumerate(tracks):
+            codec = info.audiostream(track).get('codec_name')
+            cmd += ['-map', '0:a:{}'.format(track - 1)]
+            if copy and codec in ('mp3', 'aac'):
+                outfiles[n] = '{}.{}'.format(os.path.splitext(outfiles[n])[0], 'mp3' if codec == 'mp3' else 'm4a')
+                cmd += ['-c:a', 'copy']
+            else:
+                if copy:
+                    self._info('Audio track #{} of "{}" is {}, encoding to mp3.'.format(track, infile, codec))
+                cmd += self._get_audiocodec(codec='libmp3lame')
+                cmd += [
+                      '-q:a', str(quality)
+                    , '-ar', '48000'
+                    ]
+                cmd += self._get_threadsettings()
+            cmd += [outfiles[n]]
+        yield Command(cmd, outputs=outfiles)
+        return outfiles
+
+    # --------------------------------------------
+    PIPELINESTEPS = {'cut': ('a', 'b'), 'resize': ('m', 'r'), 'to264': ('q',), 'towebm': ('q',), 'tomp3': ('q',), 'togif': ('x', 'w', 'dither')}
+    PIPELINEOUTPUTS = {'to264': 'mp4', 'towebm': 'webm', 'tomp3': 'mp3', 'togif': 'gif'}
+
+    # --------------------------------------------
+    def _parse_step(self, step):
+        '''"resize:m=0.5" or ('resize', {'m': 0.5}) to ('resize', {'m': '0.5'})'''
+        if isinstance(step, str):
+            name, _, params = step.partition(':')
+            params = dict(param.partition('=')[::2] for param in params.split(',') if param)
+        else:
+            name, params = step
+            params = {key: str(value) for key, value in params.items()}
+        if name not in self.PIPELINESTEPS:
+            raise InvalidArgumentError('Unknown step: "{}". Steps: {}.'.format(name, ', '.join(self.PIPELINESTEPS)))
+        for key in params:
+            if key not in self.PIPELINESTEPS[name]:
+                raise InvalidArgumentError('Unknown parameter of "{}": "{}". Parameters: {}.'.format(name, key, ', '.join(self.PIPELINESTEPS[name])))
+        return name, params
+
+    # --------------------------------------------
+    @operation
+    def pipeline(self, infile, steps, audiotrack=None, outfile=None):
+        '''Runs a chain of steps as one ffmpeg process (one decode, one encode):
+        cut:a=START,b=END (input seeking), resize:m=MULTIPLIER or resize:r=WxH (one scale filter),
+        then one output step - to264:q=N (default), towebm:q=N, tomp3:q=N or togif:x=FPS,w=WIDTH,dither=MODE.
+        Steps are strings as above or (name, {param: value}) tuples; every step works on the result of the previous one.
+        outfile - by default "<name>_pipeline.<extension of the output step>"'''
+        steps = [self._parse_step(step) for step in steps]
+        output, options = steps.pop() if steps and steps[-1][0] in self.PIPELINEOUTPUTS else ('to264', {})
+        for name, params in steps:
+            if name in self.PIPELINEOUTPUTS:
+                raise InvalidArgumentError('"{}" must be the last step.'.format(name))
+        if outfile is None:
+            outfile = '{}_pipeline.{}'.format(os.path.splitext(os.path.basename(infile))[0], self.PIPELINEOUTPUTS[output])
+
+        # cuts: the range of every cut is counted from the start of the previous one
+        start = 0.0
+        duration = None
+        width, height = self._get_resolution(infile)
+        resized = False
+        for name, params in steps:
+            if name == 'cut':
+                a = self._parse_timestamp(params['a']) if params.get('a', '-1') != '-1' else 0.0
+                b = self._parse_timestamp(params['b']) if params.get('b', '-1') != '-1' else None
+                start += a
+                if duration is not None:
+                    duration = max(0.0, duration - a)
+                if b is not None:
+                    duration = b - a if duration is None else min(duration, b - a)
+            elif name == 'resize':
+                # only the final size matters: one scale from the source is faster and sharper than several
+                if 'r' in params:
+                    width, height = (int(value) for value in params['r'].split('x'))
+                else:
+                    scale = float(params.get('m', 1))
+                    width, height = int(width * scale), int(height * scale)
+                width = self._lead_to_divisibility_by_2(width)
+                height = self._lead_to_divisibility_by_2(height)
+                resized = True
+        videofilters = ['scale={}:{}'.format(width, height), 'setsar=1:1'] if resized else []
+
+        inputcmd, outputcmd = self._get_rangesettings(start or None, duration)
+        cmd = [self.bins['ffmpeg']]
+        cmd += inputcmd
+        cmd += ['-i', infile]
+        cmd += outputcmd
+
+        if output == 'tomp3':
+            audiotrackcmd = self._there_is_audio(infile, audiotrack=audiotrack, wrongtrackexit=True)
+            cmd += ['-vn']
+            cmd += audiotrackcmd
+            cmd += self._get_audiocodec(codec='libmp3lame')
+            cmd += ['-q:a', options.get('q', '4'), '-ar', '48000']
+        elif output == 'togif':
+            fps = float(options.get('x', 10))
+            fps = int(fps) if fps.is_integer() else fps
+            width = int(options['w']) if options.get('w') else None
+            videofilters.append(self._get_giffilters(fps, width))
+            cmd += [
+                '-lavfi', '{},split[a][b];[a]palettegen=stats_mode=full[p];[b][p]paletteuse=dither={}'.format(','.join(videofilters), options.get('dither', 'sierra2_4a'))
+                , '-loop', '0'
+                ]
+        else:
+            cmd += ['-map', '0:v:0']
+            if videofilters:
+                cmd += ['-vf', ','.join(videofilters)]
+            if output == 'to264':
+                quality = int(options.get('q', 22))
+                cmd += self._get_h264settings(quality, (yield from self._get_preset(infile, quality)))
+            else:
+                cmd += self._get_vp9settings(int(options.get('q', 31)))
+            audiotrackcmd = self._there_is_audio(infile, audiotrack=audiotrack)
+            if audiotrackcmd:
+                cmd += audiotrackcmd
+                cmd += self._get_audiocodec()
+        cmd += self._get_threadsettings()
+        cmd += [outfile]
+        yield Command(cmd, outputs=[outfile])
+        return [outfile]
+
+    # --------------------------------------------
+    def _parse_outputs(self, outputs):
+        '''Output steps of multi, see _parse_step'''
+        outputs = [self._parse_step(output) for output in outputs]
+        for name, options in outputs:
+            if name not in self.PIPELINEOUTPUTS:
+                raise InvalidArgumentError('"{}" is not an output step. Outputs: {}.'.format(name, ', '.join(self.PIPELINEOUTPUTS)))
+        return outputs
+
+    # --------------------------------------------
+    def get_multioutfiles(self, infile, outputs):
+        '''Default output files of multi: "<name>.<extension>", "<name>_2.<extension>" for the second file
+        of the same type (the input counts as the first one: it is never overwritten)'''
+        base = os.path.splitext(os.path.basename(infile))[0]
+        outfiles = []
+        taken = [os.path.basename(infile)]
+        for name, options in self._parse_outputs(outputs):
+            extension = self.PIPELINEOUTPUTS[name]
+            n = len([name for name in taken if name.endswith('.' + extension)])
+            outfile = '{}{}.{}'.format(base, '_{}'.format(n + 1) if n else '', extension)
+            outfiles.append(outfile)
+            taken.append(outfile)
+        return outfiles
+
+    # --------------------------------------------
+    @operation
+    def multi(self, infile, outputs, audiotrack=None, outfiles=None):
+        '''Decodes infile once and writes several outputs from one ffmpeg process.
+        outputs - output steps as in pipeline: "to264:q=22", "towebm:q=31", "tomp3:q=4", "togif:x=10,w=320,dither=bayer"
+        (strings or (name, {param: value}) tuples), every one with the settings and checks of its own operation
+        (to264 of h264 and towebm of vp8 video are skipped). outfiles - by default see get_multioutfiles.
+        A gif palette is taken from the cache (see _get_palette) or made in the same graph: the scaled frames go to palettegen
+        and to a lossless intermediate file, paletteuse makes the gif from them in a second (small) process.
+        Returns the list of written files'''
+        outputs = self._parse_outputs(outputs)
+        if outfiles is None:
+            outfiles = self.get_multioutfiles(infile, outputs)
+        if len(outfiles) != len(outputs):
+            raise InvalidArgumentError('Number of outputs and output files must be the same.')
+
+        # the checks of convert_to_x264 and convert_to_webm
+        videocodec = self.probe(infile).videocodec
+        jobs = []
+        for (name, options), outfile in zip(outputs, outfiles):
+            if (name, videocodec) in (('to264', 'h264'), ('towebm', 'vp8')):
+                self._info('"{}" is already {}, "{}" skipped.'.format(infile, videocodec, outfile))
+            else:
+                jobs.append((name, options, outfile))
+        if not jobs:
+            return False
+
+        inwidth, inheight = self._get_resolution(infile)
+        videooutputs = [n for n, (name, options, outfile) in enumerate(jobs) if name != 'tomp3']
+        audiotrackcmd = self._there_is_audio(infile, audiotrack=audiotrack, wrongtrackexit='tomp3' in [job[0] for job in jobs]) or []
+
+        # one decoded video stream for all video outputs
+        graph = []
+        if len(videooutputs) > 1:
+            graph.append('[0:v:0]split={}{}'.format(len(videooutputs), ''.join('[v{}]'.format(n) for n in videooutputs)))
+        labels = {n: '[v{}]'.format(n) if len(videooutputs) > 1 else '[0:v:0]' for n in videooutputs}
+
+        workdir = None
+        palettes = [] # extra inputs after infile
+        gifs = [] # (intermediate, palette, dither, outfile) made by the second process
+        outputcmd = []
+        written = []
+        for n, (name, options, outfile) in enumerate(jobs):
+            if name == 'tomp3':
+                outputcmd += ['-vn']
+                outputcmd += audiotrackcmd
+                outputcmd += self._get_audiocodec(codec='libmp3lame')
+                outputcmd += ['-q:a', options.get('q', '4'), '-ar', '48000']
+            elif name == 'togif':
+                fps = float(options.get('x', 10))
+                fps = int(fps) if fps.is_integer() else fps
+                width = int(options['w']) if options.get('w') else None
+                dither = options.get('dither', 'sierra2_4a')
+                palette = self._get_palettepath(infile, fps, width)
+                if os.path.exists(palette):
+                    if not self.dryrun:
+                        self._touch_cached([palette])
+                    palettes.append(palette)
+                    graph.append('{}{}[g{n}];[g{n}][{}:v]paletteuse=dither={}[o{n}]'.format(labels[n], self._get_giffilters(fps, width), len(palettes), dither, n=n))
+                    outputcmd += ['-map', '[o{}]'.format(n), '-loop', '0']
+                else:
+                    # paletteuse needs the whole palette before the first frame: the frames wait in a file, not in memory
+                    if workdir is None:
+                        workdir = self._get_workdir(prefix='tmp-multi-', dir=os.path.dirname(os.path.abspath(outfile)))
+                    intermediate = os.path.join(workdir, '{}.mkv'.format(n))
+                    graph.append('{}{},split[g{n}][p{n}];[p{n}]palettegen=stats_mode=full[o{n}]'.format(labels[n], self._get_giffilters(fps, width), n=n))
+                    outputcmd += ['-map', '[o{}]'.format(n), '-update', '1']
+                    outputcmd += self._get_threadsettings()
+                    outputcmd += [palette]
+                    outputcmd += ['-map', '[g{}]'.format(n), '-c:v', 'ffv1']
+                    outputcmd += self._get_threadsettings()
+                    outputcmd += [intermediate]
+                    written.append(palette)
+                    gifs.append((intermediate, palette, dither, outfile))
+                    continue
+            else:
+                outwidth = self._lead_to_divisibility_by_2(inwidth)
+                outheight = self._lead_to_divisibility_by_2(inheight)
+                if name == 'to264' and (outwidth != inwidth or outheight != inheight):
+                    graph.append('{}scale={}:{},setsar=1:1[o{}]'.format(labels[n], outwidth, outheight, n))
+                    outputcmd += ['-map', '[o{}]'.format(n)]
+                else:
+                    outputcmd += ['-map', labels[n] if len(videooutputs) > 1 else '0:v:0']
+                if name == 'to264':
+                    quality = int(options.get('q', 22))
+                    outputcmd += self._get_h264settings(quality, (yield from self._get_preset(infile, quality)))
+                else:
+                    outputcmd += self._get_vp9settings(int(options.get('q', 31)))
+                if audiotrackcmd:
+                    outputcmd += audiotrackcmd
+                    outputcmd += self._get_audiocodec()
+            outputcmd += self._get_threadsettings()
+            outputcmd += [outfile]
+            written.append(outfile)
+
+        cmd = [
+            self.bins['ffmpeg']
+            , '-i', infile
+            ]
+        for palette in palettes:
+            cmd += ['-i', palette]
+        if graph:
+            cmd += ['-filter_complex', ';'.join(graph)]
+        cmd += outputcmd
+        try:
+            yield Command(cmd, outputs=written)
+            if gifs and not self.dryrun:
+                self._trim_cache(os.path.dirname(gifs[0][1]), self.CACHELIMITS['palettes'], keep=[gif[1] for gif in gifs])
+            for intermediate, palette, dither, outfile in gifs:
+                cmd = [
+                    self.bins['ffmpeg']
+                    , '-i', intermediate
+                    , '-i', palette
+                    , '-lavfi', '[0:v][1:v]paletteuse=dither={}'.format(dither)
+                    , '-loop', '0'
+                    ]
+                cmd += self._get_threadsettings()
+                cmd += [outfile]
+                yield Command(cmd, outputs=[outfile])
+        finally:
+            if workdir is not None:
+                self._remove_workdir(workdir)
+        return [job[2] for job in jobs]
+
+
+class AsyncVideoTool:
+    '''Awaitable VideoTool operations: many of them run from one asyncio event loop without a thread per job.
+    timeout - seconds for one operation. A timed out or cancelled operation kills the process group of its ffmpeg,
+    removes its temporary outputs and pass logs, and raises asyncio.TimeoutError / asyncio.CancelledError.'''
+
+    # --------------------------------------------
+    def __init__(self, videotool=None, timeout=None, killtimeout=5):
+        self.videotool = videotool or VideoTool()
+        self.timeout = timeout
+        self.killtimeout = killtimeout # seconds between SIGTERM and SIGKILL
+
+    # --------------------------------------------
+    async def run(self, method, *args, timeout=None, **kwargs):
+        '''Runs VideoTool operation (ex. VideoTool.convert_to_x264 or its name) with its arguments, returns Result.
+        Every operation is also a method of AsyncVideoTool: await tool.convert_to_x264(...)'''
+        if isinstance(method, str):
+            method = OPERATIONS[method]
+        inputs = kwargs.get('infile', kwargs.get('files', args[0] if args else []))
+        for file in [inputs] if isinstance(inputs, str) else inputs:
+            await self.probe(file)
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        value = await asyncio.wait_for(self._drive(method.plan(self.videotool, *args, **kwargs)), timeout)
+        return self.videotool._get_result(method.plan, args, kwargs, value, started)
+
+    # --------------------------------------------
+    async def probe(self, file) -> MediaInfo:
+        '''VideoTool.probe without blocking the event loop'''
+        vt = self.videotool
+        info = vt._get_probed(file)
+        if info is None:
+            info = vt._set_probed(file, await self._run_command(Command(vt._get_probecmd(file), capture=True)))
+        return info
+
+    # --------------------------------------------
+    async def _drive(self, plan):
+        '''Runs an operation plan (see VideoTool._drive) in the event loop. The code of the plan between its requests
+        (ex. probes of the files it made, indexes, checks of the results) runs in the default executor: it never blocks the loop'''
+        loop = asyncio.get_running_loop()
+
+        def step(result, error):
+            # StopIteration can not be set to a future: returns (finished, request or return value)
+            try:
+                return False, plan.send(result) if error is None else plan.throw(error)
+            except StopIteration as e:
+                return True, e.value
+
+        result, error = None, None
+        while True:
+            future = loop.run_in_executor(None, step, result, error)
+            try:
+                finished, request = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # the step can not be stopped in its thread: the plan is closed when it ends, so the cleanup
+                # of the plan (temporary outputs, work directories) is done before the cancellation is raised
+                try:
+                    finished, request = await future
+                except BaseException:
+                    finished = True
+                if not finished:
+                    await loop.run_in_executor(None, plan.close)
+                raise
+            if finished:
+                return request
+            result, error = None, None
+            try:
+                if isinstance(request, Parallel):
+                    result = await self._parallel(request)
+                else:
+                    result = await self._run_command(request)
+            except BaseException as e:
+                error = e
+
+    # --------------------------------------------
+    async def _parallel(self, request):
+        '''Runs plans of Parallel as tasks, cancels the rest on the first error'''
+        semaphore = asyncio.Semaphore(request.workers)
+
+        async def limited(plan):
+            async with semaphore:
+                return await self._drive(plan)
+
+        tasks = [asyncio.ensure_future(limited(plan)) for plan in request.plans]
+        try:
+            return await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    # --------------------------------------------
+    async def _run_command(self, request):
+        '''Runs Command in a new process group (see VideoTool._run_command)'''
+        vt = self.videotool
+        if os.name == 'posix':
+            newgroup = {'start_new_session': True}
+        else:
+            newgroup = {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+        started = time.monotonic()
+        if request.capture:
+            proc = await asyncio.create_subprocess_exec(*request.cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **newgroup)
+            try:
+                out, err = await proc.communicate()
+            except BaseException:
+                await self._kill(proc)
+                raise
+            finally:
+                vt._add_stats('ffprobe', started)
+            return out.decode('utf-8', errors='replace')
+
+        cmd, temps = vt._get_tempoutputs(request)
+        cmd = vt._get_quietcmd(cmd)
+        stdout = None
+        jobid = None
+        if vt.progress:
+            jobid = vt.progress.start(vt._get_cmdlabel(request.cmd), request.duration or vt._get_cmdduration(request.cmd))
+            cmd = cmd[:1] + ['-progress', 'pipe:1'] + cmd[1:]
+            stdout = subprocess.PIPE
+        proc = None
+        try:
+            proc = await asyncio.create_subprocess_exec(*cmd, stdin=subprocess.DEVNULL, stdout=stdout, **newgroup)
+            if stdout:
+                async for line in proc.stdout:
+                    vt.progress.feed(jobid, line.decode('utf-8', errors='replace'))
+            await proc.wait()
+        except BaseException:
+            if proc is not None:
+                await self._kill(proc)
+            vt._remove_files(temp for temp, outfile in temps)
+            raise
+        finally:
+            if jobid is not None:
+                vt.progress.finish(jobid, proc.returncode if proc else None)
+        vt._add_stats('ffmpeg', started)
+        result = vt._commit_outputs(request.cmd, proc.returncode, temps)
+        vt._learn_speed(request, time.monotonic() - started)
+        return result
+
+    # --------------------------------------------
+    async def _kill(self, proc):
+        '''Terminates the process group, kills it if it is still alive after killtimeout'''
+        if proc.returncode is not None:
+            return
+        VideoTool._terminate(proc, group=True)
+        try:
+            await asyncio.wait_for(proc.wait(), self.killtimeout)
+        except asyncio.TimeoutError:
+            VideoTool._terminate(proc, force=True, group=True)
+            await proc.wait()
+
+
+# --------------------------------------------
+def _add_asyncoperations():
+    '''Adds an awaitable method to AsyncVideoTool for every VideoTool operation (see OPERATIONS)'''
+    def make(method):
+        async def asyncmethod(self, *args, timeout=None, **kwargs):
+            return await self.run(method, *args, timeout=timeout, **kwargs)
+        asyncmethod.__name__ = method.__name__
+        asyncmethod.__qualname__ = 'AsyncVideoTool.{}'.format(method.__name__)
+        asyncmethod.__doc__ = method.__doc__
+        return asyncmethod
+
+    for name, method in OPERATIONS.items():
+        setattr(AsyncVideoTool, name, make(method))
+
+
+_add_asyncoperations()
+
+
+class Manifest:
+    '''Inputs and encode parameters of the output files in a directory (JSON file next to them).
+    An output is up to date (like in make) if it was not changed and was made from the same input with the same parameters.'''
+
+    NAME = '.ffeasytool-manifest.json'
+
+    # --------------------------------------------
+    def __init__(self, directory):
+        self.path = os.path.join(directory, self.NAME)
+        self._lock = threading.Lock()
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    # --------------------------------------------
+    @staticmethod
+    def get_hash(file):
+        '''Content hash of a file (blake2b)'''
+        digest = hashlib.blake2b(digest_size=20)
+        with open(file, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    # --------------------------------------------
+    def get_outputs(self, outfile):
+        '''Files made by ffeasytool for outfile (they can be replaced): outfile itself or the files named by the operation'''
+        with self._lock:
+            entry = self.entries.get(os.path.basename(outfile))
+        if entry is None:
+            return []
+        return list(entry['outputs']) if 'outputs' in entry else [os.path.abspath(outfile)]
+
+    # --------------------------------------------
+    def is_uptodate(self, infile, outfile, params, usehash=False):
+        '''usehash - an input with another mtime is the same if its content hash is the same. Changes nothing (see refresh)'''
+        with self._lock:
+            entry = self.entries.get(os.path.basename(outfile))
+        if entry is None or entry['params'] != json.loads(json.dumps(params)) or entry['input'] != os.path.abspath(infile):
+            return False
+        outputs = entry['outputs'] if 'outputs' in entry else {os.path.abspath(outfile): entry['output']}
+        try:
+            inst = os.stat(infile)
+            outsts = {path: os.stat(path) for path in outputs}
+        except OSError:
+            return False
+        if any([outsts[path].st_size, outsts[path].st_mtime_ns] != output for path, output in outputs.items()) or inst.st_size != entry['size']:
+            return False
+        if inst.st_mtime_ns == entry['mtime']:
+            return True
+        return usehash and entry.get('hash') is not None and entry['hash'] == self.get_hash(infile)
+
+    # --------------------------------------------
+    def refresh(self, infile, outfile):
+        '''Stores the mtime of an up to date input (same content, see is_uptodate): the next check does not need the hash'''
+        mtime = os.stat(infile).st_mtime_ns
+        with self._lock:
+            entry = self.entries.get(os.path.basename(outfile))
+            if entry is not None and entry['mtime'] != mtime:
+                entry['mtime'] = mtime
+                self._save()
+
+    # --------------------------------------------
+    def record(self, infile, outfile, params, usehash=False, outputs=None):
+        '''Stores an output made from infile with params. outputs - all files made for outfile (outfile by default)'''
+        inst = os.stat(infile)
+        outsts = {os.path.abspath(path): os.stat(path) for path in (outputs or [outfile])}
+        entry = {
+            'input': os.path.abspath(infile)
+            , 'size': inst.st_size
+            , 'mtime': inst.st_mtime_ns
+            , 'hash': self.get_hash(infile) if usehash else None
+            , 'params': params
+            , 'outputs': {path: [st.st_size, st.st_mtime_ns] for path, st in outsts.items()}
+            }
+        with self._lock:
+            self.entries[os.path.basename(outfile)] = entry
+            self._save()
+
+    # --------------------------------------------
+    def _save(self):
+        try:
+            with open(self.path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(self.entries, f, indent=1)
+            os.replace(self.path + '.tmp', self.path)
+        except OSError as e:
+            log.warning('Manifest is not saved: {}'.format(e))
+
+
+class JobScheduler:
+    '''Runs VideoTool methods for many files at once and splits CPU cores between ffmpeg processes'''
+
+    # cores one ffmpeg process of each kind can keep busy. Used for "auto" number of jobs.
+    THREADSPERJOB = {'x264': 4, 'vp9': 4, 'mp3': 1, 'gif': 1, 'thumbs': 1}
+
+    # --------------------------------------------
+    def __init__(self, videotool, jobs=0, kind='x264', force=False, usehash=False):
+        '''Jobs with "infile" and "outfile" (or "outfiles") keyword arguments are skipped if the output is up to date (see Manifest),
+        force - do them anyway, usehash - compare content of inputs with another mtime'''
+        self.videotool = videotool
+        self.cpus = get_cpucount()
+        if jobs <= 0:
+            jobs = max(1, self.cpus // self.THREADSPERJOB.get(kind, 1))
+        self.jobs = jobs
+        self.queue = []
+        self.results = []
+        self.force = force
+        self.usehash = usehash
+        self._manifests = {}
+        self._lock = threading.Lock()
+
+    # --------------------------------------------
+    def add(self, name, func, *args, **kwargs):
+        self.queue.append((name, func, args, kwargs))
+
+    # --------------------------------------------
+    def _get_manifest(self, outfile):
+        directory = os.path.dirname(os.path.abspath(outfile))
+        with self._lock:
+            if directory not in self._manifests:
+                self._manifests[directory] = Manifest(directory)
+            return self._manifests[directory]
+
+    # --------------------------------------------
+    @staticmethod
+    def _get_outfile(kwargs):
+        '''Output file of a job in the manifest: "outfile" or the first of "outfiles" (see multi), None if there is none'''
+        if isinstance(kwargs.get('outfile'), str):
+            return kwargs['outfile']
+        if isinstance(kwargs.get('outfiles'), list) and kwargs['outfiles']:
+            return kwargs['outfiles'][0]
+        return None
+
+    # --------------------------------------------
+    def _get_params(self, func, kwargs):
+        '''Parameters of a job kept in the manifest: its arguments and the encoder settings of the VideoTool'''
+        params = {key: value for key, value in kwargs.items() if key not in ('infile', 'outfile')}
+        params['operation'] = func.__name__
+        params['preset'] = self.videotool.preset
+        params['autopreset'] = self.videotool.autopreset
+        params['threads'] = self.videotool.threads
+        params['keyint'] = self.videotool.keyint
+        return params
+
+    # --------------------------------------------
+    def run_job(self, name, func, args, kwargs):
+        '''Runs one job now (skipped if its output is up to date), returns (name, status, message, seconds).
+        Errors are returned as the "failed" status'''
+        start = time.monotonic()
+        manifest = None
+        if 'infile' in kwargs and self._get_outfile(kwargs) is not None:
+            infile, outfile = kwargs['infile'], self._get_outfile(kwargs)
+            params = self._get_params(func, kwargs)
+            manifest = self._get_manifest(outfile)
+            if not self.force and manifest.is_uptodate(infile, outfile, params, self.usehash):
+                manifest.refresh(infile, outfile)
+                return name, 'skipped', 'up to date', time.monotonic() - start
+            for path in manifest.get_outputs(outfile):
+                self.videotool.replaceable.add(path)
+        try:
+            result = func(*args, **kwargs)
+            status = result.status
+            message = ''
+            # outputs can be named by the operation itself (ex. several audio tracks): all of them are checked next time
+            if status == 'ok' and manifest is not None and result.outputs:
+                manifest.record(infile, outfile, params, self.usehash, result.outputs)
+        except subprocess.CalledProcessError as e:
+            status, message = 'failed', 'ffmpeg exit code {}'.format(e.returncode)
+        except subprocess.TimeoutExpired as e:
+            status, message = 'failed', 'timed out after {:.0f}s'.format(e.timeout)
+        except SystemExit as e:
+            status, message = 'failed', 'exit code {}'.format(e.code)
+        except Exception as e:
+            status, message = 'failed', str(e) or e.__class__.__name__
+        return name, status, message, time.monotonic() - start
+
+    # --------------------------------------------
+    def run(self):
+        '''Runs all queued jobs, returns list of (name, status, message, seconds)'''
+        jobs = min(self.jobs, len(self.queue)) or 1
+        if jobs > 1:
+            self.videotool.threads = max(1, self.cpus // jobs)
+            self.videotool.quiet = True
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(self.run_job, *job) for job in self.queue]
+            for future in futures:
+                result = future.result()
+                self.results.append(result)
+                if jobs > 1:
+                    log.info('[{}] {} ({:.1f}s)'.format(result[1], result[0], result[3]))
+        self.queue = []
+        return self.results
+
+    # --------------------------------------------
+    def _planjob(self, name, func, args, kwargs):
+        if 'infile' in kwargs and self._get_outfile(kwargs) is not None:
+            params = self._get_params(func, kwargs)
+            outfile = self._get_outfile(kwargs)
+            if not self.force and self._get_manifest(outfile).is_uptodate(kwargs['infile'], outfile, params, self.usehash):
+                return Estimate(func.__name__, 'skipped', message='up to date')
+        try:
+            return self.videotool.get_plan(func, *args, **kwargs)
+        except (subprocess.CalledProcessError, FFEasyToolError) as e:
+            return Estimate(func.__name__, 'failed', message=str(e) or e.__class__.__name__)
+
+    # --------------------------------------------
+    def plan(self):
+        '''Dry run of all queued jobs (inputs are probed at once), returns list of (name, Estimate). See VideoTool.get_plan'''
+        jobs = min(self.jobs, len(self.queue)) or 1
+        if jobs > 1:
+            # as in run(): estimates are looked up for the same number of threads
+            self.videotool.threads = max(1, self.cpus // jobs)
+        with ThreadPoolExecutor(max_workers=self.cpus) as executor:
+            futures = [executor.submit(self._planjob, *job) for job in self.queue]
+            return [(job[0], future.result()) for job, future in zip(self.queue, futures)]
+
+    # --------------------------------------------
+    def print_plan(self, estimates):
+        '''Prints commands and estimates of every job (see plan) and the totals, returns True if nothing failed'''
+        def format_seconds(seconds):
+            return '{:d}:{:02d}:{:02d}'.format(int(seconds // 3600), int(seconds % 3600 // 60), int(seconds % 60)) if seconds is not None else '?'
+        def format_size(size):
+            return '{:.1f} Mb'.format(size / 1024 ** 2) if size is not None else '?'
+        print('\nPLAN:')
+        for name, estimate in estimates:
+            if estimate.status in ('skipped', 'failed'):
+                print('  {:8} {}{}'.format(estimate.status, name, ': {}'.format(estimate.message) if estimate.message else ''))
+                continue
+            print('  {:8} {} (time ~{}, size ~{})'.format(estimate.status, name, format_seconds(estimate.seconds), format_size(estimate.size)))
+            for request in estimate.commands:
+                print('    {}'.format(shlex.join(request.cmd)))
+            if estimate.status == 'partial':
+                print('    ... the next commands depend on results of these ({})'.format(estimate.message))
+        planned = [estimate for name, estimate in estimates if estimate.status in ('planned', 'partial')]
+        seconds = sum(estimate.seconds or 0.0 for estimate in planned)
+        size = sum(estimate.size or 0 for estimate in planned)
+        unknown = len([estimate for estimate in planned if estimate.seconds is None or estimate.size is None])
+        jobs = min(self.jobs, len(planned)) or 1
+        print('jobs: {}, skipped: {}, failed: {}'.format(len(planned), len([e for n, e in estimates if e.status == 'skipped']), len([e for n, e in estimates if e.status == 'failed'])))
+        print('estimated time: ~{} ({} at once), output size: ~{}'.format(format_seconds(seconds / jobs), jobs, format_size(size)))
+        if unknown:
+            print('{} job(s) without estimates: nothing learned for their commands on this host yet (estimates come from finished runs)'.format(unknown))
+        return not [estimate for name, estimate in estimates if estimate.status == 'failed']
+
+    # --------------------------------------------
+    def print_summary(self):
+        '''Prints per-file results, returns True if nothing failed'''
+        print('\nSUMMARY:')
+        for name, status, message, seconds in self.results:
+            print('  {:8} {} ({:.1f}s){}'.format(status, name, seconds, ': {}'.format(message) if message else ''))
+        counts = {status: len([r for r in self.results if r[1] == status]) for status in ('ok', 'skipped', 'failed')}
+        print('ok: {ok}, skipped: {skipped}, failed: {failed}'.format(**counts))
+        return counts['failed'] == 0
+
+
+class Benchmark:
+    '''Runs ffeasytool commands on synthetic inputs (lavfi testsrc2 + sine) and measures them'''
+
+    COMMANDS = ['to264', 'towebm', 'tomp3', 'togif', 'compress', 'cut', 'resize', 'split', 'merge']
+    INPUTS = [((640, 360), 10), ((1280, 720), 10), ((1280, 720), 30)]
+    QUICKINPUTS = [((320, 240), 5)]
+
+    # --------------------------------------------
+    def __init__(self, videotool, commands=None, repeats=3, quick=False):
+        self.videotool = videotool
+        self.commands = commands or self.COMMANDS
+        self.repeats = repeats
+        self.inputs = self.QUICKINPUTS if quick else self.INPUTS
+
+    # --------------------------------------------
+    def _make_input(self, workdir, resolution, duration):
+        '''Generates test video (mpeg4 video, aac audio in mkv)'''
+        infile = os.path.join(workdir, 'testsrc_{}x{}_{}s.mkv'.format(resolution[0], resolution[1], duration))
+        cmd = [
+            self.videotool.bins['ffmpeg']
+            , '-y'
+            , '-f', 'lavfi', '-i', 'testsrc2=size={}x{}:rate=30:duration={}'.format(resolution[0], resolution[1], duration)
+            , '-f', 'lavfi', '-i', 'sine=frequency=440:sample_rate=48000:duration={}'.format(duration)
+            , '-c:v', 'mpeg4', '-q:v', '3'
+            , '-c:a', 'aac'
+            , infile
+            ]
+        self.videotool._run(cmd)
+        return infile
+
+    # --------------------------------------------
+    def _call(self, command, infile, duration):
+        '''Runs one command in the current directory'''
+        vt = self.videotool
+        if command == 'to264':
+            vt.convert_to_x264(infile, outfile='out.mp4')
+        elif command == 'towebm':
+            vt.convert_to_webm(infile, outfile='out.webm')
+        elif command == 'tomp3':
+            vt.convert_to_mp3(infile, audiotrack=1, outfile='out.mp3')
+        elif command == 'togif':
+            vt.convert_to_gif(infile, 10, outfile='out.gif')
+        elif command == 'compress':
+            vt.compress_single_video(infile, '{}K'.format(duration * 100), audiotrack=1, outfile='out.mp4')
+        elif command == 'cut':
+            vt.cut_single_video(infile, startpoint=str(duration / 4), endpoint=str(duration * 3 / 4), audiotrack=1, outfile='out.mp4')
+        elif command == 'resize':
+            vt.resize_single_video(infile, scale=0.5, audiotrack=1, outfile='out.mp4')
+        elif command == 'split':
+            vt.split_video(infile, time=str(max(1, duration // 3)), audiotrack=1)
+        elif command == 'merge':
+            # always re-encoded: an input of the output size would be joined by copy otherwise
+            vt.avmerge([infile, infile], 640, 360, 30, copy=False, outfile='out.mp4')
+
+    # --------------------------------------------
+    def run(self):
+        '''Returns results as dict (see "results" key)'''
+        workdir = tempfile.mkdtemp(prefix='tmp-bench-')
+        cwd = os.getcwd()
+        ffmpegpath, ffmpegver, ffprobepath, ffprobever = self.videotool.show_versions()
+        report = {
+            'host': platform.node()
+            , 'platform': platform.platform()
+            , 'cpus': get_cpucount()
+            , 'ffmpeg': ffmpegver
+            , 'date': time.strftime('%Y-%m-%dT%H:%M:%S')
+            , 'repeats': self.repeats
+            , 'results': []
+            }
+        try:
+            for resolution, duration in self.inputs:
+                infile = self._make_input(workdir, resolution, duration)
+                for command in self.commands:
+                    runs = []
+                    for n in range(self.repeats):
+                        rundir = tempfile.mkdtemp(dir=workdir)
+                        os.chdir(rundir)
+                        # every run probes the file again: ffprobe time is a part of the result
+                        self.videotool._mediainfo.clear()
+                        self.videotool.reset_stats()
+                        started = time.monotonic()
+                        try:
+                            self._call(command, infile, duration)
+                        finally:
+                            os.chdir(cwd)
+                        wall = time.monotonic() - started
+                        stats = dict(self.videotool.stats)
+                        runs.append({
+                            'wall': round(wall, 3)
+                            , 'realtime_factor': round(duration / wall, 3)
+                            , 'ffprobe_time': round(stats['ffprobe_time'], 3)
+                            , 'ffprobe_calls': stats['ffprobe_calls']
+                            , 'ffmpeg_time': round(stats['ffmpeg_time'], 3)
+                            , 'ffmpeg_calls': stats['ffmpeg_calls']
+                            , 'ffmpeg_maxrss_kb': stats['ffmpeg_maxrss']
+                            })
+                        shutil.rmtree(rundir, ignore_errors=True)
+                    walls = sorted(r['wall'] for r in runs)
+                    result = {
+                        'command': command
+                        , 'input': '{}x{}@30 {}s'.format(resolution[0], resolution[1], duration)
+                        , 'median_wall': walls[len(walls) // 2]
+                        , 'median_realtime_factor': round(duration / walls[len(walls) // 2], 3)
+                        , 'max_ffmpeg_maxrss_kb': max(r['ffmpeg_maxrss_kb'] for r in runs)
+                        , 'runs': runs
+                        }
+                    print('{:10} {:22} wall {:8.3f}s  x{:<8} ffprobe {:.3f}s  rss {} Kb'.format(command, result['input'], result['median_wall']
+                          , result['median_realtime_factor'], runs[0]['ffprobe_time'], result['max_ffmpeg_maxrss_kb']))
+                    report['results'].append(result)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        return report
+
+    # --------------------------------------------
+    @staticmethod
+    def compare(report, baseline, threshold=10):
+        '''Prints differences of median wall time with baseline report, returns list of regressions (slower than threshold %)'''
+        old = {(r['command'], r['input']): r for r in baseline.get('results', [])}
+        regressions = []
+        print('\nCOMPARE (threshold {}%):'.format(threshold))
+        for result in report['results']:
+            key = (result['command'], result['input'])
+            if key not in old:
+                continue
+            change = (result['median_wall'] - old[key]['median_wall']) * 100 / max(old[key]['median_wall'], 0.001)
+            mark = ''
+            if change > threshold:
+                mark = 'REGRESSION'
+                regressions.append((key, change))
+            elif change < -threshold:
+                mark = 'faster'
+            print('  {:10} {:22} {:8.3f}s -> {:8.3f}s  {:+6.1f}% {}'.format(key[0], key[1], old[key]['median_wall'], result['median_wall'], change, mark))
+        return regressions
+
+
+class Inotify:
+    '''Linux inotify through ctypes: close-after-write, move-in and create events of files in directories'''
+
+    IN_MODIFY = 0x2
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+
+    # --------------------------------------------
+    def __init__(self, directories):
+        '''Raises OSError if inotify is not available'''
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError('inotify is not supported')
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.directories = {}
+        mask = self.IN_MODIFY | self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+        for directory in directories:
+            wd = libc.inotify_add_watch(self.fd, os.fsencode(directory), mask)
+            if wd < 0:
+                os.close(self.fd)
+                raise OSError(ctypes.get_errno(), 'inotify_add_watch failed: {}'.format(directory))
+            self.directories[wd] = directory
+
+    # --------------------------------------------
+    def read(self):
+        '''Returns paths of files with pending events'''
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return []
+        paths = []
+        offset = 0
+        while offset + 16 <= len(data):
+            wd, mask, cookie, length = struct.unpack_from('iIII', data, offset)
+            name = data[offset + 16:offset + 16 + length].rstrip(b'\0')
+            offset += 16 + length
+            if name and wd in self.directories:
+                paths.append(os.path.join(self.directories[wd], os.fsdecode(name)))
+        return paths
+
+    # --------------------------------------------
+    def close(self):
+        os.close(self.fd)
+
+
+class WatchJobs:
+    '''Persistent job table of the "watch" command: one row for each (file, operation).
+    A failed job is done again (on the next check or start) until it has failed "attempts" times, as in SqliteQueue.'''
+
+    FINISHED = "(status IN ('done', 'skipped') OR (status='failed' AND attempts>=?))"
+
+    # --------------------------------------------
+    def __init__(self, path=None, attempts=3):
+        if path is None:
+            path = os.path.join(get_cachedir(), 'watch.sqlite')
+        self.path = path
+        self.attempts = attempts
+        self._db = sqlite3.connect(path)
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS jobs (path TEXT, operation TEXT, size INTEGER, mtime INTEGER, status TEXT'
+                             ', outputs TEXT, message TEXT, updated REAL, attempts INTEGER DEFAULT 0, PRIMARY KEY (path, operation))')
+            if 'attempts' not in [row[1] for row in self._db.execute('PRAGMA table_info(jobs)')]:
+                # a table of an older version
+                self._db.execute('ALTER TABLE jobs ADD COLUMN attempts INTEGER DEFAULT 0')
+            # jobs interrupted by a stop or a crash are done again
+            self._db.execute("UPDATE jobs SET status='queued' WHERE status='running'")
+
+    # --------------------------------------------
+    def get_finished(self, operation):
+        '''Returns {path: (size, mtime)} of files done with operation (or failed "attempts" times)'''
+        rows = self._db.execute('SELECT path, size, mtime FROM jobs WHERE operation=? AND ' + self.FINISHED, (operation, self.attempts))
+        return {path: (size, mtime) for path, size, mtime in rows}
+
+    # --------------------------------------------
+    def get_outputs(self):
+        '''Returns set of all output files (they are not inputs of the next jobs)'''
+        outputs = set()
+        for row in self._db.execute('SELECT outputs FROM jobs'):
+            outputs.update(json.loads(row[0] or '[]'))
+        return outputs
+
+    # --------------------------------------------
+    def add(self, path, operation, size, mtime, outputs):
+        '''Queues file, returns False if it is already finished with the same size and mtime.
+        Attempts of a failed job are counted until the file is changed.'''
+        row = self._db.execute('SELECT size, mtime, ' + self.FINISHED + ', attempts FROM jobs WHERE path=? AND operation=?'
+                               , (self.attempts, path, operation)).fetchone()
+        if row is not None and row[:2] == (size, mtime) and row[2]:
+            return False
+        attempts = (row[3] or 0) if row is not None and row[:2] == (size, mtime) else 0
+        with self._db:
+            self._db.execute('INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)'
+                             , (path, operation, size, mtime, 'queued', json.dumps(outputs), '', time.time(), attempts))
+        return True
+
+    # --------------------------------------------
+    def start(self, path, operation):
+        '''Marks job as running, returns its attempt number'''
+        with self._db:
+            self._db.execute("UPDATE jobs SET status='running', attempts=attempts+1, updated=? WHERE path=? AND operation=?", (time.time(), path, operation))
+        return self._db.execute('SELECT attempts FROM jobs WHERE path=? AND operation=?', (path, operation)).fetchone()[0]
+
+    # --------------------------------------------
+    def set_status(self, path, operation, status, message=''):
+        with self._db:
+            self._db.execute('UPDATE jobs SET status=?, message=?, updated=? WHERE path=? AND operation=?', (status, message, time.time(), path, operation))
+
+
+class FolderWatcher:
+    '''Applies one operation to every new file in directories (inotify or polling), when the file is not written anymore.
+    Jobs are kept in WatchJobs, so finished files are not done again after a restart.'''
+
+    KINDS = {'to264': 'x264', 'towebm': 'vp9', 'tomp3': 'mp3', 'togif': 'gif', 'compress': 'x264'}
+
+    # --------------------------------------------
+    def __init__(self, asynctool, directories, operation, options={}, outdir='.', jobs=0, pattern='*', interval=2, stable=5, db=None, attempts=3):
+        self.tool = asynctool
+        self.directories = [os.path.abspath(directory) for directory in directories]
+        self.operation = operation
+        self.options = options
+        self.key = '{} {}'.format(operation, json.dumps(options, sort_keys=True))
+        self.outdir = os.path.abspath(outdir)
+        cpus = get_cpucount()
+        self.jobs = jobs if jobs > 0 else max(1, cpus // JobScheduler.THREADSPERJOB.get(self.KINDS[operation], 1))
+        self.pattern = pattern
+        self.interval = interval
+        self.stable = stable
+        self.table = WatchJobs(db, attempts)
+        self.tool.videotool.threads = max(1, cpus // self.jobs)
+        self.tool.videotool.quiet = True
+        self._known = {}
+        self._candidates = {}
+        self._outputs = set()
+        self._running = set()
+        self._wakeup = None
+
+    # --------------------------------------------
+    @staticmethod
+    def get_job(operation, path, options, outdir):
+        '''Returns (VideoTool method, keyword arguments, output files) of operation (see KINDS) for a file'''
+        base = os.path.join(outdir, os.path.splitext(os.path.basename(path))[0])
+        kwargs = {'infile': path}
+        if 'audiotrack' in options:
+            kwargs['audiotrack'] = options['audiotrack']
+        if operation == 'compress':
+            sizes = options['size'].split(',')
+            outfiles = ['{}_compressed_{}.mp4'.format(base, size) for size in sizes]
+            kwargs.update({'targetsize': sizes, 'outfile': outfiles})
+            return VideoTool.compress_single_video, kwargs, outfiles
+        if operation == 'togif':
+            outfile = '{}.gif'.format(base)
+            return VideoTool.convert_to_gif, {'infile': path, 'fps': options.get('fps', 10), 'outfile': outfile}, [outfile]
+        if 'quality' in options:
+            kwargs['quality'] = options['quality']
+        if operation == 'towebm' and options.get('resume'):
+            kwargs['resume'] = True
+        method, extension = {'to264': (VideoTool.convert_to_x264, 'mp4'), 'towebm': (VideoTool.convert_to_webm, 'webm'), 'tomp3': (VideoTool.convert_to_mp3, 'mp3')}[operation]
+        outfile = '{}.{}'.format(base, extension)
+        kwargs['outfile'] = outfile
+        return method, kwargs, [outfile]
 
     # --------------------------------------------
-    def compress_single_video(self, infile: str, targetsize: str, audiobitrate=None, audiotrack=None, containerfactor=10, outfile="outfile.mp4"):
-        # platform check
-        if platform.system() == "Linux":
-            devnull = '/dev/null'
-        elif platform.system() == "Windows":
-            devnull = 'NUL'
+    def _check(self, path):
+        '''Adds a new or changed file to candidates (files waiting until they are not written anymore)'''
+        name = os.path.basename(path)
+        if name.startswith(('.', 'tmp-')) or not fnmatch.fnmatch(name, self.pattern) or path in self._outputs or path in self._running:
+            return
+        try:
+            st = os.stat(path)
+        except OSError:
+            self._candidates.pop(path, None)
+            return
+        if not stat.S_ISREG(st.st_mode):
+            return
+        state = (st.st_size, st.st_mtime_ns)
+        if self._known.get(path) == state:
+            return
+        if path not in self._candidates or self._candidates[path][0] != state:
+            self._candidates[path] = (state, time.monotonic())
 
-        # convert target size to bytes
-        sizeerror='Use size format: 1024 - 1024 bytes, 1K - 1 kilobyte, 1M - 1 megabyte, 1G - 1 gigabyte'
-        if targetsize.endswith('K'):
-            try:
-                targetsize = int(targetsize[:-1]) * 1024
-                sizein = 'Kb'
-            except Exception as e:
-                print('{}\n\n{}.'.format(e, sizeerror))
-        elif targetsize.endswith('M'):
-            try:
-                targetsize = int(targetsize[:-1]) * (1024 ** 2)
-                sizein = 'Mb'
-            except Exception as e:
-                print('{}\n\n{}.'.format(e, sizeerror))
-        elif targetsize.endswith('G'):
+    # --------------------------------------------
+    def _scan(self):
+        for directory in self.directories:
             try:
-                targetsize = int(targetsize[:-1]) * (1024 ** 3)
-                sizein = 'Gb'
-            except Exception as e:
-                print('{}\n\n{}.'.format(e, sizeerror))
-        else:
+                entries = list(os.scandir(directory))
+            except OSError as e:
+                log.warning('Can not read "{}": {}'.format(directory, e))
+                continue
+            for entry in entries:
+                self._check(entry.path)
+
+    # --------------------------------------------
+    async def _process(self, path, state, method, kwargs, semaphore):
+        async with semaphore:
+            attempt = self.table.start(path, self.key)
+            started = time.monotonic()
             try:
-                targetsize = int(targetsize)
-                sizein = 'B'
+                status = 'done' if (await self.tool.run(method, **kwargs)).ok else 'skipped'
+                message = ''
+            except subprocess.CalledProcessError as e:
+                status, message = 'failed', 'ffmpeg exit code {}'.format(e.returncode)
+            except asyncio.TimeoutError:
+                status, message = 'failed', 'timed out'
+            except SystemExit as e:
+                status, message = 'failed', 'exit code {}'.format(e.code)
             except Exception as e:
-                print('{}\n\n{}.'.format(e, sizeerror))
+                status, message = 'failed', str(e) or e.__class__.__name__
+            finally:
+                self._running.discard(path)
+            self.table.set_status(path, self.key, status, message)
+            if status == 'failed' and attempt < self.table.attempts:
+                # done again when the file is not changed for "stable" seconds more
+                message += ' (attempt {} of {})'.format(attempt, self.table.attempts)
+                self._candidates[path] = (state, time.monotonic())
+                self._wakeup.set()
+            else:
+                self._known[path] = state
+            log.info('[{}] {} ({:.1f}s){}'.format(status, path, time.monotonic() - started, ': {}'.format(message) if message else ''))
 
-        # find video duration in seconds
-        cmd = [self.bins['ffprobe']
-             , '-v'
-             , 'error'
-             , '-show_entries'
-             , 'format=duration'
-             , '-of'
-             , 'csv=p=0'
-             , infile]
-        out, err = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True).communicate()
-        duration = float(out.strip())
+    # --------------------------------------------
+    async def run(self):
+        '''Watches until cancelled (Ctrl+C). Running jobs are stopped then and done again on the next start.'''
+        os.makedirs(self.outdir, exist_ok=True)
+        self._known = self.table.get_finished(self.key)
+        self._outputs = self.table.get_outputs()
+        semaphore = asyncio.Semaphore(self.jobs)
+        wakeup = self._wakeup = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        try:
+            inotify = Inotify(self.directories)
+        except OSError as e:
+            inotify = None
+            log.warning('inotify is not available ({}), checking directories every {}s.'.format(e, self.interval))
+        if inotify is not None:
+            def onevent():
+                for path in inotify.read():
+                    self._check(path)
+                wakeup.set()
+            loop.add_reader(inotify.fd, onevent)
+        log.info('Watching {} ({}, {} jobs at once)'.format(', '.join(self.directories), self.operation, self.jobs))
+        tasks = set()
+        self._scan()
+        try:
+            while True:
+                if inotify is None or self._candidates:
+                    try:
+                        await asyncio.wait_for(wakeup.wait(), self.interval)
+                    except asyncio.TimeoutError:
+                        pass
+                else:
+                    await wakeup.wait()
+                wakeup.clear()
+                if inotify is None:
+                    self._scan()
+                now = time.monotonic()
+                for path, (state, since) in list(self._candidates.items()):
+                    # re-check: inotify does not report every write
+                    self._check(path)
+                    if path not in self._candidates or self._candidates[path][0] != state or now - since < self.stable:
+                        continue
+                    del self._candidates[path]
+                    method, kwargs, outfiles = self.get_job(self.operation, path, self.options, self.outdir)
+                    self._outputs.update(outfiles)
+                    if not self.table.add(path, self.key, state[0], state[1], outfiles):
+                        self._known[path] = state
+                        continue
+                    self._running.add(path)
+                    task = asyncio.ensure_future(self._process(path, state, method, kwargs, semaphore))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if inotify is not None:
+                loop.remove_reader(inotify.fd)
+                inotify.close()
 
-        # check if audio exists
-        audiocodeccmd = []
-        audiotrackcmd = []
-        audiobps = 0
-        if self._there_is_audio(infile, audiotrack=audiotrack):
-            audiocodeccmd = self._get_audiocodec()
-            audiotrackcmd = self._there_is_audio(infile, audiotrack=audiotrack)
-            
-            # get audio rate in bits per seconds
-            if audiobitrate is None:
-                cmd = [self.bins['ffprobe']
-                    , '-v'
-                    , 'error'
-                    , '-select_streams'
-                    , 'a:{}'.format(str(audiotrack-1))
-                    , '-show_entries'
-                    , 'stream=bit_rate'
-                    , '-of'
-                    , 'csv=p=0'
-                    , infile]
-                out, err = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True).communicate()
-                try:
-                    audiobps = float(out.strip())
-                except:
-                    # sometimes ffprobe return N/A
-                    audiobps = 128 * 1000
-            else:
-                audiobps = audiobitrate * 1000
 
-        mp4overhead = math.floor( containerfactor *  (1024**2/3600) * duration ) # in bytes. The basic overhead is 1Mb per hour (really a random value). Some multiplier (containerfactor) is needed for tuning.
-        # check if target size is smaller than audio size
-        audiosize = duration * (audiobps/8) # bytes
-        if targetsize <= ( audiosize + mp4overhead ):
-            if sizein == 'B':
-                errsize = math.ceil( audiosize + mp4overhead )
-            elif sizein == 'Kb':
-                errsize = math.ceil( (audiosize + mp4overhead) / 1024 )
-            elif sizein == 'Mb':
-                errsize = math.ceil(( audiosize + mp4overhead) / 1024**2 )
-            elif sizein == 'Gb':
-                errsize = math.ceil( (audiosize + mp4overhead) / 1024**3 )
-            print("TARGET SIZE IS TOO SMALL!\nAudio track size: ~{asize} {sizein} with {audiokbps} kbps. \nTry target size {errsize} {sizein}. Increase it if an encoding error appears.".format(asize=errsize-1, audiokbps=math.ceil(audiobps/1000), errsize=errsize, sizein=sizein))
-            sys.exit(1)
+# --------------------------------------------
+def get_workqueue(path):
+    '''Opens the work queue of the distributed mode: SqliteQueue for a file (*.sqlite, *.db or an existing file),
+    DirectoryQueue for a directory'''
+    if os.path.isfile(path) or os.path.splitext(path)[1].lower() in ('.sqlite', '.db'):
+        return SqliteQueue(path)
+    return DirectoryQueue(path)
 
-        # calculate bitrate
-        videobps = math.floor( ( (targetsize - mp4overhead) * 8 / duration ) - math.floor(audiobps) )
-        infotargetsize = targetsize / 1024 # Kb
-        infovideosize = (videobps / (8 * 1024) ) * duration # Kb
-        infomp4overhead = mp4overhead /  1024 # Kb
-        infoaudiosize = (audiobps / (8 * 1024)) * duration # Kb
-        print("Duration: {duration}\nTarget size: {targetsize} Kb\nVideo size: {videosize} Kb\nAudio size: {audiosize} Kb\nMP4 Overhead: {mp4overhead} Kb".format(duration=duration, targetsize=infotargetsize, videosize=infovideosize, audiosize=infoaudiosize, mp4overhead=infomp4overhead))
-        ffmpeglogname = 'tmp-passlogfile-{}'.format(''.join(random.choices(string.ascii_uppercase + string.digits, k=6)))
-        # pass 1
-        cmd = [self.bins['ffmpeg']
-             , '-y'
-             , '-i'
-             , infile]
-        cmd += audiotrackcmd
-        cmd += [
-               '-map', '0:v:0'
-             , '-c:v'
-             , 'libx264'
-             , '-b:v'
-             , '{}k'.format(str(math.floor(videobps/1000)))
-             , '-pass'
-             , '1'
-             , '-passlogfile'
-             , ffmpeglogname
-             , '-f'
-             , 'mp4'
-             , devnull]
-        subprocess.Popen(cmd).communicate()
-        # pass 2
-        cmd = [self.bins['ffmpeg']
-            , '-y' 
-            , '-i'
-             , infile]
-        cmd += audiotrackcmd
-        cmd += audiocodeccmd
-        cmd += [
-              '-map', '0:v:0'
-             , '-c:v'
-             , 'libx264'
-             , '-b:v'
-             , '{}k'.format(str(math.floor(videobps/1000)))
-             , '-pass'
-             , '2'
-             , '-passlogfile'
-             , ffmpeglogname
-             , '-b:a'
-             , '{}k'.format(str(math.floor(audiobps/1000)))
-             , outfile]
-        subprocess.Popen(cmd).communicate()
-
-        try:
-            os.remove("{}-0.log.mbtree".format(ffmpeglogname))
-        except OSError:
-            pass
-        try:
-            os.remove("{}-0.log".format(ffmpeglogname))
-        except OSError:
-            pass
+
+class SqliteQueue:
+    '''Work queue of the distributed mode in one SQLite file (a local disk or a shared mount with working file locks).
+    A worker claims a job with a lease (seconds) and extends it while the job runs; a job with an expired lease
+    (its worker crashed or lost the mount) is claimed again, up to "attempts" times.
+    Job statuses: queued, running, ok, skipped, failed.'''
 
     # --------------------------------------------
-    def resize_single_video(self, infile: str, scale=None, audiotrack=None, resolution=None, quality=22, outfile='outfile.mp4'):
-        if scale is None and resolution is None: return
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS jobs (id INTEGER PRIMARY KEY, name TEXT, operation TEXT, kwargs TEXT, status TEXT'
+                         ', worker TEXT, lease REAL, attempts INTEGER, message TEXT, seconds REAL, updated REAL)')
 
-        if scale is not None:
-            scale = float(scale)
-            width, height = self._get_resolution(infile)
-            newwidth = int(width * scale)
-            newheight = int(height * scale)
-        elif resolution is not None:
-            newwidth, newheight = resolution.split('x')
-            newwidth = int(newwidth)
-            newheight = int(newheight)
-        
-        newwidth = self._lead_to_divisibility_by_2(newwidth)
-        newheight = self._lead_to_divisibility_by_2(newheight)
+    # --------------------------------------------
+    def add(self, name, operation, kwargs):
+        '''Queues VideoTool operation (method name) with its keyword arguments'''
+        with self._lock:
+            self._db.execute("INSERT INTO jobs (name, operation, kwargs, status, attempts, message, updated) VALUES (?, ?, ?, 'queued', 0, '', ?)"
+                             , (name, operation, json.dumps(kwargs), time.time()))
 
-        # convert resolution
-        cmd = [
-            self.bins['ffmpeg']
-            , '-i', infile
-            , '-map', '0:v:0'
-            , '-vf', 'scale={}:{}, setsar=1:1'.format(newwidth, newheight)
-            ]
-        
-        # check if audio exists
-        audiocodeccmd = []
-        audiotrackcmd = []
-        if self._there_is_audio(infile, audiotrack=audiotrack):
-            audiocodeccmd = self._get_audiocodec()
-            audiotrackcmd = self._there_is_audio(infile, audiotrack=audiotrack)
-        
-        cmd += self._get_h264settings(quality)
-        cmd += audiotrackcmd
-        cmd += audiocodeccmd
-        cmd += [outfile]
-        subprocess.Popen(cmd).communicate()
+    # --------------------------------------------
+    def claim(self, worker, lease, attempts=3):
+        '''Returns (id, name, operation, kwargs) of the next queued job or of a job with an expired lease, None if there are no jobs'''
+        with self._lock:
+            now = time.time()
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                self._db.execute("UPDATE jobs SET status='failed', message=?, updated=? WHERE status='running' AND lease<? AND attempts>=?"
+                                 , ('lease expired {} times'.format(attempts), now, now, attempts))
+                row = self._db.execute("SELECT id, name, operation, kwargs FROM jobs WHERE status='queued' OR (status='running' AND lease<?) ORDER BY id LIMIT 1"
+                                       , (now,)).fetchone()
+                if row is not None:
+                    self._db.execute("UPDATE jobs SET status='running', worker=?, lease=?, attempts=attempts+1, updated=? WHERE id=?"
+                                     , (worker, now + lease, now, row[0]))
+                self._db.execute('COMMIT')
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+        if row is None:
+            return None
+        return row[0], row[1], row[2], json.loads(row[3])
 
     # --------------------------------------------
-    def cut_single_video(self, infile: str, startpoint='-1', endpoint='-1', audiotrack=None, quality=22, outfile='outfile.mp4'):
-        if startpoint == '-1' and endpoint == '-1': return
+    def heartbeat(self, jobid, worker, lease):
+        '''Extends the lease, returns False if the job is not this worker's anymore'''
+        with self._lock:
+            cursor = self._db.execute("UPDATE jobs SET lease=? WHERE id=? AND worker=? AND status='running'", (time.time() + lease, jobid, worker))
+        return cursor.rowcount == 1
 
-        cmd = [
-            self.bins['ffmpeg']
-            , '-i', infile
-            , '-map', '0:v:0'
-            ]
-        if startpoint != '-1': cmd += ['-ss', startpoint]
-        if endpoint != '-1':   cmd += ['-to', endpoint]
-        
-        # check if audio exists
-        audiocodeccmd = []
-        audiotrackcmd = []
-        if self._there_is_audio(infile, audiotrack=audiotrack):
-            audiocodeccmd = self._get_audiocodec()
-            audiotrackcmd = self._there_is_audio(infile, audiotrack=audiotrack)
+    # --------------------------------------------
+    def finish(self, jobid, worker, status, message='', seconds=0.0):
+        '''Stores the result, returns False if the job is not this worker's anymore (the result is dropped)'''
+        with self._lock:
+            cursor = self._db.execute("UPDATE jobs SET status=?, message=?, seconds=?, updated=? WHERE id=? AND worker=? AND status='running'"
+                                      , (status, message, seconds, time.time(), jobid, worker))
+        return cursor.rowcount == 1
 
-        cmd += self._get_h264settings(quality)
-        cmd += audiotrackcmd
-        cmd += audiocodeccmd
-        cmd += [outfile]
-        subprocess.Popen(cmd).communicate()
+    # --------------------------------------------
+    def count_unfinished(self):
+        '''Number of queued and running jobs'''
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')").fetchone()[0]
 
     # --------------------------------------------
-    def split_video(self, infile, time='0', chunks=0, quality=22, audiotrack=None) -> None:
-        '''time in seconds (also in 1m/1h format)'''
-        if chunks == 0 and time == '0': return
+    def get_jobs(self):
+        '''Returns list of (name, status, message, seconds) of all jobs'''
+        with self._lock:
+            return [tuple(row) for row in self._db.execute('SELECT name, status, message, seconds FROM jobs ORDER BY id')]
 
-        infilebasename = os.path.basename(infile)
-        outfile = '{}.split_%03d.mp4'.format(os.path.splitext(infilebasename)[0])
-        
-        # check if audio exists
-        audiocodeccmd = []
-        audiotrackcmd = []
-        if self._there_is_audio(infile, audiotrack=audiotrack):
-            audiocodeccmd = self._get_audiocodec()
-            audiotrackcmd = self._there_is_audio(infile, audiotrack=audiotrack)
 
-        cmd = [
-            self.bins['ffmpeg']
-            , '-i', infile
-            ]
+class DirectoryQueue:
+    '''Work queue of the distributed mode in a directory (ex. on a shared mount without reliable file locks):
+    a job is a JSON file moved between queued/, running/ and finished/ by atomic renames.
+    The mtime of a running job file is the end of its lease (see SqliteQueue).'''
 
-        if chunks != 0:
-            pass
-        elif time != '0':
-            if time.endswith('m'):
-                try:
-                    time = int(time[:-1]) * 60
-                except Exception as e:
-                    print('{}\n\nUse time format: 1 - 1 sec, 1m - 1 min, 1h - 1 hour.'.format(e))
-            elif time.endswith('h'):
-                try:
-                    time = int(time[:-1]) * 60 * 60
-                except Exception as e:
-                    print('{}\n\nUse time format: 1 - 1 sec, 1m - 1 min, 1h - 1 hour.'.format(e))
-            else:
-                time = int(time)
+    # --------------------------------------------
+    def __init__(self, path):
+        self.path = path
+        for directory in ('queued', 'running', 'finished'):
+            os.makedirs(os.path.join(path, directory), exist_ok=True)
 
-            cmd += [
-                '-f', 'segment'
-                , '-reset_timestamps', '1'
-                , '-map', '0:v:0'
-                , '-segment_time', str(time)
-                ]
+    # --------------------------------------------
+    def _read(self, directory, jobid):
+        with open(os.path.join(self.path, directory, jobid), encoding='utf-8') as f:
+            return json.load(f)
 
-        cmd += self._get_h264settings(quality)
-        cmd += audiotrackcmd
-        cmd += audiocodeccmd
-        cmd += ['-sc_threshold', '0']
-        cmd += [outfile]
-        subprocess.Popen(cmd).communicate()
+    # --------------------------------------------
+    def _write(self, directory, jobid, job, lease=None):
+        '''Writes job file through a temporary name (readers never see a part of it), lease - mtime of the file'''
+        path = os.path.join(self.path, directory, jobid)
+        temp = os.path.join(self.path, directory, '.tmp-{}-{}'.format(''.join(random.choices(string.ascii_lowercase + string.digits, k=6)), jobid))
+        with open(temp, 'w', encoding='utf-8') as f:
+            json.dump(job, f)
+        if lease is not None:
+            os.utime(temp, (lease, lease))
+        os.replace(temp, path)
 
     # --------------------------------------------
-    def convert_to_gif(self, infile, fps, outfile='outfile.gif'):
-        cmd = [
-            self.bins['ffmpeg']
-            , '-i', infile
-            ]
-        cmd += [
-            '-vf', 'fps={},split[s0][s1];[s0]palettegen=stats_mode=single[p];[s1][p]paletteuse'.format(fps)
-            , '-loop', '0'
-            ]
-        cmd += [outfile]
-        subprocess.Popen(cmd).communicate()
+    def _list(self, directory):
+        return sorted(name for name in os.listdir(os.path.join(self.path, directory)) if not name.startswith('.'))
 
     # --------------------------------------------
-    def convert_to_webm(self, infile, quality=31, audiotrack=None, outfile='outfile.webm'):
+    def add(self, name, operation, kwargs):
+        jobid = '{:017d}-{}.json'.format(time.time_ns() // 1000, ''.join(random.choices(string.ascii_lowercase + string.digits, k=6)))
+        self._write('queued', jobid, {'name': name, 'operation': operation, 'kwargs': kwargs, 'status': 'queued', 'attempts': 0
+                                      , 'worker': None, 'message': '', 'seconds': 0.0})
 
-        # check video codec
-        cmdpv = [
-            self.bins['ffprobe']
-            , '-v', 'error'
-            , '-select_streams', 'v:0'
-            , '-show_entries', 'stream=codec_name'
-            , '-of', 'default=noprint_wrappers=1:nokey=1'
-            , infile
-            ]
-        out, err = subprocess.Popen(cmdpv, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True).communicate()
+    # --------------------------------------------
+    def _requeue_expired(self, attempts):
+        '''Moves running jobs with expired leases back to queued/ (or to finished/ as failed after "attempts")'''
+        now = time.time()
+        for jobid in self._list('running'):
+            path = os.path.join(self.path, 'running', jobid)
+            try:
+                if os.stat(path).st_mtime >= now:
+                    continue
+                job = self._read('running', jobid)
+                if job['attempts'] >= attempts:
+                    job.update({'status': 'failed', 'message': 'lease expired {} times'.format(attempts)})
+                    self._write('running', jobid, job)
+                    os.rename(path, os.path.join(self.path, 'finished', jobid))
+                else:
+                    os.rename(path, os.path.join(self.path, 'queued', jobid))
+            except (OSError, ValueError):
+                pass # another worker moved it first
 
-        if out.strip() == 'vp8':
-            print('"{}" is already webm, skipped.'.format(infile))
-            return
+    # --------------------------------------------
+    def claim(self, worker, lease, attempts=3):
+        self._requeue_expired(attempts)
+        for jobid in self._list('queued'):
+            queued = os.path.join(self.path, 'queued', jobid)
+            expiry = time.time() + lease
+            try:
+                os.utime(queued, (expiry, expiry)) # not expired for others while it is moved
+                os.rename(queued, os.path.join(self.path, 'running', jobid))
+            except OSError:
+                continue # claimed by another worker
+            job = self._read('running', jobid)
+            job.update({'status': 'running', 'worker': worker, 'attempts': job['attempts'] + 1})
+            self._write('running', jobid, job, lease=expiry)
+            return jobid, job['name'], job['operation'], job['kwargs']
+        return None
 
-        # check if audio exists
-        audiocodeccmd = []
-        audiotrackcmd = []
-        if self._there_is_audio(infile, audiotrack=audiotrack):
-            audiocodeccmd = self._get_audiocodec()
-            audiotrackcmd = self._there_is_audio(infile, audiotrack=audiotrack)
+    # --------------------------------------------
+    def heartbeat(self, jobid, worker, lease):
+        try:
+            if self._read('running', jobid)['worker'] != worker:
+                return False
+            expiry = time.time() + lease
+            os.utime(os.path.join(self.path, 'running', jobid), (expiry, expiry))
+            return True
+        except (OSError, ValueError):
+            return False
 
-        cmd = [
-            self.bins['ffmpeg']
-            , '-i', infile
-            , '-map', '0:v:0'
-            ]
-        cmd += audiotrackcmd
-        cmd += audiocodeccmd
-        cmd += [
-            '-c:v', 'libvpx-vp9'
-            , '-row-mt', '1'
-            , '-crf', str(quality)
-            , '-b:v', '20M'
-            , '-auto-alt-ref', '0'
-            ]
-        cmd += [outfile]
-        subprocess.Popen(cmd).communicate()
+    # --------------------------------------------
+    def finish(self, jobid, worker, status, message='', seconds=0.0):
+        try:
+            job = self._read('running', jobid)
+            if job['worker'] != worker:
+                return False
+            job.update({'status': status, 'message': message, 'seconds': seconds})
+            self._write('finished', jobid, job)
+            os.remove(os.path.join(self.path, 'running', jobid))
+            return True
+        except (OSError, ValueError):
+            return False
 
     # --------------------------------------------
-    def convert_to_x264(self, infile, quality=22, audiotrack=None, outfile='outfile.mp4'):
+    def count_unfinished(self):
+        return len(self._list('queued')) + len(self._list('running'))
 
-        # check video codec
-        cmd = [
-            self.bins['ffprobe']
-            , '-v', 'error'
-            , '-select_streams', 'v:0'
-            , '-show_entries', 'stream=codec_name'
-            , '-of', 'default=noprint_wrappers=1:nokey=1'
-            , infile
-            ]
-        out, err = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True).communicate()
+    # --------------------------------------------
+    def get_jobs(self):
+        jobs = []
+        for directory in ('finished', 'running', 'queued'):
+            for jobid in self._list(directory):
+                try:
+                    job = self._read(directory, jobid)
+                except (OSError, ValueError):
+                    continue
+                jobs.append((jobid, job['name'], job['status'], job['message'], job['seconds']))
+        return [job[1:] for job in sorted(jobs)]
 
-        if out.strip() == 'h264':
-            print('"{}" is already h264, skipped.'.format(infile))
-            return
 
-        inwidth, inheight = self._get_resolution(infile)
-        outwidth = self._lead_to_divisibility_by_2(inwidth)
-        outheight = self._lead_to_divisibility_by_2(inheight)
-        
-        # check if audio exists
-        audiocodeccmd = []
-        audiotrackcmd = []
-        if self._there_is_audio(infile, audiotrack=audiotrack):
-            audiocodeccmd = self._get_audiocodec()
-            audiotrackcmd = self._there_is_audio(infile, audiotrack=audiotrack)
-        
-        cmd = [
-            self.bins['ffmpeg']
-            , '-i', infile
-            , '-map', '0:v:0'
-            ]
-        if inwidth != outwidth or inheight != outheight: cmd += ['-vf', 'scale={}:{}, setsar=1:1'.format(outwidth, outheight)]
-        cmd += self._get_h264settings(quality)
-        cmd += audiotrackcmd
-        cmd += audiocodeccmd
-        cmd += [outfile]
-        subprocess.Popen(cmd).communicate()
+class Worker:
+    '''Runs jobs of a work queue (see get_workqueue) on this node: claims a job with a lease, extends the lease
+    while the job runs (heartbeat), stores the result. Workers on any number of nodes (or processes) share one queue.'''
+
+    OPERATIONS = ('convert_to_x264', 'convert_to_webm', 'convert_to_mp3', 'convert_to_gif', 'compress_single_video')
 
     # --------------------------------------------
-    def convert_to_mp3(self, infile, audiotrack=None, quality=4, outfile='outfile.mp3'):
-       
-       # check if audio exists
-        audiocodeccmd = []
-        audiotrackcmd = []
-        if self._there_is_audio(infile, audiotrack=audiotrack, wrongtrackexit=True):
-            audiocodeccmd = self._get_audiocodec(codec='libmp3lame')
-            audiotrackcmd = self._there_is_audio(infile, audiotrack=audiotrack)
-        
-        cmd = [
-            self.bins['ffmpeg']
-            , '-i', infile]
-        cmd += audiotrackcmd
-        cmd += audiocodeccmd
-        cmd += [
-              '-q:a', str(quality)
-            , '-ar', '48000'
-            ]
-        cmd += [outfile]
-        subprocess.Popen(cmd).communicate()
+    def __init__(self, videotool, queue, jobs=0, lease=60, attempts=3, wait=False, interval=5, force=False):
+        '''jobs - jobs run at once (default: by CPU count), lease - seconds a job is kept without heartbeat,
+        attempts - claims of a job before it is failed, wait - wait for new jobs (checks every "interval" seconds)
+        instead of exit when all jobs are finished,
+        force - do jobs with up-to-date outputs (see Manifest)'''
+        self.videotool = videotool
+        self.queue = queue
+        self.cpus = get_cpucount()
+        self.jobs = jobs if jobs > 0 else max(1, self.cpus // JobScheduler.THREADSPERJOB['x264'])
+        self.lease = lease
+        self.attempts = attempts
+        self.wait = wait
+        self.interval = interval
+        self.name = '{}:{}'.format(platform.node(), os.getpid())
+        self.scheduler = JobScheduler(videotool, jobs=1, force=force)
+        self.results = []
+        self._lock = threading.Lock()
 
+    # --------------------------------------------
+    def _heartbeat(self, jobid, worker, stop):
+        while not stop.wait(self.lease / 3):
+            if not self.queue.heartbeat(jobid, worker, self.lease):
+                return
 
-if __name__ == '__main__':
+    # --------------------------------------------
+    def _loop(self, n):
+        worker = '{}:{}'.format(self.name, n)
+        while True:
+            with self._lock:
+                job = self.queue.claim(worker, self.lease, self.attempts)
+            if job is None:
+                # running jobs of other workers are waited for: they are claimed again if their leases expire
+                if not self.wait and self.queue.count_unfinished() == 0:
+                    return
+                time.sleep(self.interval)
+                continue
+            jobid, name, operation, kwargs = job
+            stop = threading.Event()
+            heartbeat = threading.Thread(target=self._heartbeat, args=(jobid, worker, stop), daemon=True)
+            heartbeat.start()
+            try:
+                if operation in self.OPERATIONS:
+                    name, status, message, seconds = self.scheduler.run_job(name, getattr(self.videotool, operation), (), kwargs)
+                else:
+                    status, message, seconds = 'failed', 'unknown operation: {}'.format(operation), 0.0
+            finally:
+                stop.set()
+                heartbeat.join()
+            if not self.queue.finish(jobid, worker, status, message, seconds):
+                message = 'lease lost, the result is dropped'
+            with self._lock:
+                self.results.append((name, status, message, seconds))
+            log.info('[{}] {} ({:.1f}s){}'.format(status, name, seconds, ': {}'.format(message) if message else ''))
+
+    # --------------------------------------------
+    def run(self):
+        '''Runs jobs until the queue is empty (or forever with "wait"), returns list of (name, status, message, seconds)'''
+        if self.jobs > 1:
+            self.videotool.threads = max(1, self.cpus // self.jobs)
+            self.videotool.quiet = True
+        threads = [threading.Thread(target=self._loop, args=(n,)) for n in range(self.jobs)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.results
+
+
+# --------------------------------------------
+def main(argv=None):
+    '''Command line interface: parses argv (sys.argv by default) and runs VideoTool'''
     ver = '1.6.0-rc1'
     H264CRF = 22
     VP9CRF = 30
     LAMEQUAL = 4
     parser = argparse.ArgumentParser(description='%(prog)s - is a ffmpeg/ffprobe wrapper. https://github.com/qiwichupa/ffeasytool')
+    parser.add_argument('--progress', choices=['none', 'term', 'json'], default='none', help='report progress, speed and ETA of every ffmpeg process: compact line (term) or JSON lines on stdout (json, all other output goes to stderr)')
+    parser.add_argument('--no-probe-cache', action='store_true', help='do not use (and do not update) the persistent ffprobe cache')
+    parser.add_argument('--auto-preset', action='store_true', help='choose x264 preset by sample encodes (the choice is cached for this host and resolution): '
+                        'the slowest preset fast enough for --min-speed or the fastest one with --min-ssim / --min-psnr quality')
+    presetgroup = parser.add_mutually_exclusive_group()
+    presetgroup.add_argument('--min-speed', type=float, default=1.0, metavar='1.0', help='realtime factor for --auto-preset (default: 1.0)')
+    presetgroup.add_argument('--min-ssim', type=float, metavar='0.98', help='SSIM for --auto-preset')
+    presetgroup.add_argument('--min-psnr', type=float, metavar='42', help='PSNR (dB) for --auto-preset')
+    parser.add_argument('--keyint', type=float, metavar='SECONDS', help='x264: a keyframe (seek point) every SECONDS at most (default: chosen by x264 at scene changes)')
+    parser.add_argument('--timeout', type=float, metavar='SECONDS', help='stop ffmpeg if one file takes longer (outputs and temporary files are removed)')
     subparser = parser.add_subparsers(title='COMMANDS', dest='command', required=True, help='''Check "%(prog)s COMMAND -h" for additional help''')
     compress = subparser.add_parser('compress', help='''compress single video to size. Ex.: "%(prog)s compress -s 8M myvideo.mp4"''')
     cut = subparser.add_parser('cut', help='''cut single video. Use -a and(or) -b parameters as  start and end points. Ex.: "%(prog)s cut -a 01:05 -b 02:53 myvideo.mp4" ''')
+    pipeline = subparser.add_parser('pipeline', help='''run several operations as one ffmpeg process. Ex.: "%(prog)s pipeline myvideo.mp4 cut:a=01:00,b=05:00 resize:m=0.5 towebm" ''')
+    multi = subparser.add_parser('multi', help='''convert file(s) to several formats at once (one decode). Ex.: "%(prog)s multi --to to264 --to tomp3 --to togif:x=5,w=320 *.mkv" ''')
     merge = subparser.add_parser('merge', help='''merge video files. Ex.: "%(prog)s merge -f 1280x720 *.mp4" ''')
     resize = subparser.add_parser('resize', help='''resize single video. Ex.: "%(prog)s resize -m 0.5 myvideo.mp4",  "%(prog)s resize -r 1280x720 myvideo.mp4"''')
     split = subparser.add_parser('split', help='''split single video. Ex.: "%(prog)s split -t 5m myvideo.mp4" ''')
@@ -545,15 +4107,31 @@ if __name__ == '__main__':
     togif = subparser.add_parser('togif', help='''convert file(s) to gif. Ex.: "%(prog)s togif -x 5 *.mp4" ''')
     tomp3 = subparser.add_parser('tomp3', help='''extract audio to mp3. Ex.: "%(prog)s tomp3 -t 2 *.mp4" ''')
     towebm = subparser.add_parser('towebm', help='''convert file(s) to webm/vp9. Ex.: "%(prog)s towebm *.mp4" ''')
+    thumbs = subparser.add_parser('thumbs', help='''contact sheet of keyframes (only keyframes are decoded), optionally a sprite sheet with WebVTT for scrubbing previews. Ex.: "%(prog)s thumbs -t 24 --sprite *.mp4" ''')
+    index = subparser.add_parser('index', help='''index keyframes and packets of file(s) once for cut --snap, split and chunked encoding; show keyframes and bitrate. Ex.: "%(prog)s index -a 01:00 -b 02:00 myvideo.mkv" ''')
     version = subparser.add_parser('version', help='''show version''')
+    watch = subparser.add_parser('watch', help='''convert new files in directories as they appear. Ex.: "%(prog)s watch --op to264 -o converted incoming/" ''')
+    enqueue = subparser.add_parser('enqueue', help='''add files to a work queue of "worker" processes (on any node). Ex.: "%(prog)s enqueue --queue /mnt/share/queue.sqlite --op to264 -o /mnt/share/out /mnt/share/in/*.mkv" ''')
+    worker = subparser.add_parser('worker', help='''run jobs of a work queue. Ex.: "%(prog)s worker --queue /mnt/share/queue.sqlite" ''')
+    queue = subparser.add_parser('queue', help='''show jobs of a work queue. Ex.: "%(prog)s queue /mnt/share/queue.sqlite" ''')
+    bench = subparser.add_parser('bench', help='''benchmark commands on generated test videos. Ex.: "%(prog)s bench -o before.json", "%(prog)s bench --compare before.json" ''')
 
     merge.add_argument('-f', type=str, required=True, metavar='1280x720[@30]', help='output video format')
     merge.add_argument('-q', type=int, default=H264CRF, metavar='{}'.format(H264CRF), help='quality from 51 (worst), to 0 (best). Recommended: 28-17. Default: {}'.format(H264CRF))
+    merge.add_argument('--reencode', action='store_true', help='always re-encode (by default files of the same format are joined without re-encoding)')
+    merge.add_argument('--resume', action='store_true', help='encode in segments with a checkpoint: started again after a kill, continues from the last finished segment')
+    merge.add_argument('--segment', type=int, default=300, metavar='300', help='segment length in seconds for --resume (default: 300)')
+    merge.add_argument('--normalize', action='store_true', help='for many files: encode every file separately (in parallel, cached for the next merges), then join them without re-encoding')
+    merge.add_argument('-j', '--jobs', type=int, default=0, metavar='N', help='number of files normalized at once (default: auto, by CPU count)')
     merge.add_argument('file', nargs='+', help='filenames (space-separated) or name with wildcards')
 
-    compress.add_argument('-s', type=str,required=True, metavar='2M', help='target size (in bytes by default). Ex.: 1024, 512K, 2M, 1G')
+    compress.add_argument('-s', type=str,required=True, metavar='2M', help='target size (in bytes by default). Ex.: 1024, 512K, 2M, 1G. Several comma-separated sizes share one first pass: 8M,25M,50M')
     compress.add_argument('-a', type=int, metavar='128', help='audio bitrate in kbps. By default it is taken from the source file.')
     compress.add_argument('-n', type=int, default=1, metavar='1', help='audio track (default: 1)')
+    compress.add_argument('-c', '--chunks', type=int, default=0, metavar='N', help='split the file at keyframes into N parts and encode them in parallel (for long videos)')
+    compress.add_argument('--mode', choices=['abr', 'predict'], default='abr', help='abr - two-pass encoding (default), predict - single pass with CRF predicted from short samples (faster)')
+    compress.add_argument('-j', '--jobs', type=int, default=1, metavar='N', help='number of second passes (target sizes) encoded at once (default: 1)')
+    compress.add_argument('--plan', action='store_true', help='dry run: print ffmpeg commands and estimated time and output size (learned from the previous runs), encode nothing')
     compress.add_argument('file', nargs='+', help='filename(s) (space-separated) or name with wildcards')
 
     resizegroup = resize.add_mutually_exclusive_group(required=True)
@@ -567,41 +4145,227 @@ if __name__ == '__main__':
     cut.add_argument('-b', type=str, default='-1', metavar='[HH:][MM:]SS[.mmm]', help='end point. Ex.: 01:05:00 (1 hour, 5 min)')
     cut.add_argument('-q', type=int, default=H264CRF, metavar='{}'.format(H264CRF), help='quality from 51 (worst), to 0 (best). Recommended: 28-17. Default: {}'.format(H264CRF))
     cut.add_argument('-n', type=int, default=1, metavar='1', help='audio track (default: 1)')
+    cut.add_argument('-k', '--smart', action='store_true', help='smart cut (h264 only): copy the video between keyframes, re-encode only the edges')
+    cut.add_argument('--snap', action='store_true', help='move -a and -b to the keyframes around the range and copy the video (fast, no re-encoding; see index)')
     cut.add_argument('file', nargs=1, help='filename')
 
-    split.add_argument('-t', type=str, required=True, metavar='20m', help='chunks length (in sec by default). Ex.: 15, 2m, 1h')
+    splitgroup = split.add_mutually_exclusive_group(required=True)
+    splitgroup.add_argument('-t', type=str, default='0', metavar='20m', help='chunks length (in sec by default). Ex.: 15, 2m, 1h')
+    splitgroup.add_argument('-c', '--chunks', type=int, default=0, metavar='N', help='number of chunks of equal length')
     split.add_argument('-q', type=int, default=H264CRF, metavar='{}'.format(H264CRF), help='quality from 51 (worst), to 0 (best). Recommended: 28-17. Default: {}'.format(H264CRF))
     split.add_argument('-n', type=int, default=1, metavar='1', help='audio track (default: 1)')
+    split.add_argument('--copy', action='store_true', help='split without re-encoding (fast, chunks start at keyframes, so their length is not exact)')
+    split.add_argument('-j', '--jobs', type=int, default=0, metavar='N', help='number of chunks encoded at once (default: auto, by CPU count)')
     split.add_argument('file', nargs=1, help='filename')
 
+    multi.add_argument('--to', action='append', required=True, metavar='OUTPUT', help='''output (repeat for every output): to264:q=N, towebm:q=N, tomp3:q=N, togif:x=FPS,w=WIDTH,dither=MODE''')
+    multi.add_argument('-n', type=int, default=1, metavar='1', help='audio track (default: 1)')
+    multi.add_argument('-j', '--jobs', type=int, default=0, metavar='N', help='number of files processed at once (default: auto, by CPU count)')
+    multi.add_argument('--force', action='store_true', help='convert all files (by default files converted before with the same settings are skipped)')
+    multi.add_argument('--hash', action='store_true', help='compare content of input files with changed mtime (slower), not only size and mtime')
+    multi.add_argument('--plan', action='store_true', help='dry run: print ffmpeg commands and estimated time and output size (learned from the previous runs), encode nothing')
+    multi.add_argument('file', nargs='+', help='filename(s) (space-separated) or name with wildcards')
+
+    thumbs.add_argument('-t', '--thumbs', type=int, default=16, metavar='16', help='number of thumbnails (default: 16)')
+    thumbs.add_argument('-i', '--interval', type=float, default=None, metavar='SECONDS', help='one thumbnail every N seconds (instead of -t)')
+    thumbs.add_argument('-c', '--columns', type=int, default=4, metavar='4', help='thumbnails in a row (default: 4)')
+    thumbs.add_argument('-w', '--width', type=int, default=320, metavar='320', help='thumbnail width on the contact sheet (default: 320)')
+    thumbs.add_argument('--scenes', action='store_true', help='keyframes with the most changes instead of evenly spaced ones')
+    thumbs.add_argument('--sprite', action='store_true', help='also write <name>_thumbs_sprite.jpg and <name>_thumbs_sprite.vtt (WebVTT for scrubbing previews)')
+    thumbs.add_argument('--sprite-width', type=int, default=160, metavar='160', help='thumbnail width on the sprite sheet (default: 160)')
+    thumbs.add_argument('-j', '--jobs', type=int, default=0, metavar='N', help='number of files processed at once (default: auto, by CPU count)')
+    thumbs.add_argument('--force', action='store_true', help='make sheets of all files (by default files done before with the same settings are skipped)')
+    thumbs.add_argument('file', nargs='+', help='filename(s) (space-separated) or name with wildcards')
+
+    index.add_argument('-a', type=str, metavar='[HH:][MM:]SS[.mmm]', help='start of the range: show keyframes around it and the bitrate of the range')
+    index.add_argument('-b', type=str, metavar='[HH:][MM:]SS[.mmm]', help='end of the range (default: the end of the file)')
+    index.add_argument('file', nargs='+', help='filename(s) (space-separated) or name with wildcards')
+
+    pipeline.add_argument('-n', type=int, default=1, metavar='1', help='audio track (default: 1)')
+    pipeline.add_argument('-o', '--outfile', type=str, metavar='out.webm', help='output file (default: <name>_pipeline.<extension of the last step>)')
+    pipeline.add_argument('file', nargs=1, help='filename')
+    pipeline.add_argument('step', nargs='+', help='''steps: cut:a=START,b=END, resize:m=MULTIPLIER or resize:r=WxH, then one output step
+                          (default: to264): to264:q=N, towebm:q=N, tomp3:q=N, togif:x=FPS,w=WIDTH,dither=MODE''')
+
     togif.add_argument('-x', type=int, default=10, metavar='10', help='framerate for gif (default: 10)')
+    togif.add_argument('-w', '--width', type=int, default=None, metavar='320', help='scale down to this width (default: keep size)')
+    togif.add_argument('--dither', default='sierra2_4a', choices=['sierra2_4a', 'sierra2', 'floyd_steinberg', 'heckbert', 'bayer', 'none'], help='dither mode (default: sierra2_4a)')
+    togif.add_argument('-s', '--size', default=None, metavar='5M', help='target size: framerate, width and dither (-x, -w and --dither are upper limits) are chosen to fit it')
+    togif.add_argument('-c', '--chunks', type=int, default=0, metavar='N', help='encode N parts of a file in parallel (default: 0 - whole file at once)')
+    togif.add_argument('-j', '--jobs', type=int, default=0, metavar='N', help='number of files processed at once (default: auto, by CPU count)')
+    togif.add_argument('--plan', action='store_true', help='dry run: print ffmpeg commands and estimated time and output size (learned from the previous runs), encode nothing')
+    togif.add_argument('--force', action='store_true', help='convert all files (by default files converted before with the same settings are skipped)')
+    togif.add_argument('--hash', action='store_true', help='compare content of input files with changed mtime (slower), not only size and mtime')
     togif.add_argument('file', nargs='+', help='filename(s) (space-separated) or name with wildcards')
 
     to264.add_argument('-q', type=int, default=H264CRF, metavar='{}'.format(H264CRF), help='quality from 51 (worst), to 0 (best). Recommended: 28-17. Default: {}'.format(H264CRF))
     to264.add_argument('-n', type=int, default=1, metavar='1', help='audio track (default: 1)')
+    to264.add_argument('-j', '--jobs', type=int, default=0, metavar='N', help='number of files processed at once (default: auto, by CPU count)')
+    to264.add_argument('--plan', action='store_true', help='dry run: print ffmpeg commands and estimated time and output size (learned from the previous runs), encode nothing')
+    to264.add_argument('--force', action='store_true', help='convert all files (by default files converted before with the same settings are skipped)')
+    to264.add_argument('--hash', action='store_true', help='compare content of input files with changed mtime (slower), not only size and mtime')
+    to264.add_argument('-c', '--chunks', type=int, default=0, metavar='N', help='split every file at keyframes into N parts and encode them in parallel (for long videos)')
     to264.add_argument('file', nargs='+', help='filename(s) (space-separated) or name with wildcards')
 
     towebm.add_argument('-q', type=int, default=VP9CRF, metavar='{}'.format(VP9CRF), help='quality from 63 (worst), to 0 (best). Recommended: 35-15. Default: {}'.format(VP9CRF))
     towebm.add_argument('-n', type=int, default=1, metavar='1', help='audio track (default: 1)')
+    towebm.add_argument('-j', '--jobs', type=int, default=0, metavar='N', help='number of files processed at once (default: auto, by CPU count)')
+    towebm.add_argument('--plan', action='store_true', help='dry run: print ffmpeg commands and estimated time and output size (learned from the previous runs), encode nothing')
+    towebm.add_argument('--force', action='store_true', help='convert all files (by default files converted before with the same settings are skipped)')
+    towebm.add_argument('--hash', action='store_true', help='compare content of input files with changed mtime (slower), not only size and mtime')
+    towebm.add_argument('--resume', action='store_true', help='encode in segments with a checkpoint: started again after a kill, continues from the last finished segment')
+    towebm.add_argument('--segment', type=int, default=300, metavar='300', help='segment length in seconds for --resume (default: 300)')
     towebm.add_argument('file', nargs='+', help='filename(s) (space-separated) or name with wildcards')
 
-    tomp3.add_argument('-n', type=int, default=1, metavar='1', help='audio track (default: 1)')
+    tomp3.add_argument('-n', type=str, default='1', metavar='1', help='audio track or comma-separated tracks: 1,3 (default: 1). Several tracks are written to <name>_<track>.mp3')
+    tomp3.add_argument('--all-tracks', action='store_true', help='extract all audio tracks (one ffmpeg process)')
+    tomp3.add_argument('--copy', action='store_true', help='keep mp3 and AAC (.m4a) tracks without re-encoding')
     tomp3.add_argument('-q', type=int, default=LAMEQUAL, metavar='{}'.format(LAMEQUAL), help='quality from 9 (worst), to 0 (best).  Default: {}'.format(LAMEQUAL))
+    tomp3.add_argument('-j', '--jobs', type=int, default=0, metavar='N', help='number of files processed at once (default: auto, by CPU count)')
+    tomp3.add_argument('--plan', action='store_true', help='dry run: print ffmpeg commands and estimated time and output size (learned from the previous runs), encode nothing')
+    tomp3.add_argument('--force', action='store_true', help='convert all files (by default files converted before with the same settings are skipped)')
+    tomp3.add_argument('--hash', action='store_true', help='compare content of input files with changed mtime (slower), not only size and mtime')
     tomp3.add_argument('file', nargs='+', help='filename(s) (space-separated) or name with wildcards.')
 
-    args = parser.parse_args()
+    watch.add_argument('--op', choices=sorted(FolderWatcher.KINDS), required=True, help='operation for every new file')
+    watch.add_argument('-o', '--outdir', type=str, default='.', metavar='DIR', help='directory for output files (default: current)')
+    watch.add_argument('-q', type=int, metavar='N', help='quality (see the operation help). Default: the operation default')
+    watch.add_argument('-n', type=int, default=1, metavar='1', help='audio track (default: 1)')
+    watch.add_argument('-s', type=str, metavar='2M', help='target size(s) for compress')
+    watch.add_argument('-x', type=int, default=10, metavar='10', help='framerate for togif (default: 10)')
+    watch.add_argument('--resume', action='store_true', help='towebm in segments with a checkpoint: a job started again continues from the last finished segment')
+    watch.add_argument('-j', '--jobs', type=int, default=0, metavar='N', help='number of files processed at once (default: auto, by CPU count)')
+    watch.add_argument('--pattern', type=str, default='*', metavar='*.mkv', help='names of files to process (default: all)')
+    watch.add_argument('--stable', type=float, default=5, metavar='5', help='seconds without changes of size and mtime before a file is processed (default: 5)')
+    watch.add_argument('--interval', type=float, default=2, metavar='2', help='seconds between checks (directory scans without inotify) (default: 2)')
+    watch.add_argument('--attempts', type=int, default=3, metavar='3', help='runs of a failed job before it is given up (until the file is changed) (default: 3)')
+    watch.add_argument('--db', type=str, metavar='watch.sqlite', help='job table (default: in the cache directory)')
+    watch.add_argument('dir', nargs='+', help='directories to watch')
+
+    enqueue.add_argument('--queue', type=str, required=True, metavar='QUEUE', help='work queue: SQLite file (*.sqlite, *.db) or directory, on a mount shared by the nodes')
+    enqueue.add_argument('--op', choices=sorted(FolderWatcher.KINDS), required=True, help='operation for every file')
+    enqueue.add_argument('-o', '--outdir', type=str, default='.', metavar='DIR', help='directory for output files (default: current)')
+    enqueue.add_argument('-q', type=int, metavar='N', help='quality (see the operation help). Default: the operation default')
+    enqueue.add_argument('-n', type=int, default=1, metavar='1', help='audio track (default: 1)')
+    enqueue.add_argument('-s', type=str, metavar='2M', help='target size(s) for compress')
+    enqueue.add_argument('-x', type=int, default=10, metavar='10', help='framerate for togif (default: 10)')
+    enqueue.add_argument('--resume', action='store_true', help='towebm in segments with a checkpoint: a job started again continues from the last finished segment')
+    enqueue.add_argument('file', nargs='+', help='filename(s) (space-separated) or name with wildcards. Paths must be the same on all nodes')
+
+    worker.add_argument('--queue', type=str, required=True, metavar='QUEUE', help='work queue (see enqueue)')
+    worker.add_argument('-j', '--jobs', type=int, default=0, metavar='N', help='jobs run at once (default: auto, by CPU count)')
+    worker.add_argument('--lease', type=float, default=60, metavar='60', help='seconds a job stays claimed without a heartbeat of this worker (default: 60)')
+    worker.add_argument('--attempts', type=int, default=3, metavar='3', help='claims of a job (after crashed workers) before it is failed (default: 3)')
+    worker.add_argument('--wait', action='store_true', help='wait for new jobs instead of exit when all jobs are finished')
+    worker.add_argument('--interval', type=float, default=5, metavar='5', help='seconds between checks of the queue without free jobs (default: 5)')
+    worker.add_argument('--force', action='store_true', help='convert all files (by default files converted before with the same settings are skipped)')
+
+    queue.add_argument('queue', type=str, help='work queue (see enqueue)')
+
+    bench.add_argument('-r', '--repeats', type=int, default=3, metavar='3', help='runs of every command (default: 3)')
+    bench.add_argument('-c', '--commands', type=str, default=','.join(Benchmark.COMMANDS), metavar='to264,tomp3', help='comma-separated commands (default: all)')
+    bench.add_argument('--quick', action='store_true', help='one small input (320x240, 5 sec)')
+    bench.add_argument('-o', '--output', type=str, metavar='results.json', help='save results to JSON file')
+    bench.add_argument('--compare', type=str, metavar='baseline.json', help='compare with previous results, exit code 1 on regressions')
+    bench.add_argument('--threshold', type=float, default=10, metavar='10', help='regression threshold in percent (default: 10)')
+
+    args = parser.parse_args(argv)
+
+    stdout = sys.stdout
+    if args.progress == 'json':
+        # stdout is for JSON lines only: messages and the summary go to stderr
+        sys.stdout = sys.stderr
+    # status messages of VideoTool and of the batch modes
+    logging.basicConfig(level=logging.INFO, format='%(message)s', stream=sys.stdout)
+
+    def confirm_overwrite(outfile):
+        return sys.stdin.isatty() and input('File "{}" already exists. Overwrite? [y/N] '.format(outfile)).strip().lower() in ('y', 'yes')
 
-    # some fuckup with code: two 'videotool = VideoTool()' - here and later
-    # The VideoTool class checks for ffmpeg executables and
-    # calls sys.exit() if they are not found. So, to display the version of this script,
-    # if ffmpeg is not installed, an instance of the VideoTool class must be created AFTER printing the version.
+    # VideoTool looks for ffmpeg executables on first use and raises BinaryNotFoundError
+    # if they are not found. So the version of this script is printed even if ffmpeg is not installed.
     if args.command == 'version':
         print('ffeasytool: {}'.format(ver))
         videotool = VideoTool()
-        binsinfo = videotool.show_versions()
+        try:
+            binsinfo = videotool.show_versions()
+        except BinaryNotFoundError as e:
+            print(e)
+            sys.exit(1)
         print('ffmpeg ({}): {}\nffprobe ({}): {}'.format(binsinfo[0], binsinfo[1],binsinfo[2],binsinfo[3]))
         sys.exit()
 
+    if args.command == 'bench':
+        videotool = VideoTool(probecache=False)
+        videotool.calibration = Calibration() # do not learn from synthetic videos
+        videotool.quiet = True
+        report = Benchmark(videotool, commands=args.commands.split(','), repeats=args.repeats, quick=args.quick).run()
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=1)
+        if args.compare:
+            with open(args.compare, encoding='utf-8') as f:
+                if Benchmark.compare(report, json.load(f), threshold=args.threshold):
+                    sys.exit(1)
+        sys.exit()
+
+    if args.command in ('watch', 'enqueue'):
+        if args.op == 'compress' and not args.s:
+            print('Use -s with compress.')
+            sys.exit(1)
+        options = {'audiotrack': args.n}
+        if args.q is not None:
+            options['quality'] = args.q
+        if args.op == 'compress':
+            options['size'] = args.s
+        if args.op == 'towebm' and args.resume:
+            options['resume'] = True
+        if args.op == 'togif':
+            options = {'fps': args.x}
+
+    if args.command == 'enqueue':
+        workqueue = get_workqueue(args.queue)
+        files = sorted(args.file) if len(args.file) > 1 else sorted(glob.glob(args.file[0]))
+        for file in files:
+            method, kwargs, outfiles = FolderWatcher.get_job(args.op, os.path.abspath(file), options, os.path.abspath(args.outdir))
+            workqueue.add(file, method.__name__, kwargs)
+        print('{} job(s) queued.'.format(len(files)))
+        sys.exit()
+
+    if args.command == 'queue':
+        jobs = get_workqueue(args.queue).get_jobs()
+        for name, status, message, seconds in jobs:
+            print('  {:8} {} ({:.1f}s){}'.format(status, name, seconds or 0.0, ': {}'.format(message) if message else ''))
+        counts = {}
+        for job in jobs:
+            counts[job[1]] = counts.get(job[1], 0) + 1
+        print(', '.join('{}: {}'.format(status, counts.get(status, 0)) for status in ('queued', 'running', 'ok', 'skipped', 'failed')))
+        sys.exit()
+
+    if args.command == 'worker':
+        videotool = VideoTool(probecache=not args.no_probe_cache)
+        videotool.timeout = args.timeout
+        if args.auto_preset:
+            videotool.autopreset = ('ssim', args.min_ssim) if args.min_ssim else ('psnr', args.min_psnr) if args.min_psnr else ('speed', args.min_speed)
+        videotool.keyint = args.keyint
+        results = Worker(videotool, get_workqueue(args.queue), jobs=args.jobs, lease=args.lease, attempts=args.attempts
+                         , wait=args.wait, interval=args.interval, force=args.force).run()
+        counts = {status: len([r for r in results if r[1] == status]) for status in ('ok', 'skipped', 'failed')}
+        print('ok: {ok}, skipped: {skipped}, failed: {failed}'.format(**counts))
+        sys.exit(1 if counts['failed'] else 0)
+
+    if args.command == 'watch':
+        videotool = VideoTool(probecache=not args.no_probe_cache)
+        if args.auto_preset:
+            videotool.autopreset = ('ssim', args.min_ssim) if args.min_ssim else ('psnr', args.min_psnr) if args.min_psnr else ('speed', args.min_speed)
+        videotool.keyint = args.keyint
+        watcher = FolderWatcher(AsyncVideoTool(videotool, timeout=args.timeout), args.dir, args.op, options=options, outdir=args.outdir, jobs=args.jobs
+                                , pattern=args.pattern, interval=args.interval, stable=args.stable, db=args.db, attempts=args.attempts)
+        try:
+            asyncio.run(watcher.run())
+        except KeyboardInterrupt:
+            print('\nStopped.')
+        sys.exit()
+
     # correct method to parse filenames with wildcards:
     # wildcards will be converted to filenames by shell in linux,
     # but not in windows. So we set  "nargs='+'" in argparse argument and...
@@ -612,62 +4376,137 @@ if __name__ == '__main__':
     elif len(args.file) == 1 and args.command != 'version':
         files = sorted(glob.glob(args.file[0]))
 
-    videotool = VideoTool() # this instance is created AFTER the "version" command (see comment before "version")
-    if args.command == 'resize':
-        infile = files[0]
-        infilebasename = os.path.basename(infile)
-        outfile = '{}_resized.mp4'.format(os.path.splitext(infilebasename)[0])
-        if args.m != 1:
-            videotool.resize_single_video(infile=infile, scale=args.m, quality=args.q, audiotrack=args.n, outfile=outfile)
-        elif args.r:
-            videotool.resize_single_video(infile=infile, resolution=args.r, quality=args.q, audiotrack=args.n, outfile=outfile)
-    elif args.command == 'compress':
-        infile = files[0]
-        infilebasename = os.path.basename(infile)
-        outfile = '{}_compressed_{}.mp4'.format(os.path.splitext(infilebasename)[0], args.s)
-        if args.a:
-            videotool.compress_single_video(infile=infile, targetsize=args.s, audiobitrate=args.a, audiotrack=args.n, outfile=outfile)
-        else:
-            videotool.compress_single_video(infile=infile, targetsize=args.s, audiotrack=args.n, outfile=outfile)
-    elif args.command == 'split':
-        infile = files[0]
-        infilebasename = os.path.basename(infile)
-        videotool.split_video(infile=infile, time=args.t, quality=args.q, audiotrack=args.n)
-    elif args.command == 'togif':
-        for infile in files:
+    videotool = VideoTool(probecache=not args.no_probe_cache)
+    videotool.confirm_overwrite = confirm_overwrite
+    if args.progress != 'none':
+        videotool.progress = ProgressReporter(mode=args.progress, stream=stdout if args.progress == 'json' else None)
+    videotool.timeout = args.timeout
+    if args.auto_preset:
+        videotool.autopreset = ('ssim', args.min_ssim) if args.min_ssim else ('psnr', args.min_psnr) if args.min_psnr else ('speed', args.min_speed)
+    videotool.keyint = args.keyint
+    try:
+        if args.command == 'resize':
+            infile = files[0]
             infilebasename = os.path.basename(infile)
-            outfile = '{}.gif'.format(os.path.splitext(infilebasename)[0])
-            fps = args.x
-            videotool.convert_to_gif(infile, fps, outfile)
-    elif args.command == 'to264':
-        for infile in files:
+            outfile = '{}_resized.mp4'.format(os.path.splitext(infilebasename)[0])
+            if args.m != 1:
+                videotool.resize_single_video(infile=infile, scale=args.m, quality=args.q, audiotrack=args.n, outfile=outfile)
+            elif args.r:
+                videotool.resize_single_video(infile=infile, resolution=args.r, quality=args.q, audiotrack=args.n, outfile=outfile)
+        elif args.command == 'compress':
+            infile = files[0]
             infilebasename = os.path.basename(infile)
-            outfile = '{}.mp4'.format(os.path.splitext(infilebasename)[0])
-            videotool.convert_to_x264(infile=infile, quality=args.q, audiotrack=args.n, outfile=outfile)
-    elif args.command == 'towebm':
-        for infile in files:
+            targetsizes = args.s.split(',')
+            outfiles = ['{}_compressed_{}.mp4'.format(os.path.splitext(infilebasename)[0], size) for size in targetsizes]
+            if args.plan:
+                scheduler = JobScheduler(videotool, jobs=1)
+                scheduler.add(infile, videotool.compress_single_video, infile=infile, targetsize=targetsizes, audiobitrate=args.a, audiotrack=args.n, chunks=args.chunks, jobs=args.jobs, mode=args.mode, outfile=outfiles)
+            elif args.a:
+                videotool.compress_single_video(infile=infile, targetsize=targetsizes, audiobitrate=args.a, audiotrack=args.n, chunks=args.chunks, jobs=args.jobs, mode=args.mode, outfile=outfiles)
+            else:
+                videotool.compress_single_video(infile=infile, targetsize=targetsizes, audiotrack=args.n, chunks=args.chunks, jobs=args.jobs, mode=args.mode, outfile=outfiles)
+        elif args.command == 'index':
+            for infile in files:
+                index = videotool.get_index(infile)
+                info = videotool.probe(infile)
+                gops = [b - a for a, b in zip(index.keytimes, index.keytimes[1:])]
+                print('"{}": {} keyframes (GOP: {:.2f}s average, {:.2f}s max), {} packets, video {:.0f} kbps'.format(
+                    infile, len(index.keytimes), sum(gops) / len(gops) if gops else 0.0, max(gops, default=0.0), len(index.packettimes), index.bitrate() / 1000))
+                if args.a is not None or args.b is not None:
+                    start = videotool._parse_timestamp(args.a) if args.a is not None else 0.0
+                    end = videotool._parse_timestamp(args.b) if args.b is not None else info.duration
+                    before = index.snap(start + info.start_time, 'before')
+                    after = index.snap(end + info.start_time, 'after')
+                    print('  keyframes: at or before {:.3f}: {}, at or after {:.3f}: {}'.format(
+                        start, '{:.3f}'.format(before - info.start_time) if before is not None else '-', end, '{:.3f}'.format(after - info.start_time) if after is not None else '-'))
+                    print('  video bitrate {:.3f} - {:.3f}: {:.0f} kbps'.format(start, end, index.bitrate(start + info.start_time, end + info.start_time) / 1000))
+        elif args.command == 'pipeline':
+            videotool.pipeline(infile=files[0], steps=args.step, audiotrack=args.n, outfile=args.outfile)
+        elif args.command == 'thumbs':
+            scheduler = JobScheduler(videotool, jobs=args.jobs, kind='thumbs', force=args.force)
+            for infile in files:
+                infilebasename = os.path.basename(infile)
+                outfile = '{}_thumbs.jpg'.format(os.path.splitext(infilebasename)[0])
+                scheduler.add(infile, videotool.make_thumbnails, infile=infile, count=args.thumbs, columns=args.columns, width=args.width, scenes=args.scenes
+                              , interval=args.interval, sprite=args.sprite, spritewidth=args.sprite_width, outfile=outfile)
+        elif args.command == 'multi':
+            scheduler = JobScheduler(videotool, jobs=args.jobs, kind='x264', force=args.force, usehash=args.hash)
+            for infile in files:
+                scheduler.add(infile, videotool.multi, infile=infile, outputs=args.to, audiotrack=args.n, outfiles=videotool.get_multioutfiles(infile, args.to))
+        elif args.command == 'split':
+            infile = files[0]
             infilebasename = os.path.basename(infile)
-            outfile = '{}.webm'.format(os.path.splitext(infilebasename)[0])
-            videotool.convert_to_webm(infile=infile, quality=args.q, audiotrack=args.n, outfile=outfile)
-    elif args.command == 'cut':
-        infile = files[0]
-        infilebasename = os.path.basename(infile)
-        outfile = '{}_cut.mp4'.format(os.path.splitext(infilebasename)[0])
-        if args.a == -1 and args.b == -1:
-            print('use -a and(or) -b')
-        else:
-            videotool.cut_single_video(infile=infile, startpoint=args.a, endpoint=args.b, quality=args.q, audiotrack=args.n, outfile=outfile)
-    elif args.command == 'tomp3':
-        for infile in files:
+            videotool.split_video(infile=infile, time=args.t, chunks=args.chunks, quality=args.q, audiotrack=args.n, copy=args.copy, jobs=args.jobs)
+        elif args.command == 'togif':
+            scheduler = JobScheduler(videotool, jobs=args.jobs, kind='gif', force=args.force, usehash=args.hash)
+            for infile in files:
+                infilebasename = os.path.basename(infile)
+                outfile = '{}.gif'.format(os.path.splitext(infilebasename)[0])
+                fps = args.x
+                scheduler.add(infile, videotool.convert_to_gif, infile=infile, fps=fps, outfile=outfile, width=args.width, dither=args.dither, targetsize=args.size, chunks=args.chunks)
+        elif args.command == 'to264':
+            scheduler = JobScheduler(videotool, jobs=args.jobs, kind='x264', force=args.force, usehash=args.hash)
+            for infile in files:
+                infilebasename = os.path.basename(infile)
+                outfile = '{}.mp4'.format(os.path.splitext(infilebasename)[0])
+                scheduler.add(infile, videotool.convert_to_x264, infile=infile, quality=args.q, audiotrack=args.n, chunks=args.chunks, outfile=outfile)
+        elif args.command == 'towebm':
+            scheduler = JobScheduler(videotool, jobs=args.jobs, kind='vp9', force=args.force, usehash=args.hash)
+            # only given with --resume: the manifest (see JobScheduler) keeps files converted without it up to date
+            resumeoptions = {'resume': True, 'segmentlength': args.segment} if args.resume else {}
+            for infile in files:
+                infilebasename = os.path.basename(infile)
+                outfile = '{}.webm'.format(os.path.splitext(infilebasename)[0])
+                scheduler.add(infile, videotool.convert_to_webm, infile=infile, quality=args.q, audiotrack=args.n, outfile=outfile, **resumeoptions)
+        elif args.command == 'cut':
+            infile = files[0]
             infilebasename = os.path.basename(infile)
-            outfile = '{}.mp3'.format(os.path.splitext(infilebasename)[0])
-            videotool.convert_to_mp3(infile=infile, audiotrack=args.n, quality=args.q, outfile=outfile)
-    elif args.command == 'merge':
-        filestomerge = files
-        resolution, *fps = args.f.split('@')
-        if len(fps) < 1:
-            fps = 30
-        else:
-            fps = int(fps[0])
-        width, height = resolution.split('x')
-        videotool.avmerge(filestomerge, int(width), int(height), int(fps), quality=args.q, outfile='outfile_merged.mp4')
+            outfile = '{}_cut.mp4'.format(os.path.splitext(infilebasename)[0])
+            if args.a == -1 and args.b == -1:
+                print('use -a and(or) -b')
+            else:
+                videotool.cut_single_video(infile=infile, startpoint=args.a, endpoint=args.b, quality=args.q, audiotrack=args.n, smart=args.smart, snap=args.snap, outfile=outfile)
+        elif args.command == 'tomp3':
+            try:
+                audiotracks = 'all' if args.all_tracks else [int(track) for track in args.n.split(',')]
+            except ValueError:
+                print('Wrong audio track(s): "{}"'.format(args.n))
+                sys.exit(1)
+            if isinstance(audiotracks, list) and len(audiotracks) == 1:
+                audiotracks = audiotracks[0]
+            scheduler = JobScheduler(videotool, jobs=args.jobs, kind='mp3', force=args.force, usehash=args.hash)
+            for infile in files:
+                infilebasename = os.path.basename(infile)
+                outfile = '{}.mp3'.format(os.path.splitext(infilebasename)[0])
+                scheduler.add(infile, videotool.convert_to_mp3, infile=infile, audiotrack=audiotracks, quality=args.q, copy=args.copy, outfile=outfile)
+        elif args.command == 'merge':
+            filestomerge = files
+            resolution, *fps = args.f.split('@')
+            if len(fps) < 1:
+                fps = 30
+            else:
+                fps = int(fps[0])
+            width, height = resolution.split('x')
+            videotool.avmerge(filestomerge, int(width), int(height), int(fps), quality=args.q, copy=not args.reencode, resume=args.resume, segmentlength=args.segment
+                             , normalize=args.normalize, jobs=args.jobs, outfile='outfile_merged.mp4')
+
+        if getattr(args, 'plan', False):
+            if not scheduler.print_plan(scheduler.plan()):
+                sys.exit(1)
+        elif args.command in ('togif', 'to264', 'towebm', 'tomp3', 'multi', 'thumbs'):
+            scheduler.run()
+            if not scheduler.print_summary():
+                sys.exit(1)
+    except subprocess.CalledProcessError as e:
+        print('ffmpeg failed with exit code {}'.format(e.returncode))
+        sys.exit(1)
+    except subprocess.TimeoutExpired as e:
+        print('ffmpeg timed out after {:.0f}s'.format(e.timeout))
+        sys.exit(1)
+    except (FileExistsError, FFEasyToolError) as e:
+        print(e)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
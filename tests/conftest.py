@@ -0,0 +1,36 @@
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+requires_ffmpeg = pytest.mark.skipif(shutil.which('ffmpeg') is None or shutil.which('ffprobe') is None, reason='ffmpeg not found')
+
+
+@pytest.fixture(autouse=True)
+def cachedir(tmp_path, monkeypatch):
+    '''Every test gets its own cache directory (probe cache, indexes, calibration)'''
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    monkeypatch.setenv('LOCALAPPDATA', str(tmp_path / 'cache'))
+    return tmp_path / 'cache'
+
+
+def make_video(path, duration=20, rate=25, gop=50, extra=()):
+    '''h264/aac test video with a keyframe every "gop" frames'''
+    subprocess.run([
+        'ffmpeg', '-loglevel', 'error', '-y'
+        , '-f', 'lavfi', '-i', 'testsrc2=size=320x240:rate={}:duration={}'.format(rate, duration)
+        , '-f', 'lavfi', '-i', 'sine=duration={}'.format(duration)
+        , '-c:v', 'libx264', '-g', str(gop), '-keyint_min', str(gop), '-sc_threshold', '0'
+        , '-c:a', 'aac', '-shortest'
+        ] + list(extra) + [str(path)], check=True)
+    return str(path)
+
+
+def count_frames(path):
+    out = subprocess.run(['ffprobe', '-v', 'error', '-count_frames', '-select_streams', 'v:0', '-show_entries', 'stream=nb_read_frames', '-of', 'csv=p=0', str(path)]
+                         , check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+    return int(out.strip())
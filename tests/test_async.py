@@ -0,0 +1,89 @@
+import asyncio
+import os
+import time
+
+from conftest import make_video, requires_ffmpeg
+from ffeasytool import AsyncVideoTool, Command
+
+
+@requires_ffmpeg
+def test_plan_probes_do_not_block_loop(tmp_path):
+    infile = make_video(tmp_path / 'in.mp4', duration=2)
+    tool = AsyncVideoTool()
+    vt = tool.videotool
+    runffprobe = vt._run_ffprobe
+
+    def slow_ffprobe(cmd):
+        time.sleep(1.0)
+        return runffprobe(cmd)
+    vt._run_ffprobe = slow_ffprobe
+
+    def plan():
+        # a file not probed by AsyncVideoTool.run: VideoTool.probe in the plan
+        return vt.probe(infile).duration
+        yield
+
+    async def main():
+        gaps = []
+
+        async def ticker():
+            last = time.monotonic()
+            while True:
+                await asyncio.sleep(0.05)
+                gaps.append(time.monotonic() - last)
+                last = time.monotonic()
+
+        task = asyncio.ensure_future(ticker())
+        duration = await tool._drive(plan())
+        task.cancel()
+        return duration, max(gaps)
+
+    duration, maxgap = asyncio.run(main())
+    assert round(duration) == 2
+    assert maxgap < 0.5
+
+
+def test_cancel_during_plan_step_cleans_up(tmp_path):
+    tool = AsyncVideoTool()
+    tempfile = tmp_path / 'tmp-step.txt'
+
+    def plan():
+        tempfile.write_text('')
+        try:
+            time.sleep(1.0) # a blocking step (ex. a probe) runs when the task is cancelled
+            yield Command(tool.videotool._get_probecmd(str(tmp_path)), capture=True)
+        finally:
+            tempfile.unlink()
+
+    async def main():
+        task = asyncio.ensure_future(tool._drive(plan()))
+        await asyncio.sleep(0.3)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        # cleaned up before the cancellation is raised, not when the plan is collected
+        return tempfile.exists()
+
+    assert not asyncio.run(main())
+
+
+@requires_ffmpeg
+def test_timeout_removes_temporary_files(tmp_path):
+    infile = make_video(tmp_path / 'in.mp4')
+    tool = AsyncVideoTool(timeout=1.5)
+
+    async def main():
+        try:
+            await tool.convert_to_gif(infile, chunks=2, outfile=str(tmp_path / 'out.gif'))
+        except asyncio.TimeoutError:
+            return True
+
+    assert asyncio.run(main())
+    assert sorted(os.listdir(str(tmp_path))) == ['cache', 'in.mp4']
+
+
+def test_operations_are_awaitable():
+    for name in ('avmerge', 'convert_to_x264', 'multi', 'make_thumbnails'):
+        assert asyncio.iscoroutinefunction(getattr(AsyncVideoTool, name))
@@ -0,0 +1,91 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import make_video, requires_ffmpeg
+from ffeasytool import JobScheduler, Manifest, VideoTool
+
+FFEASYTOOL = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'ffeasytool.py')
+
+
+def run(cwd, *args):
+    out = subprocess.run([sys.executable, FFEASYTOOL] + list(args), cwd=str(cwd), check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+    return out.split('SUMMARY:')[-1]
+
+
+@requires_ffmpeg
+@pytest.mark.parametrize('options, outputs', [
+    (['--copy'], ['in.m4a']) # the extension is chosen by the codec
+    , (['--all-tracks'], ['in_1.mp3', 'in_2.mp3']) # the names are made from the track numbers
+    ])
+def test_tomp3_rerun_skips(tmp_path, options, outputs):
+    tmp_path = tmp_path / 'work'
+    tmp_path.mkdir()
+    make_video(tmp_path / 'in.mp4', duration=4, extra=['-map', '0:v', '-map', '1:a', '-map', '1:a'])
+    assert 'ok: 1,' in run(tmp_path, 'tomp3', 'in.mp4', *options)
+    assert sorted(os.listdir(str(tmp_path))) == sorted(['.ffeasytool-manifest.json', 'in.mp4'] + outputs)
+    assert 'skipped: 1,' in run(tmp_path, 'tomp3', 'in.mp4', *options)
+    # one of the outputs is missing: the job runs again
+    os.remove(str(tmp_path / outputs[-1]))
+    assert 'ok: 1,' in run(tmp_path, 'tomp3', 'in.mp4', *options)
+
+
+@requires_ffmpeg
+def test_progress_json_stdout(tmp_path):
+    tmp_path = tmp_path / 'work'
+    tmp_path.mkdir()
+    make_video(tmp_path / 'in.mp4', duration=4)
+    proc = subprocess.run([sys.executable, FFEASYTOOL, '--progress', 'json', 'tomp3', 'in.mp4'], cwd=str(tmp_path), check=True
+                          , stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    events = [json.loads(line) for line in proc.stdout.splitlines()]
+    assert events[0]['event'] == 'start' and events[-1]['event'] == 'end' and events[-1]['returncode'] == 0
+    assert 'SUMMARY:' in proc.stderr
+
+
+@requires_ffmpeg
+def test_manifest(tmp_path):
+    # not h264: to264 would skip it
+    infile = make_video(tmp_path / 'in.mp4', duration=2, extra=['-c:v', 'mpeg4'])
+    outfile = str(tmp_path / 'out.mp4')
+    tool = VideoTool()
+
+    def run_job(**options):
+        return JobScheduler(tool, jobs=1, **options).run_job('in.mp4', tool.convert_to_x264, (), {'infile': infile, 'outfile': outfile})[1]
+
+    assert run_job() == 'ok'
+    assert run_job() == 'skipped'
+    # another encoder setting of the tool: the output is made again
+    tool.preset = 'veryfast'
+    assert run_job() == 'ok'
+    assert json.load(open(str(tmp_path / Manifest.NAME)))['out.mp4']['params']['preset'] == 'veryfast'
+    # the content hash of the input is stored with --hash
+    assert run_job(force=True, usehash=True) == 'ok'
+    # the input is touched, its content is the same
+    mtime = os.stat(infile).st_mtime_ns
+    os.utime(infile, ns=(mtime + 10 ** 9, mtime + 10 ** 9))
+    manifest = Manifest(str(tmp_path))
+    params = JobScheduler(tool)._get_params(tool.convert_to_x264, {'infile': infile, 'outfile': outfile})
+    assert manifest.is_uptodate(infile, outfile, params, usehash=True)
+    assert not manifest.is_uptodate(infile, outfile, params)
+    # the check itself changes nothing, the job stores the new mtime
+    assert Manifest(str(tmp_path)).entries['out.mp4']['mtime'] == mtime
+    assert run_job(usehash=True) == 'skipped'
+    assert Manifest(str(tmp_path)).entries['out.mp4']['mtime'] == mtime + 10 ** 9
+    assert run_job() == 'skipped'
+
+
+@requires_ffmpeg
+def test_multi_rerun(tmp_path):
+    tmp_path = tmp_path / 'work'
+    tmp_path.mkdir()
+    make_video(tmp_path / 'in.mp4', duration=2, extra=['-c:v', 'mpeg4'])
+    make_video(tmp_path / 'h264.mp4', duration=2)
+    options = ['multi', '--to', 'to264', '--to', 'towebm', '--to', 'tomp3']
+    assert 'ok: 2,' in run(tmp_path, *(options + ['in.mp4', 'h264.mp4']))
+    # the input is not overwritten, an h264 input gets no mp4
+    assert sorted(os.listdir(str(tmp_path))) == ['.ffeasytool-manifest.json', 'h264.mp3', 'h264.mp4', 'h264.webm', 'in.mp3', 'in.mp4', 'in.webm', 'in_2.mp4']
+    assert 'skipped: 2,' in run(tmp_path, *(options + ['in.mp4', 'h264.mp4']))
+    assert 'ok: 2,' in run(tmp_path, *(options + ['--force', 'in.mp4', 'h264.mp4']))
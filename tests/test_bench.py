@@ -0,0 +1,31 @@
+import subprocess
+
+from conftest import requires_ffmpeg
+from ffeasytool import Benchmark, VideoTool
+
+
+def get_codec(path):
+    return subprocess.run(['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-show_entries', 'stream=codec_name', '-of', 'csv=p=0', str(path)]
+                          , check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout.strip()
+
+
+@requires_ffmpeg
+def test_bench_smoke(monkeypatch):
+    # an input of the merge output size: joined by copy unless the merge re-encodes
+    monkeypatch.setattr(Benchmark, 'QUICKINPUTS', [((640, 360), 2)])
+    codecs = []
+    avmerge = VideoTool.avmerge
+
+    def merge(self, *args, **kwargs):
+        result = avmerge(self, *args, **kwargs)
+        codecs.append(get_codec(kwargs['outfile']))
+        return result
+    monkeypatch.setattr(VideoTool, 'avmerge', merge)
+    report = Benchmark(VideoTool(), commands=['tomp3', 'merge'], repeats=2, quick=True).run()
+    assert [(r['command'], r['input'], len(r['runs'])) for r in report['results']] == [
+        ('tomp3', '640x360@30 2s', 2), ('merge', '640x360@30 2s', 2)]
+    # the mpeg4 input is encoded to h264 like every other input size
+    assert codecs == ['h264', 'h264']
+    for result in report['results']:
+        assert result['median_wall'] > 0 and all(run['ffmpeg_calls'] == 1 for run in result['runs'])
+    assert not Benchmark.compare(report, report)
@@ -0,0 +1,32 @@
+import os
+
+import pytest
+
+from conftest import count_frames, make_video, requires_ffmpeg
+from ffeasytool import VideoTool
+
+
+@requires_ffmpeg
+@pytest.mark.parametrize('chunks', [2, 3])
+def test_chunked_to264_frames(tmp_path, chunks):
+    # not h264: to264 would skip it
+    infile = make_video(tmp_path / 'in.mp4', duration=10, extra=['-c:v', 'mpeg4'])
+    outfile = str(tmp_path / 'out.mp4')
+    tool = VideoTool()
+    plan = tool.get_plan(VideoTool.convert_to_x264, infile, chunks=chunks, outfile=outfile)
+    assert len([command for command in plan.commands if '-c:v' in command.cmd and 'libx264' in command.cmd]) == chunks
+    assert tool.convert_to_x264(infile, chunks=chunks, outfile=outfile).ok
+    # parts are joined without missing or repeated frames, audio is kept whole
+    assert count_frames(outfile) == 250
+    info = VideoTool().probe(outfile)
+    assert info.videocodec == 'h264' and abs(info.duration - 10) < 0.1
+    assert sorted(os.listdir(str(tmp_path))) == ['cache', 'in.mp4', 'out.mp4']
+
+
+@requires_ffmpeg
+def test_chunked_compress_frames(tmp_path):
+    infile = make_video(tmp_path / 'in.mp4', duration=10)
+    outfile = str(tmp_path / 'out.mp4')
+    assert VideoTool().compress_single_video(infile, '700K', chunks=2, outfile=outfile).ok
+    assert count_frames(outfile) == 250
+    assert os.path.getsize(outfile) <= 700 * 1024
@@ -0,0 +1,39 @@
+import os
+
+from conftest import make_video, requires_ffmpeg
+from ffeasytool import VideoTool
+
+
+@requires_ffmpeg
+def test_predict_retry_learns_overhead_from_final_file(tmp_path, monkeypatch):
+    infile = make_video(tmp_path / 'in.mp4')
+    outfile = str(tmp_path / 'out.mp4')
+    tool = VideoTool()
+    # a wrong prediction: the first file is too big and is encoded again
+    def predict_crf(infile, videobitrates):
+        return [10.0] * len(videobitrates), -0.1
+        yield
+    monkeypatch.setattr(tool, '_predict_crf', predict_crf)
+    assert tool.compress_single_video(infile, '700K', mode='predict', outfile=outfile).ok
+    info = VideoTool().probe(outfile)
+    streamsbytes = sum(float(s['bit_rate']) * float(s['duration']) / 8 for s in info.streams)
+    overhead = max(0.0, (os.path.getsize(outfile) - streamsbytes) / info.duration)
+    assert abs(tool.calibration.get('overhead', 'mp4') - overhead) < 0.01
+
+
+@requires_ffmpeg
+def test_multiple_targets_share_first_pass(tmp_path):
+    infile = make_video(tmp_path / 'in.mp4')
+    outfiles = [str(tmp_path / 'out{}.mp4'.format(n)) for n in range(3)]
+    tool = VideoTool()
+    # low audio bitrate: the sizes are mostly video
+    plan = tool.get_plan(VideoTool.compress_single_video, infile, '300K,500K,800K', audiobitrate=32, jobs=2, outfile=outfiles)
+    passes = [command.cmd[command.cmd.index('-pass') + 1] for command in plan.commands if '-pass' in command.cmd]
+    assert passes == ['1', '2', '2', '2']
+    result = tool.compress_single_video(infile, '300K,500K,800K', audiobitrate=32, jobs=2, outfile=outfiles)
+    assert result.ok and result.outputs == outfiles
+    sizes = [os.path.getsize(outfile) for outfile in outfiles]
+    # every output fits its target and uses most of it
+    for size, target in zip(sizes, [300, 500, 800]):
+        assert 0.6 * target * 1024 < size <= target * 1024
+    assert sorted(os.listdir(str(tmp_path))) == ['cache', 'in.mp4', 'out0.mp4', 'out1.mp4', 'out2.mp4']
@@ -0,0 +1,44 @@
+import subprocess
+
+import pytest
+
+from conftest import count_frames, make_video, requires_ffmpeg
+from ffeasytool import VideoTool
+
+
+def framemd5(path):
+    out = subprocess.run(['ffmpeg', '-v', 'error', '-i', str(path), '-map', '0:v:0', '-fps_mode', 'passthrough', '-f', 'framemd5', '-']
+                         , check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+    return [line.split(',')[-1].strip() for line in out.splitlines() if not line.startswith('#')]
+
+
+@requires_ffmpeg
+@pytest.mark.parametrize('start, end, frames', [
+    ('3.3', '13.7', 260) # head, copied GOPs, tail
+    , ('4', '10', 150) # starts and ends at keyframes
+    , ('1.96', '8.04', 152) # one re-encoded frame before the first keyframe and after the last one
+    ])
+def test_smart_cut_frames(tmp_path, start, end, frames):
+    infile = make_video(tmp_path / 'in.mp4')
+    outfile = str(tmp_path / 'cut.mp4')
+    result = VideoTool().cut_single_video(infile, startpoint=start, endpoint=end, smart=True, outfile=outfile)
+    assert result.ok
+    assert count_frames(outfile) == frames
+    # joins decode without repeated timestamps
+    log = subprocess.run(['ffmpeg', '-v', 'warning', '-i', outfile, '-f', 'null', '-'], stderr=subprocess.PIPE, universal_newlines=True).stderr
+    assert 'non monotonically increasing dts' not in log
+    # the copied GOPs are the original frames at their places
+    first = round(float(start) * 25 + 0.4999)
+    original = framemd5(infile)[first:first + frames]
+    cut = framemd5(outfile)
+    copied = [n for n, md5 in enumerate(cut) if md5 == original[n]]
+    assert copied and copied == list(range(copied[0], copied[-1] + 1))
+
+
+@requires_ffmpeg
+def test_snap_cut_frames(tmp_path):
+    infile = make_video(tmp_path / 'in.mp4')
+    outfile = str(tmp_path / 'cut.mp4')
+    assert VideoTool().cut_single_video(infile, startpoint='3.3', endpoint='13.7', snap=True, outfile=outfile).ok
+    # keyframes every 2 seconds: 2.0 - 14.0, copied without re-encoding
+    assert framemd5(outfile) == framemd5(infile)[50:350]
@@ -0,0 +1,74 @@
+import filecmp
+import logging
+import os
+import re
+import subprocess
+
+from conftest import count_frames, make_video, requires_ffmpeg
+from ffeasytool import VideoTool
+
+
+@requires_ffmpeg
+def test_multi_gif_palette_in_graph(tmp_path, cachedir):
+    infile = make_video(tmp_path / 'in.mp4', duration=4)
+    outfiles = [str(tmp_path / 'out.gif'), str(tmp_path / 'out.mp3')]
+    tool = VideoTool()
+    # the input is decoded by one process only: palettegen is fed from its graph
+    plan = tool.get_plan(VideoTool.multi, infile, ['togif:x=10,w=160', 'tomp3'], outfiles=outfiles)
+    assert [command.cmd.count(infile) for command in plan.commands] == [1, 0]
+    assert 'palettegen' in ' '.join(plan.commands[0].cmd) and 'paletteuse' in ' '.join(plan.commands[1].cmd)
+    assert tool.multi(infile, ['togif:x=10,w=160', 'tomp3'], outfiles=outfiles).outputs == outfiles
+    assert count_frames(outfiles[0]) == 40
+    assert len(os.listdir(str(cachedir / 'ffeasytool' / 'palettes'))) == 1
+    assert sorted(os.listdir(str(tmp_path))) == ['cache', 'in.mp4', 'out.gif', 'out.mp3']
+    # the same palette as convert_to_gif: it is not made again, the gifs are the same
+    plan = tool.get_plan(VideoTool.convert_to_gif, infile, fps=10, width=160, outfile=str(tmp_path / 'single.gif'))
+    assert len(plan.commands) == 1 and 'palettegen' not in ' '.join(plan.commands[0].cmd)
+    assert tool.convert_to_gif(infile, fps=10, width=160, outfile=str(tmp_path / 'single.gif')).ok
+    assert filecmp.cmp(outfiles[0], str(tmp_path / 'single.gif'), shallow=False)
+    # the cached palette is used in the graph of multi too
+    plan = tool.get_plan(VideoTool.multi, infile, ['togif:x=10,w=160'], outfiles=[str(tmp_path / 'again.gif')])
+    assert len(plan.commands) == 1 and 'palettegen' not in ' '.join(plan.commands[0].cmd)
+
+
+def framemd5(path):
+    '''md5 of every decoded frame'''
+    out = subprocess.run(['ffmpeg', '-v', 'error', '-i', str(path), '-f', 'framemd5', '-'], check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+    return [line.split(',')[-1].strip() for line in out.splitlines() if not line.startswith('#')]
+
+
+@requires_ffmpeg
+def test_chunked_gif(tmp_path, cachedir):
+    infile = make_video(tmp_path / 'in.mp4', duration=6)
+    tool = VideoTool()
+    assert tool.convert_to_gif(infile, fps=10, width=160, outfile=str(tmp_path / 'single.gif')).ok
+    assert tool.convert_to_gif(infile, fps=10, width=160, chunks=3, outfile=str(tmp_path / 'chunked.gif')).ok
+    # parts use the same palette: joined without re-encoding, they are the frames of one encode
+    assert count_frames(tmp_path / 'chunked.gif') == 60
+    assert framemd5(tmp_path / 'chunked.gif') == framemd5(tmp_path / 'single.gif')
+    assert sorted(os.listdir(str(tmp_path))) == ['cache', 'chunked.gif', 'in.mp4', 'single.gif']
+
+
+@requires_ffmpeg
+def test_gif_target_size(tmp_path, caplog):
+    caplog.set_level(logging.INFO, logger='ffeasytool')
+    infile = make_video(tmp_path / 'in.mp4', duration=6)
+    outfile = str(tmp_path / 'out.gif')
+    assert VideoTool().convert_to_gif(infile, fps=15, width=320, targetsize='300K', outfile=outfile).ok
+    assert os.path.getsize(outfile) <= 300 * 1024
+    # the chosen settings are logged: all frames at the chosen fps
+    fps = float(re.search(r'target: \d+ Kb\), ([\d.]+) fps', caplog.text).group(1))
+    assert fps <= 15 and count_frames(outfile) == round(6 * fps)
+
+
+@requires_ffmpeg
+def test_palette_cache_limit(tmp_path, cachedir, monkeypatch):
+    infile = make_video(tmp_path / 'in.mp4', duration=2)
+    tool = VideoTool()
+    assert tool.convert_to_gif(infile, fps=5, width=80, outfile=str(tmp_path / 'a.gif')).ok
+    palettedir = cachedir / 'ffeasytool' / 'palettes'
+    first = os.listdir(str(palettedir))
+    # room for one palette: the least recently used one is removed, the new one is kept
+    monkeypatch.setitem(VideoTool.CACHELIMITS, 'palettes', os.path.getsize(str(palettedir / first[0])))
+    assert tool.convert_to_gif(infile, fps=5, width=96, outfile=str(tmp_path / 'b.gif')).ok
+    assert len(os.listdir(str(palettedir))) == 1 and os.listdir(str(palettedir)) != first
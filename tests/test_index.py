@@ -0,0 +1,31 @@
+import os
+
+from conftest import make_video, requires_ffmpeg
+from ffeasytool import MediaIndex, VideoTool
+
+
+def open_files():
+    '''Files open by this process (Linux), empty elsewhere'''
+    if not os.path.isdir('/proc/self/fd'):
+        return set()
+    return {os.path.realpath(os.path.join('/proc/self/fd', fd)) for fd in os.listdir('/proc/self/fd')}
+
+
+@requires_ffmpeg
+def test_index_rebuilt_while_loaded(tmp_path):
+    infile = make_video(tmp_path / 'in.mp4', duration=4, gop=25)
+    tool = VideoTool()
+    index = tool._drive(tool._get_index(infile))
+    assert list(index.keytimes) == [0.0, 1.0, 2.0, 3.0]
+    assert len(index.packettimes) == 100 and index.packetbytes[-1] > 0
+    indexpath = tool._get_indexpath(infile)
+    loaded = MediaIndex.load(indexpath, size=index.size, mtime=index.mtime)
+    assert list(loaded.keytimes) == list(index.keytimes) and list(loaded.packetbytes) == list(index.packetbytes)
+    # the index file is not kept open (or mapped): a changed media file gets a new index over it
+    assert os.path.realpath(indexpath) not in open_files()
+    make_video(tmp_path / 'in.mp4', duration=2, gop=25)
+    tool = VideoTool()
+    index = tool._drive(tool._get_index(infile))
+    assert list(index.keytimes) == [0.0, 1.0]
+    assert list(loaded.keytimes) == [0.0, 1.0, 2.0, 3.0]
+    assert MediaIndex.load(indexpath, size=loaded.size, mtime=loaded.mtime) is None
@@ -0,0 +1,38 @@
+import logging
+import sys
+
+import pytest
+
+from conftest import make_video, requires_ffmpeg
+from ffeasytool import VideoTool
+
+
+@requires_ffmpeg
+def test_existing_output_is_not_asked(tmp_path, monkeypatch):
+    infile = make_video(tmp_path / 'in.mp4', duration=2)
+    outfile = str(tmp_path / 'out.mp3')
+    tool = VideoTool()
+    assert tool.convert_to_mp3(infile, outfile=outfile).ok
+    # a library never reads the terminal
+    monkeypatch.setattr(sys.stdin, 'isatty', lambda: True, raising=False)
+    monkeypatch.setattr('builtins.input', lambda prompt='': pytest.fail('input() called'))
+    with pytest.raises(FileExistsError):
+        tool.convert_to_mp3(infile, outfile=outfile)
+    asked = []
+    tool.confirm_overwrite = lambda path: asked.append(path) or True
+    assert tool.convert_to_mp3(infile, outfile=outfile).ok
+    assert asked == [outfile]
+
+
+@requires_ffmpeg
+def test_messages_are_logged(tmp_path, capsys, caplog):
+    infile = make_video(tmp_path / 'in.mp4', duration=2)
+    tool = VideoTool()
+    caplog.set_level(logging.INFO, logger='ffeasytool')
+    assert tool.convert_to_x264(infile, outfile=str(tmp_path / 'out.mp4')).status == 'skipped'
+    assert 'already h264' in caplog.text
+    # a dry run has no status messages
+    caplog.clear()
+    estimate = tool.get_plan(VideoTool.compress_single_video, infile, '300K', outfile=str(tmp_path / 'small.mp4'))
+    assert estimate.commands and caplog.text == ''
+    assert capsys.readouterr().out == ''
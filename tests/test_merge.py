@@ -0,0 +1,52 @@
+import logging
+import os
+
+import pytest
+
+from conftest import count_frames, make_video, requires_ffmpeg
+from ffeasytool import VideoTool
+
+
+@requires_ffmpeg
+def test_normalize_cache_reuse_and_limit(tmp_path, cachedir, caplog, monkeypatch):
+    files = [make_video(tmp_path / 'in{}.mp4'.format(n), duration=2, rate=rate) for n, rate in enumerate((25, 30, 24))]
+    tool = VideoTool()
+    caplog.set_level(logging.INFO, logger='ffeasytool')
+    outfile = str(tmp_path / 'merged.mp4')
+    assert tool.avmerge(files[:2], 320, 240, 25, normalize=True, outfile=outfile).ok
+    assert 'Normalizing 2 of 2 files (0 cached)' in caplog.text
+    assert count_frames(outfile) == 100
+    normalized = cachedir / 'ffeasytool' / 'normalized'
+    assert len(os.listdir(str(normalized))) == 2
+
+    # a changed list: only the new clip is encoded
+    caplog.clear()
+    os.remove(outfile)
+    assert tool.avmerge(files, 320, 240, 25, normalize=True, outfile=outfile).ok
+    assert 'Normalizing 1 of 3 files (2 cached)' in caplog.text
+    assert count_frames(outfile) == 150
+
+    # above the limit the clips not used by this merge are removed
+    monkeypatch.setitem(VideoTool.CACHELIMITS, 'normalized', 1)
+    os.remove(outfile)
+    assert tool.avmerge(files[1:], 320, 240, 25, normalize=True, outfile=outfile).ok
+    assert len(os.listdir(str(normalized))) == 2
+    assert count_frames(outfile) == 100
+
+
+@requires_ffmpeg
+@pytest.mark.parametrize('options, copied', [
+    ([], True) # the same encoder settings
+    , (['-profile:v', 'main'], False)
+    , (['-pix_fmt', 'yuvj420p'], False) # full range, the same profile
+    , (['-x264-params', 'ref=1'], False) # another SPS (extradata) with the same profile and level
+    , (['-video_track_timescale', '90000'], False) # another time base
+    ])
+def test_concat_fast_path(tmp_path, caplog, options, copied):
+    files = [make_video(tmp_path / 'a.mp4', duration=2), make_video(tmp_path / 'b.mp4', duration=2, extra=options)]
+    caplog.set_level(logging.INFO, logger='ffeasytool')
+    outfile = str(tmp_path / 'merged.mp4')
+    assert VideoTool().avmerge(files, 320, 240, 25, outfile=outfile).ok
+    assert ('joining without re-encoding' in caplog.text) == copied
+    # a file of the joined inputs, -r of the re-encode path can add the last frame once more
+    assert count_frames(outfile) == 100 if copied else 100 <= count_frames(outfile) <= 101
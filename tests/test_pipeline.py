@@ -0,0 +1,46 @@
+import subprocess
+
+import pytest
+
+from conftest import count_frames, make_video, requires_ffmpeg
+from ffeasytool import InvalidArgumentError, VideoTool
+
+
+def get_stream(path, kind):
+    out = subprocess.run(['ffprobe', '-v', 'error', '-select_streams', kind, '-show_entries', 'stream=codec_name,width,height', '-of', 'csv=p=0', str(path)]
+                         , check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+    return out.strip()
+
+
+def get_duration(path):
+    out = subprocess.run(['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'csv=p=0', str(path)]
+                         , check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+    return float(out)
+
+
+@requires_ffmpeg
+def test_pipeline_chain(tmp_path):
+    infile = make_video(tmp_path / 'in.mp4', duration=10)
+    outfile = str(tmp_path / 'out.webm')
+    # the second cut is counted from the start of the first one: 3..5 sec of the input
+    steps = ['cut:a=2,b=8', 'cut:a=1,b=3', 'resize:m=0.5', ('resize', {'m': 0.5}), 'towebm']
+    tool = VideoTool()
+    plan = tool.get_plan(VideoTool.pipeline, infile, steps, outfile=outfile)
+    assert [command.cmd.count('-i') for command in plan.commands] == [1]
+    # one scale filter to the final size
+    assert plan.commands[0].cmd[plan.commands[0].cmd.index('-vf') + 1] == 'scale=80:60,setsar=1:1'
+    assert tool.pipeline(infile, steps, outfile=outfile).outputs == [outfile]
+    assert get_stream(outfile, 'v:0') == 'vp9,80,60'
+    assert count_frames(outfile) == 50
+
+
+@requires_ffmpeg
+def test_pipeline_audio_and_order(tmp_path):
+    infile = make_video(tmp_path / 'in.mp4', duration=10)
+    outfile = str(tmp_path / 'out.mp3')
+    tool = VideoTool()
+    tool.pipeline(infile, ['cut:a=4', 'cut:b=3', 'tomp3'], outfile=outfile)
+    assert get_stream(outfile, 'a:0') == 'mp3' and abs(get_duration(outfile) - 3) < 0.1
+    # an output step in the middle of the chain
+    with pytest.raises(InvalidArgumentError):
+        tool.pipeline(infile, ['towebm', 'cut:a=1'], outfile=outfile)
@@ -0,0 +1,47 @@
+import os
+import tempfile
+
+import pytest
+
+from conftest import make_video, requires_ffmpeg
+from ffeasytool import VideoTool
+
+
+@requires_ffmpeg
+@pytest.mark.parametrize('method, kwargs', [
+    (VideoTool.avmerge, {'files': ['in.mp4', 'in2.mp4'], 'outfile': 'merged.mp4'}) # concat list
+    , (VideoTool.cut_single_video, {'infile': 'in.mp4', 'startpoint': '3.3', 'endpoint': '13.7', 'smart': True, 'outfile': 'cut.mp4'}) # parts and concat list
+    , (VideoTool.convert_to_gif, {'infile': 'in.mp4', 'chunks': 2, 'outfile': 'out.gif'})
+    , (VideoTool.compress_single_video, {'infile': 'in.mp4', 'targetsize': '1M', 'chunks': 2, 'outfile': 'out.mp4'})
+    ])
+def test_plan_writes_nothing(tmp_path, monkeypatch, method, kwargs):
+    workdir = tmp_path / 'work'
+    workdir.mkdir()
+    monkeypatch.chdir(str(workdir))
+    make_video(workdir / 'in.mp4')
+    make_video(workdir / 'in2.mp4')
+    created = []
+    for name in ('mkstemp', 'mkdtemp'):
+        monkeypatch.setattr(tempfile, name, lambda *args, **kwargs: created.append(kwargs.get('prefix')))
+    estimate = VideoTool().get_plan(method, **kwargs)
+    assert estimate.status in ('planned', 'partial') and estimate.commands
+    # no temporary files or directories, even removed ones
+    assert created == []
+    assert sorted(os.listdir(str(workdir))) == ['in.mp4', 'in2.mp4']
+
+
+@requires_ffmpeg
+def test_plan_leaves_tool_unchanged(tmp_path):
+    infile = make_video(tmp_path / 'in.mp4')
+    tool = VideoTool()
+    tool.replaceable.add(str(tmp_path / 'old.mp4'))
+    estimate = tool.get_plan(VideoTool.cut_single_video, infile, startpoint='3.3', endpoint='13.7', smart=True, outfile=str(tmp_path / 'cut.mp4'))
+    assert estimate.status in ('planned', 'partial')
+    # probe results, indexes, outputs and stats of the planner are its own
+    assert tool._mediainfo == {} and tool._indexes == {}
+    assert tool.replaceable == {str(tmp_path / 'old.mp4')}
+    assert tool.stats['ffprobe_calls'] == 0 and not tool.dryrun
+    # temporary names are shown as templates
+    names = [os.path.basename(arg) for command in estimate.commands for arg in command.cmd if arg.startswith(str(tmp_path))]
+    assert 'tmp-concat-XXXXXXXX.txt' in names
+    assert not any('dryrun' in arg for command in estimate.commands for arg in command.cmd)
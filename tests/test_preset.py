@@ -0,0 +1,60 @@
+import pytest
+
+from conftest import make_video, requires_ffmpeg
+from ffeasytool import VideoTool
+
+# measured sample encodes: speed falls and quality grows with slower presets
+MEASURED = [
+    {'preset': 'ultrafast', 'speed': 12.0, 'ssim': 0.950, 'psnr': 38.0}
+    , {'preset': 'superfast', 'speed': 8.0, 'ssim': 0.965, 'psnr': 39.5}
+    , {'preset': 'veryfast', 'speed': 5.0, 'ssim': 0.975, 'psnr': 40.5}
+    , {'preset': 'faster', 'speed': 3.0, 'ssim': 0.981, 'psnr': 41.2}
+    , {'preset': 'fast', 'speed': 2.2, 'ssim': 0.984, 'psnr': 41.8}
+    , {'preset': 'medium', 'speed': 1.6, 'ssim': 0.986, 'psnr': 42.3}
+    , {'preset': 'slow', 'speed': 0.9, 'ssim': 0.988, 'psnr': 42.9}
+    , {'preset': 'slower', 'speed': 0.4, 'ssim': 0.989, 'psnr': 43.2}
+    ]
+
+
+@pytest.fixture
+def measured(monkeypatch):
+    '''Replaces sample encodes with MEASURED, returns the list of measurements made'''
+    calls = []
+
+    def measure_presets(self, infile, quality, name, target, samplelength=5):
+        calls.append((name, target))
+        return MEASURED
+        yield
+    monkeypatch.setattr(VideoTool, '_measure_presets', measure_presets)
+    return calls
+
+
+@requires_ffmpeg
+@pytest.mark.parametrize('autopreset, preset', [
+    (('speed', 2.0), 'fast') # the slowest preset fast enough
+    , (('speed', 1.0), 'medium')
+    , (('speed', 20.0), 'ultrafast') # nothing is fast enough: the fastest one
+    , (('ssim', 0.98), 'faster') # the fastest preset good enough
+    , (('psnr', 42.0), 'medium')
+    , (('ssim', 0.999), 'slower') # nothing is good enough: the best one
+    ])
+def test_preset_choice(tmp_path, measured, autopreset, preset):
+    infile = make_video(tmp_path / 'in.mp4', duration=1)
+    tool = VideoTool()
+    tool.autopreset = autopreset
+    assert tool._drive(tool._get_preset(infile, 22)) == preset
+    # the choice is cached for the host and resolution class
+    tool = VideoTool()
+    tool.autopreset = autopreset
+    assert tool._drive(tool._get_preset(infile, 22)) == preset
+    assert measured == [autopreset]
+
+
+@requires_ffmpeg
+def test_measure_presets(tmp_path):
+    infile = make_video(tmp_path / 'in.mp4', duration=2)
+    tool = VideoTool()
+    # any quality is enough: only the fastest preset is encoded
+    results = tool._drive(tool._measure_presets(infile, 22, 'ssim', 0.0, samplelength=1))
+    assert [r['preset'] for r in results] == ['ultrafast']
+    assert results[0]['speed'] > 0 and 0.9 < results[0]['ssim'] <= 1.0 and results[0]['psnr'] > 30
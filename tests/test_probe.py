@@ -0,0 +1,17 @@
+import os
+
+from conftest import make_video, requires_ffmpeg
+from ffeasytool import VideoTool
+
+
+@requires_ffmpeg
+def test_probe_replaced_file(tmp_path):
+    tool = VideoTool()
+    infile = make_video(tmp_path / 'in.mp4')
+    info = tool.probe(infile)
+    assert round(info.duration) == 20 and info.video[0]['codec_name'] == 'h264'
+    # same tool, same path, another file
+    make_video(tmp_path / 'new.mp4', duration=12, extra=['-c:v', 'mpeg4'])
+    os.replace(str(tmp_path / 'new.mp4'), infile)
+    info = tool.probe(infile)
+    assert round(info.duration) == 12 and info.video[0]['codec_name'] == 'mpeg4'
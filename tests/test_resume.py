@@ -0,0 +1,16 @@
+import pytest
+
+from conftest import count_frames, make_video, requires_ffmpeg
+from ffeasytool import VideoTool
+
+
+@requires_ffmpeg
+@pytest.mark.parametrize('name', [
+    'in.mp4'
+    , 'in.mkv' # starts at -0.023 (aac priming)
+    ])
+def test_resumable_webm_frames(tmp_path, name):
+    infile = make_video(tmp_path / name, duration=8)
+    outfile = str(tmp_path / 'out.webm')
+    assert VideoTool().convert_to_webm(infile, quality=40, resume=True, segmentlength=2, outfile=outfile).ok
+    assert count_frames(outfile) == 200
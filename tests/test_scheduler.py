@@ -0,0 +1,62 @@
+import threading
+import time
+
+import pytest
+
+import ffeasytool
+from conftest import make_video, requires_ffmpeg
+from ffeasytool import FFmpegError, JobScheduler, Result, VideoTool
+
+
+@pytest.fixture
+def cpus(monkeypatch):
+    monkeypatch.setattr(ffeasytool, 'get_cpucount', lambda: 8)
+    return 8
+
+
+def test_jobs_and_threads(cpus):
+    tool = VideoTool()
+    # auto: cores one process of the kind can keep busy
+    assert JobScheduler(tool, kind='x264').jobs == 2
+    assert JobScheduler(tool, kind='mp3').jobs == 8
+    assert JobScheduler(tool, jobs=3).jobs == 3
+
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def job(name, fail=False):
+        with lock:
+            running.append(name)
+            peak.append(len(running))
+        # threads of every ffmpeg process: the cores are split between the jobs
+        assert tool.threads == 2 and tool.quiet
+        time.sleep(0.5)
+        with lock:
+            running.remove(name)
+        if fail:
+            raise FFmpegError(1, ['ffmpeg'])
+        return Result('job', 'ok')
+
+    scheduler = JobScheduler(tool, jobs=4)
+    for n in range(4):
+        scheduler.add('file{}'.format(n), job, 'file{}'.format(n), fail=n == 2)
+    started = time.monotonic()
+    results = scheduler.run()
+    assert time.monotonic() - started < 1.5
+    assert max(peak) == 4
+    # results in the order of the jobs, a failed one does not stop the others
+    assert [(name, status, message) for name, status, message, seconds in results] == [
+        ('file0', 'ok', ''), ('file1', 'ok', ''), ('file2', 'failed', 'ffmpeg exit code 1'), ('file3', 'ok', '')]
+    assert not scheduler.print_summary()
+
+
+@requires_ffmpeg
+def test_parallel_conversions(tmp_path):
+    files = [make_video(tmp_path / 'in{}.mp4'.format(n), duration=2) for n in range(3)]
+    tool = VideoTool()
+    scheduler = JobScheduler(tool, jobs=3, kind='mp3')
+    for infile in files:
+        scheduler.add(infile, tool.convert_to_mp3, infile=infile, outfile=infile[:-1] + '3')
+    assert [status for name, status, message, seconds in scheduler.run()] == ['ok'] * 3
+    assert tool.stats['ffmpeg_calls'] == 3 and tool.threads >= 1
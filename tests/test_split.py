@@ -0,0 +1,32 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import count_frames, make_video, requires_ffmpeg
+
+FFEASYTOOL = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'ffeasytool.py')
+
+
+def keyframe_flags(path):
+    '''Key flag of every video packet'''
+    out = subprocess.run(['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-show_entries', 'packet=flags', '-of', 'csv=p=0', str(path)]
+                         , check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+    return [line.startswith('K') for line in out.split()]
+
+
+@requires_ffmpeg
+@pytest.mark.parametrize('options, frames', [
+    (['-c', '4'], [50, 50, 50, 50]) # equal parts at the exact frames
+    , (['-t', '3', '--copy'], [100, 50, 50]) # a keyframe every 2 sec: parts start at 4 and 6 sec
+    ])
+def test_split(tmp_path, options, frames):
+    tmp_path = tmp_path / 'work'
+    tmp_path.mkdir()
+    make_video(tmp_path / 'in.mp4', duration=8, gop=50)
+    subprocess.run([sys.executable, FFEASYTOOL, 'split'] + options + ['in.mp4'], cwd=str(tmp_path), check=True, stdout=subprocess.PIPE)
+    parts = ['in.split_{:03d}.mp4'.format(n) for n in range(len(frames))]
+    assert sorted(os.listdir(str(tmp_path))) == ['in.mp4'] + parts
+    assert [count_frames(tmp_path / part) for part in parts] == frames
+    assert all(keyframe_flags(tmp_path / part)[0] for part in parts)
@@ -0,0 +1,38 @@
+import logging
+import os
+import subprocess
+
+import pytest
+
+from conftest import make_video, requires_ffmpeg
+from ffeasytool import VideoTool
+
+
+def get_size(path):
+    out = subprocess.run(['ffprobe', '-v', 'error', '-show_entries', 'stream=width,height', '-of', 'csv=p=0', str(path)]
+                         , check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+    return tuple(int(value) for value in out.strip().split(','))
+
+
+@requires_ffmpeg
+@pytest.mark.parametrize('gop, keyframesonly', [
+    (25, True) # a keyframe every second: only keyframes are decoded
+    , (1000, False) # one keyframe: frames at the exact times
+    ])
+def test_sprite_thumbnails(tmp_path, caplog, gop, keyframesonly):
+    caplog.set_level(logging.INFO, logger='ffeasytool')
+    infile = make_video(tmp_path / 'in.mp4', duration=6, gop=gop)
+    outfile = str(tmp_path / 'in_thumbs.jpg')
+    tool = VideoTool()
+    plan = tool.get_plan(VideoTool.make_thumbnails, infile, count=6, columns=3, sprite=True, outfile=outfile)
+    grabs = [command.cmd for command in plan.commands if '-frames:v' in command.cmd and infile in command.cmd]
+    assert len(grabs) == 6 and all(('-skip_frame' in cmd) == keyframesonly for cmd in grabs)
+    result = tool.make_thumbnails(infile, count=6, columns=3, sprite=True, outfile=outfile)
+    assert result.outputs == [outfile, str(tmp_path / 'in_thumbs_sprite.jpg'), str(tmp_path / 'in_thumbs_sprite.vtt')]
+    assert ('exact times' in caplog.text) != keyframesonly
+    # 6 thumbnails in 2 rows of 3, 6 cues
+    assert get_size(tmp_path / 'in_thumbs_sprite.jpg') == (3 * 160, 2 * 120)
+    with open(str(tmp_path / 'in_thumbs_sprite.vtt'), encoding='utf-8') as f:
+        cues = [line for line in f.read().splitlines() if '-->' in line]
+    assert len(cues) == 6 and cues[0].startswith('00:00:00.000 -->') and cues[-1].endswith('--> 00:00:06.000')
+    assert sorted(os.listdir(str(tmp_path))) == ['cache', 'in.mp4', 'in_thumbs.jpg', 'in_thumbs_sprite.jpg', 'in_thumbs_sprite.vtt']
@@ -0,0 +1,87 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+import ffeasytool
+from conftest import make_video, requires_ffmpeg
+from ffeasytool import AsyncVideoTool, FolderWatcher, WatchJobs
+
+
+@pytest.fixture(params=['inotify', 'polling'])
+def mode(request, monkeypatch):
+    if request.param == 'polling':
+        def unavailable(directories):
+            raise OSError('disabled by the test')
+        monkeypatch.setattr(ffeasytool, 'Inotify', unavailable)
+    return request.param
+
+
+def watch(watcher, done, timeout=120):
+    '''Runs the watcher until done() is true (checked every 0.1s), then stops it as Ctrl+C does'''
+    async def main():
+        task = asyncio.ensure_future(watcher.run())
+        started = time.monotonic()
+        while not done() and time.monotonic() - started < timeout:
+            await asyncio.sleep(0.1)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+    asyncio.run(main())
+
+
+def make_watcher(tmp_path, **kwargs):
+    return FolderWatcher(AsyncVideoTool(), [str(tmp_path / 'in')], 'tomp3', outdir=str(tmp_path / 'out'), jobs=1
+                         , interval=0.2, stable=0.5, db=str(tmp_path / 'watch.sqlite'), **kwargs)
+
+
+def test_jobs_attempts(tmp_path):
+    table = WatchJobs(str(tmp_path / 'watch.sqlite'), attempts=2)
+    assert table.add('/in/a.mp4', 'tomp3', 10, 1, ['/out/a.mp3'])
+    for attempt in (1, 2):
+        assert table.start('/in/a.mp4', 'tomp3') == attempt
+        table.set_status('/in/a.mp4', 'tomp3', 'failed', 'broken')
+        # a failed job is finished only after the last attempt
+        assert table.get_finished('tomp3') == ({} if attempt < 2 else {'/in/a.mp4': (10, 1)})
+        assert table.add('/in/a.mp4', 'tomp3', 10, 1, ['/out/a.mp3']) == (attempt < 2)
+    # a changed file is done again with new attempts
+    assert table.add('/in/a.mp4', 'tomp3', 20, 2, ['/out/a.mp3'])
+    assert table.start('/in/a.mp4', 'tomp3') == 1
+    # a job interrupted while running is queued again after a restart
+    assert WatchJobs(table.path, attempts=2).get_finished('tomp3') == {}
+    assert WatchJobs(table.path, attempts=2).add('/in/a.mp4', 'tomp3', 20, 2, ['/out/a.mp3'])
+
+
+@requires_ffmpeg
+def test_watch_and_restart(tmp_path, mode):
+    (tmp_path / 'in').mkdir()
+    # files are moved in when written, as a finished download
+    for name in ('a', 'b'):
+        os.replace(make_video(tmp_path / '{}.mp4'.format(name), duration=2), str(tmp_path / 'in' / '{}.mp4'.format(name)))
+    outfiles = [str(tmp_path / 'out' / '{}.mp3'.format(name)) for name in ('a', 'b')]
+    watch(make_watcher(tmp_path), lambda: all(os.path.exists(outfile) for outfile in outfiles))
+    assert sorted(os.listdir(str(tmp_path / 'out'))) == ['a.mp3', 'b.mp3']
+    mtimes = [os.stat(outfile).st_mtime_ns for outfile in outfiles]
+
+    # after a restart only a new file is converted
+    os.replace(make_video(tmp_path / 'c.mp4', duration=2), str(tmp_path / 'in' / 'c.mp4'))
+    watcher = make_watcher(tmp_path)
+    watch(watcher, lambda: os.path.exists(str(tmp_path / 'out' / 'c.mp3')))
+    assert os.path.exists(str(tmp_path / 'out' / 'c.mp3'))
+    assert [os.stat(outfile).st_mtime_ns for outfile in outfiles] == mtimes
+    assert sorted(watcher.table.get_finished(watcher.key)) == [str(tmp_path / 'in' / '{}.mp4'.format(name)) for name in 'abc']
+
+
+@requires_ffmpeg
+def test_watch_retries_failed(tmp_path, mode):
+    (tmp_path / 'in').mkdir()
+    (tmp_path / 'in' / 'broken.mp4').write_bytes(b'not a video')
+    watcher = make_watcher(tmp_path, attempts=2)
+    infile = str(tmp_path / 'in' / 'broken.mp4')
+    watch(watcher, lambda: infile in watcher.table.get_finished(watcher.key))
+    status, attempts = watcher.table._db.execute('SELECT status, attempts FROM jobs').fetchone()
+    assert (status, attempts) == ('failed', 2)
+    # given up: not done again after a restart until the file is changed
+    watcher = make_watcher(tmp_path, attempts=2)
+    watch(watcher, lambda: False, timeout=2)
+    assert watcher.table._db.execute('SELECT attempts FROM jobs').fetchone() == (2,)
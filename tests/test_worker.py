@@ -0,0 +1,111 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from conftest import make_video, requires_ffmpeg
+from ffeasytool import get_workqueue
+
+FFEASYTOOL = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'ffeasytool.py')
+
+# claims jobs until the queue is empty and prints their names: a worker process without ffmpeg
+CLAIMER = '''
+import sys
+sys.path.insert(0, sys.argv[1])
+from ffeasytool import get_workqueue
+queue = get_workqueue(sys.argv[2])
+worker = sys.argv[3]
+while True:
+    job = queue.claim(worker, 60)
+    if job is None:
+        break
+    print(job[1], flush=True)
+    queue.finish(job[0], worker, 'ok')
+'''
+
+# claims one job with a short lease and exits without finishing it: a crashed worker
+CRASHER = '''
+import sys
+sys.path.insert(0, sys.argv[1])
+from ffeasytool import get_workqueue
+print(get_workqueue(sys.argv[2]).claim('crashed', float(sys.argv[3]), int(sys.argv[4]))[1])
+'''
+
+
+@pytest.fixture(params=['queue.sqlite', 'queue'])
+def queuepath(request, tmp_path):
+    '''SqliteQueue and DirectoryQueue'''
+    return str(tmp_path / request.param)
+
+
+def run_script(script, *args):
+    return subprocess.Popen([sys.executable, '-c', script, os.path.dirname(FFEASYTOOL)] + list(args), stdout=subprocess.PIPE, universal_newlines=True)
+
+
+def test_single_claim(queuepath):
+    queue = get_workqueue(queuepath)
+    names = ['job{:03d}'.format(n) for n in range(60)]
+    for name in names:
+        queue.add(name, 'convert_to_mp3', {})
+    workers = [run_script(CLAIMER, queuepath, 'worker{}'.format(n)) for n in range(4)]
+    claimed = []
+    for worker in workers:
+        out, _ = worker.communicate(timeout=120)
+        assert worker.returncode == 0
+        claimed += out.split()
+    # every job is claimed by exactly one worker
+    assert sorted(claimed) == names
+    assert [job[1] for job in queue.get_jobs()] == ['ok'] * len(names)
+
+
+def test_lease_expiry_and_reclaim(queuepath):
+    queue = get_workqueue(queuepath)
+    queue.add('job', 'convert_to_mp3', {})
+    crashed = run_script(CRASHER, queuepath, '1', '3')
+    assert crashed.communicate(timeout=60)[0].strip() == 'job'
+    # the lease is not expired yet
+    assert queue.claim('worker', 60) is None
+    time.sleep(1.5)
+    jobid, name, operation, kwargs = queue.claim('worker', 60)
+    assert name == 'job'
+    # the result of the crashed worker would be dropped, the new one is stored
+    assert not queue.finish(jobid, 'crashed', 'ok')
+    assert queue.finish(jobid, 'worker', 'ok', seconds=1.0)
+    assert queue.get_jobs() == [('job', 'ok', '', 1.0)]
+
+
+def test_attempts_limit(queuepath):
+    queue = get_workqueue(queuepath)
+    queue.add('job', 'convert_to_mp3', {})
+    for n in range(2):
+        crashed = run_script(CRASHER, queuepath, '0.5', '2')
+        assert crashed.communicate(timeout=60)[0].strip() == 'job'
+        time.sleep(1.0)
+    # claimed twice, both leases expired
+    assert queue.claim('worker', 60, attempts=2) is None
+    assert [job[:3] for job in queue.get_jobs()] == [('job', 'failed', 'lease expired 2 times')]
+    assert queue.count_unfinished() == 0
+
+
+@requires_ffmpeg
+def test_worker_processes(tmp_path, queuepath):
+    indir = tmp_path / 'in'
+    outdir = tmp_path / 'out'
+    indir.mkdir()
+    outdir.mkdir()
+    files = [make_video(indir / 'in{}.mp4'.format(n), duration=2) for n in range(6)]
+    subprocess.run([sys.executable, FFEASYTOOL, 'enqueue', '--queue', queuepath, '--op', 'tomp3', '-o', str(outdir)] + files, check=True, stdout=subprocess.PIPE)
+    # a worker crashed with the first job: it is done again when its lease expires
+    run_script(CRASHER, queuepath, '1', '3').communicate(timeout=60)
+    workers = [subprocess.Popen([sys.executable, FFEASYTOOL, 'worker', '--queue', queuepath, '-j', '1', '--interval', '0.2']
+                                , stdout=subprocess.PIPE, universal_newlines=True) for n in range(3)]
+    done = []
+    for worker in workers:
+        out, _ = worker.communicate(timeout=300)
+        assert worker.returncode == 0
+        done += [line for line in out.splitlines() if line.startswith('[ok]')]
+    assert len(done) == len(files)
+    assert [job[1] for job in get_workqueue(queuepath).get_jobs()] == ['ok'] * len(files)
+    assert sorted(os.listdir(str(outdir))) == ['.ffeasytool-manifest.json'] + ['in{}.mp3'.format(n) for n in range(6)]